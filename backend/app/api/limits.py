@@ -0,0 +1,37 @@
+from typing import Iterable
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Boundaries + form fields (company / year / quarter) của multipart upload, ngoài chính file
+MULTIPART_OVERHEAD = 1024 * 1024
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Từ chối upload quá lớn theo header Content-Length (413) trước khi đọc body.
+
+    Không có middleware này, FastAPI spool cả multipart body ra file tạm trước khi handler chạy,
+    nên kiểm tra trong _receive_upload chỉ tiết kiệm được phần copy sang UPLOAD_DIR.
+    Body chunked (không Content-Length) vẫn bị chặn khi đọc trong _receive_upload.
+    Giới hạn cứng nằm ở reverse proxy: client_max_body_size trong frontend/nginx.conf.
+    """
+
+    def __init__(self, app: ASGIApp, paths: Iterable[str], max_bytes: int):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in self.paths:
+            headers = dict(scope["headers"])
+            content_length = headers.get(b"content-length", b"").decode("latin-1")
+            if content_length.isdigit() and int(content_length) > self.max_bytes + MULTIPART_OVERHEAD:
+                response = JSONResponse(
+                    status_code=413,
+                    content={"detail": f"File exceeds the {self.max_bytes // (1024 * 1024)} MB upload limit."},
+                    headers={"Connection": "close"},
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
@@ -0,0 +1,9 @@
+import json
+
+# Comment line (bỏ qua phía client) giữ kết nối SSE qua proxy khi lâu không có event
+KEEPALIVE = ": keepalive\n\n"
+
+
+def format_event(event: str, data: dict) -> str:
+    """1 Server-Sent Event: `event:` + JSON `data:`."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
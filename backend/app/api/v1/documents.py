@@ -1,61 +1,96 @@
+import asyncio
+import hashlib
 import json
 import os
 import uuid
 from datetime import datetime
-from typing import List
+from typing import List, Optional, Tuple
 
-import redis
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 import aiofiles
 
+from backend.app.api.sse import KEEPALIVE, format_event
+from backend.app.config import get_settings
+from backend.app.core.clients import get_async_redis
+from backend.app.core.document_registry import STATUSES, DocumentRegistry, identity_key
+from backend.app.core.ingestion.checkpoints import CheckpointStore
+from backend.app.core.ingestion.progress import TERMINAL_STATUSES, events_channel
 from backend.app.models.document import(
     DocumentListItem, 
     DocumentResponse, 
     DocumentStatusResponse, 
 )
-from backend.app.workers.tasks import process_document_task
+from backend.app.workers.tasks import ingest_document
+
+settings = get_settings()
 
 router = APIRouter()
 
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# Redis-backed doc store — shared between FastAPI and Celery worker
-_redis = redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), decode_responses=True)
-DOC_KEY = "doc:{}"
-DOCS_SET_KEY = "docs:all"
+# Redis-backed doc store (hashes + sorted-set indexes) — shared between FastAPI and Celery worker
+registry = DocumentRegistry()
+PDF_MAGIC = b"%PDF-"
+EVENTS_KEEPALIVE_SECONDS = 15
 
 
-def _get_doc(doc_id: str):
-    raw = _redis.get(DOC_KEY.format(doc_id))
-    if not raw:
-        return None
-    return json.loads(raw)
+async def _receive_upload(file: UploadFile) -> Tuple[str, str, int]:
+    """
+    Copy upload vào file tạm trong UPLOAD_DIR theo từng chunk cố định, hash sha256 trên đường đi
+    → RAM mỗi upload không phụ thuộc kích thước file.
+    Kiểm tra magic bytes ở chunk đầu và giới hạn max_upload_mb; lỗi → xóa file tạm.
+    Upload có Content-Length quá lớn đã bị UploadSizeLimitMiddleware trả 413 trước khi đọc body;
+    kiểm tra ở đây bắt body chunked. Giới hạn cứng: client_max_body_size (frontend/nginx.conf).
 
+    Returns:
+        (tmp_path, sha256 hex, size in bytes)
+    """
+    max_bytes = settings.max_upload_mb * 1024 * 1024
+    tmp_path = os.path.join(UPLOAD_DIR, f".upload-{uuid.uuid4().hex}.part")
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out:
+            while chunk := await file.read(settings.upload_chunk_size):
+                if size == 0 and not chunk.startswith(PDF_MAGIC):
+                    raise HTTPException(status_code=400, detail="File is not a valid PDF.")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File exceeds the {settings.max_upload_mb} MB upload limit.",
+                    )
+                hasher.update(chunk)
+                await out.write(chunk)
+        if size == 0:
+            raise HTTPException(status_code=400, detail="Uploaded file is empty.")
+    except BaseException:
+        _discard(tmp_path)
+        raise
+    return tmp_path, hasher.hexdigest(), size
 
-def _save_doc(doc: dict):
-    doc_id = doc["doc_id"]
-    # Convert datetime to string for JSON
-    d = dict(doc)
-    if isinstance(d.get("created_at"), datetime):
-        d["created_at"] = d["created_at"].isoformat()
-    _redis.set(DOC_KEY.format(doc_id), json.dumps(d))
-    _redis.sadd(DOCS_SET_KEY, doc_id)
 
+def _discard(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
 
-def _delete_doc(doc_id: str):
-    _redis.delete(DOC_KEY.format(doc_id))
-    _redis.srem(DOCS_SET_KEY, doc_id)
 
+def _already_uploaded(doc: dict) -> DocumentResponse:
+    return DocumentResponse(
+        doc_id=doc["doc_id"],
+        filename=doc["filename"],
+        company=doc["company"],
+        year=doc["year"],
+        quarter=doc.get("quarter"),
+        status=doc["status"],
+        created_at=doc["created_at"],
+        message=f"Document already uploaded. Track with doc_id: {doc['doc_id']}",
+    )
 
-def _all_docs():
-    ids = _redis.smembers(DOCS_SET_KEY)
-    docs = []
-    for doc_id in ids:
-        d = _get_doc(doc_id)
-        if d:
-            docs.append(d)
-    return docs
 
 @router.post("/upload", response_model=DocumentResponse)
 async def upload_document(
@@ -64,17 +99,69 @@ async def upload_document(
     year: int = Form(...),
     quarter: str = Form(None),
 ):
-    """Upload PDF and kick off Celery ingestion task."""
+    """
+    Upload PDF and kick off Celery ingestion task.
+
+    File được stream vào file tạm (hash + kiểm tra PDF/size trong lúc copy),
+    chỉ os.replace vào UPLOAD_DIR khi là upload mới → không có file ghi dở.
+
+    Idempotent theo nội dung file:
+    - Cùng file (sha256) đã upload → trả doc_id cũ, không enqueue lại
+    - Cùng (company, year, quarter, filename) nhưng nội dung khác → phiên bản mới,
+      dùng lại doc_id để pipeline chỉ upsert chunks thay đổi và xóa chunks cũ.
+      Phiên bản trước chưa xử lý xong (pending / processing / retrying) → 409
+    """
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed.")
-    
-    doc_id = str(uuid.uuid4())
+
+    tmp_path, file_hash, file_size = await _receive_upload(file)
+    try:
+        return await _register_upload(file, company, year, quarter, tmp_path, file_hash, file_size)
+    finally:
+        # Đã os.replace vào chỗ → không còn gì để xóa; dedupe / lỗi → bỏ file tạm
+        _discard(tmp_path)
+
+
+async def _register_upload(
+    file: UploadFile,
+    company: str,
+    year: int,
+    quarter: str,
+    tmp_path: str,
+    file_hash: str,
+    file_size: int,
+) -> DocumentResponse:
+    existing = await registry.find_by_hash(file_hash)
+    if existing:
+        return _already_uploaded(existing)
+
+    name_key = identity_key(company, year, quarter, file.filename)
+    doc_id = await registry.doc_id_for_identity(name_key)
+    previous = await registry.get(doc_id) if doc_id else None
+    if previous is None:
+        doc_id = str(uuid.uuid4())
+    elif previous["status"] not in TERMINAL_STATUSES:
+        # Phiên bản mới dùng lại doc_id → checkpoints của chain đang chạy sẽ bị parse stage xoá
+        raise HTTPException(
+            status_code=409,
+            detail=f"Previous version is still {previous['status']}. Retry once doc_id {doc_id} has finished.",
+        )
+    elif previous.get("file_hash"):
+        await registry.release_hash(previous["file_hash"])
+
+    # SET NX: 2 uploads đồng thời cùng file → chỉ 1 request enqueue
+    if not await registry.claim_hash(file_hash, doc_id):
+        existing = await registry.find_by_hash(file_hash)
+        if existing:
+            return _already_uploaded(existing)
+        await registry.set_hash(file_hash, doc_id)
+    await registry.set_identity(name_key, doc_id)
+
     safe_filename = f"{doc_id}_{file.filename}"
     file_path = os.path.join(UPLOAD_DIR, safe_filename)
 
-    async with aiofiles.open(file_path, 'wb') as f:
-        content = await file.read()
-        await f.write(content)
+    # Cùng filesystem với file tạm → rename atomic, worker không bao giờ thấy file ghi dở
+    os.replace(tmp_path, file_path)
 
     metadata = {
         "company": company, 
@@ -85,7 +172,7 @@ async def upload_document(
     }
 
     now = datetime.utcnow()
-    _save_doc({
+    await registry.create({
         "doc_id": doc_id,
         "filename": file.filename,
         "company": company,
@@ -98,10 +185,13 @@ async def upload_document(
         "image_chunks": 0,
         "created_at": now,
         "error": None,
+        "file_hash": file_hash,
+        "file_size": file_size,
     })
 
-    process_document_task.delay(doc_id, file_path, metadata)
+    ingest_document(doc_id, file_path, metadata)
 
+    action = "New version uploaded" if previous else "Uploaded"
     return DocumentResponse(
         doc_id=doc_id,
         filename=file.filename,
@@ -110,28 +200,41 @@ async def upload_document(
         quarter=quarter,
         status="pending",
         created_at=now,
-        message=f"Uploaded. Processing started. Track with doc_id: {doc_id}",
+        message=f"{action}. Processing started. Track with doc_id: {doc_id}",
     )
 
 @router.get("/", response_model=List[DocumentListItem])
-async def list_documents():
-    return [DocumentListItem(**doc) for doc in _all_docs()]
+async def list_documents(
+    response: Response,
+    status: Optional[str] = Query(None, description=" | ".join(STATUSES)),
+    company: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+):
+    """Documents mới nhất trước; tổng số documents khớp filter trong header X-Total-Count."""
+    if status is not None and status not in STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(STATUSES)}")
+    docs, total = await registry.list(status=status, company=company, limit=limit, offset=offset)
+    response.headers["X-Total-Count"] = str(total)
+    return [DocumentListItem(**doc) for doc in docs]
 
 @router.get("/{doc_id}", response_model=DocumentListItem)
 async def get_document(doc_id: str):
-    doc = _get_doc(doc_id)
+    doc = await registry.get(doc_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     return DocumentListItem(**doc)
 
 @router.get("/{doc_id}/status", response_model=DocumentStatusResponse)
 async def get_document_status(doc_id: str):
-    doc = _get_doc(doc_id)
+    doc = await registry.get(doc_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     return DocumentStatusResponse(
         doc_id=doc_id,
         status=doc["status"],
+        progress=doc.get("progress"),
+        progress_percent=doc.get("progress_percent"),
         total_chunks=doc["total_chunks"],
         text_chunks=doc["text_chunks"],
         table_chunks=doc["table_chunks"],
@@ -139,34 +242,87 @@ async def get_document_status(doc_id: str):
         error=doc.get("error"),
     )
 
-@router.delete("/{doc_id}")
-async def delete_document(doc_id: str):
-    doc = _get_doc(doc_id)
-    if not doc:
+@router.get("/{doc_id}/events")
+async def document_events(doc_id: str, http_request: Request):
+    """
+    Tiến độ ingestion qua Server-Sent Events (thay cho polling /status).
+
+    Events:
+        event: status   → snapshot ngay khi kết nối, sau đó mỗi lần status đổi
+        event: progress → {"stage": "embed", "done": 120, "total": 300, "percent": 61, "message": "..."}
+
+    Nguồn: Redis pub/sub `document:{doc_id}:events` (ProgressReporter trong Celery worker).
+    Stream tự đóng sau status completed / failed.
+    """
+    if await registry.get(doc_id) is None:
         raise HTTPException(status_code=404, detail="Document not found")
 
+    async def event_generator():
+        pubsub = get_async_redis().pubsub()
+        try:
+            # Subscribe trước khi đọc snapshot → không lỡ event nào ở giữa
+            await pubsub.subscribe(events_channel(doc_id))
+            doc = await registry.get(doc_id)
+            if doc is None:
+                return
+            yield format_event("status", _status_event(doc))
+            if doc["status"] in TERMINAL_STATUSES:
+                return
+
+            while not await http_request.is_disconnected():
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=EVENTS_KEEPALIVE_SECONDS)
+                if message is None:
+                    yield KEEPALIVE
+                    continue
+                event = json.loads(message["data"])
+                yield format_event(event["type"], event)
+                if event["type"] == "status" and event["status"] in TERMINAL_STATUSES:
+                    return
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+def _status_event(doc: dict) -> dict:
+    percent = 100 if doc["status"] == "completed" else doc.get("progress_percent") or 0
+    return {
+        "type": "status",
+        "doc_id": doc["doc_id"],
+        "status": doc["status"],
+        "percent": percent,
+        "message": doc.get("progress") or doc["status"],
+        "total_chunks": doc.get("total_chunks", 0),
+        "error": doc.get("error"),
+    }
+
+def _delete_document_data(doc: dict):
+    from backend.app.core.generation.answer_cache import AnswerCache
     from backend.app.core.retrieval.qdrant_client import QdrantClientWrapper
+
+    doc_id = doc["doc_id"]
     qdrant = QdrantClientWrapper()
     qdrant.delete_by_doc_id(doc_id)
+    AnswerCache.invalidate(qdrant.client, doc)
 
-    file_path = os.path.join(UPLOAD_DIR, f"{doc_id}_{doc['filename']}")
-    if os.path.exists(file_path):
-        os.remove(file_path)
-
-    _delete_doc(doc_id)
-    return {"message": f"Document {doc_id} deleted successfully"}
+    _discard(os.path.join(UPLOAD_DIR, f"{doc_id}_{doc['filename']}"))
+    CheckpointStore(doc_id).clear()
 
-def update_doc_status(doc_id: str, status: str, result: dict = None, error: str = None):
-    """Call from Celery task to update document status in Redis."""
-    doc = _get_doc(doc_id)
+@router.delete("/{doc_id}")
+async def delete_document(doc_id: str):
+    doc = await registry.get(doc_id)
     if not doc:
-        return
-    doc["status"] = status
-    if error:
-        doc["error"] = error
-    if result:
-        doc["total_chunks"] = result.get("total_chunks", 0)
-        doc["text_chunks"] = result.get("text_chunks", 0)
-        doc["table_chunks"] = result.get("table_chunks", 0)
-        doc["image_chunks"] = result.get("image_chunks", 0)
-    _save_doc(doc)
\ No newline at end of file
+        raise HTTPException(status_code=404, detail="Document not found")
+
+    # Qdrant client sync + xóa file / checkpoints → thread, không chặn event loop (SSE, requests khác)
+    await asyncio.to_thread(_delete_document_data, doc)
+    await registry.delete(doc_id)
+    return {"message": f"Document {doc_id} deleted successfully"}
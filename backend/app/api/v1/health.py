@@ -1,8 +1,7 @@
 from fastapi import APIRouter
-from qdrant_client import QdrantClient
-import redis as redis_lib
 
 from backend.app.config import get_settings
+from backend.app.core.clients import get_async_qdrant, get_async_redis
 
 router = APIRouter()
 settings = get_settings()
@@ -16,8 +15,7 @@ async def health_check():
 @router.get("/qdrant")
 async def qdrant_health():
     try:
-        client = QdrantClient(host=settings.qdrant_host, port=settings.qdrant_port)
-        collections = client.get_collections()
+        collections = await get_async_qdrant().get_collections()
         return {
             "status": "connected",
             "collections": [c.name for c in collections.collections],
@@ -29,8 +27,21 @@ async def qdrant_health():
 @router.get("/redis")
 async def redis_health():
     try:
-        r = redis_lib.from_url(settings.redis_url)
-        r.ping()
+        await get_async_redis().ping()
         return {"status": "connected", "url": settings.redis_url}
     except Exception as e:
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        return {"status": "error", "message": str(e)}
+
+@router.get("/embedding-cache")
+async def embedding_cache_health():
+    """Hit-rate + Redis memory của embedding cache — dùng để sizing maxmemory/TTL."""
+    try:
+        from backend.app.core.retrieval.embedding_cache import EmbeddingCache
+        from backend.app.core.retrieval.retriever import query_vector_cache
+        return {
+            "status": "connected",
+            **(await EmbeddingCache().stats()),
+            "query_vector_cache": query_vector_cache.stats(),
+        }
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
@@ -1,7 +1,9 @@
-from fastapi import APIRouter, HTTPException
+from contextlib import aclosing
+
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
-import json
 
+from backend.app.api.sse import format_event
 from backend.app.models.query import QueryRequest, QueryResponse
 from backend.app.core.generation.rag_engine import RAGEngine
 
@@ -10,21 +12,25 @@ router = APIRouter()
 rag_engine = RAGEngine()
 
 
+def _build_filters(request: QueryRequest):
+    """Build filters từ request nếu có (company/year/quarter)."""
+    filters = {}
+    if request.company:
+        filters["company"] = request.company
+    if request.year:
+        filters["year"] = request.year
+    if request.quarter:
+        filters["quarter"] = request.quarter
+    return filters if filters else None
+
+
 @router.post("/", response_model=QueryResponse)
 async def query(request: QueryRequest):
     """
     RAG Query endpoint — multi-collection với auto filter từ company/year/quarter.
     """
     try:
-        # Build filters từ request nếu có
-        filters = {}
-        if request.company:
-            filters["company"] = request.company
-        if request.year:
-            filters["year"] = request.year
-        if request.quarter:
-            filters["quarter"] = request.quarter
-        filters = filters if filters else None
+        filters = _build_filters(request)
 
         result = await rag_engine.query(
             question=request.question,
@@ -35,36 +41,43 @@ async def query(request: QueryRequest):
             answer=result["answer"],
             sources=result["sources"],
             question=request.question,
+            context_stats=result.get("context_stats"),
+            cached=result.get("cached", False),
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/stream")
-async def query_stream(request: QueryRequest):
+async def query_stream(request: QueryRequest, http_request: Request):
     """
     Streaming RAG response (Server-Sent Events).
     Frontend nhận từng token như ChatGPT.
+
+    Events:
+        event: sources → {"sources": [...]}  (citations, gửi trước tokens)
+        event: token   → {"token": "..."}
+        event: done    → {"timings": {...}, "context": {"tokens_saved": ..., ...}, "cached": bool}
+        event: error   → {"error": "..."}
+
+    Câu hỏi đã có trong answer cache → cùng events, sources + answer gửi ngay không qua LLM.
+    Client disconnect → dừng generation (đóng OpenAI stream) thay vì chạy tiếp đến hết.
     """
     async def event_generator():
         try:
-            filters = {}
-            if request.company:
-                filters["company"] = request.company
-            if request.year:
-                filters["year"] = request.year
-            filters = filters if filters else None
-
-            async for token in rag_engine.stream_query(
+            stream = rag_engine.stream_query(
                 question=request.question,
                 top_k=request.top_k,
-                filters=filters,
-            ):
-                yield f"data: {json.dumps({'token': token})}\n\n"
-
-            yield "data: [DONE]\n\n"
+                filters=_build_filters(request),
+            )
+            async with aclosing(stream):
+                async for event in stream:
+                    if await http_request.is_disconnected():
+                        print("[Query] Client disconnected, cancelling generation")
+                        return
+                    yield format_event(event["event"], event["data"])
         except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield format_event("error", {"error": str(e)})
 
     return StreamingResponse(
         event_generator(),
@@ -82,7 +95,7 @@ async def find_similar(request: QueryRequest):
     try:
         from backend.app.core.retrieval.retriever import MultiCollectionRetriever
         retriever = MultiCollectionRetriever()
-        chunks = retriever.retrieve(question=request.question, top_k_text=3, top_k_table=5, top_k_image=2)
+        chunks = await retriever.retrieve(question=request.question, top_k_text=3, top_k_table=5, top_k_image=2)
         return {"question": request.question, "results": chunks}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Dict, List, Optional
 
 class Settings(BaseSettings):
     openai_api_key: str
@@ -8,15 +9,95 @@ class Settings(BaseSettings):
 
     qdrant_host: str = "localhost"
     qdrant_port: int = 6333
+    qdrant_grpc_port: int = 6334
+    qdrant_prefer_grpc: bool = True
+    qdrant_on_disk_payload: bool = True
+    hnsw_m: int = 16
+    hnsw_ef_construct: int = 128
+    # none | scalar (int8) | binary — vectors gốc chuyển xuống disk, bản quantized giữ trong RAM
+    qdrant_quantization: str = "none"
+    search_oversampling: float = 2.0     # lấy limit * oversampling ứng viên quantized rồi rescore
+    search_rescore: bool = True
 
-    redis_url: str = "redis://localhost:6379/0"
+    # Hybrid retrieval: dense + BM25 sparse (vector "bm25"), gộp bằng RRF phía Qdrant.
+    # Opt-in: collections tạo trước schema v3 cần rebuild (scripts/migrate_dims.py --rebuild)
+    hybrid_search: bool = False
+    hybrid_prefetch: int = 4             # mỗi nhánh lấy limit * hybrid_prefetch ứng viên trước khi fuse
+    bm25_k1: float = 1.2
+    bm25_b: float = 0.75
+    bm25_avg_doc_len: float = 250        # tokens (kể cả bigrams) trung bình / chunk
+    search_timeout: float = 3.0      # per-collection timeout (giây)
+
+    redis_url: str = "redis://localhost:6379/0"          # Celery broker / results + DocumentRegistry: noeviction
+    # Redis riêng cho caches (embedding / caption) với maxmemory + LRU; None → dùng redis_url
+    cache_redis_url: Optional[str] = None
 
     embedding_model: str = "text-embedding-3-small"
+    embedding_dim: int = 1536                # < 1536: Matryoshka shortening (text-embedding-3-*)
+    embedding_backend: str = "openai"        # openai | local (offline stand-in cho tests)
+    embedding_batch_tokens: int = 100_000
+    embedding_concurrency: int = 4
+    embedding_max_retries: int = 5
+    embedding_cache_enabled: bool = True
+    embedding_cache_ttl: int = 30 * 24 * 3600
+    query_vector_cache_size: int = 1024
     llm_model: str = "gpt-4o-mini"
 
+    # Context packing trước khi gọi LLM
+    context_token_budget: int = 3000         # tokens tối đa cho phần context trong prompt
+    context_dedup_threshold: float = 0.8     # Jaccard (word shingles) ≥ ngưỡng → coi là trùng
+    context_table_max_rows: int = 15
+    context_table_max_cols: int = 6
+
+    # Semantic answer cache (Qdrant collection answer_cache)
+    answer_cache_enabled: bool = True
+    answer_cache_threshold: float = 0.95     # cosine tối thiểu giữa 2 câu hỏi để dùng lại câu trả lời
+    answer_cache_ttl: int = 7 * 24 * 3600
+
+    # Tên công ty chuẩn → aliases, dùng cho rule-based QueryAnalyzer.analyze_local
+    company_aliases: Dict[str, List[str]] = {"Vinamilk": ["vnm", "vinamilk"]}
+
+    openai_max_connections: int = 20
+    openai_timeout: float = 60.0
+
+    max_upload_mb: int = 200                 # khớp client_max_body_size trong frontend/nginx.conf
+    upload_chunk_size: int = 1024 * 1024     # bytes đọc/ghi/hash mỗi lần khi nhận upload
+
     chunk_size: int = 1024
     chunk_overlap: int = 200
 
+    parse_language: str = "vi"
+    parse_cache_enabled: bool = True
+    parse_cache_dir: str = "cache/parse"
+    parse_cache_max_mb: int = 1024
+
+    # Kết quả trung gian của ingestion stages (Celery chain) — phải dùng chung giữa workers mọi queues.
+    # Mặc định tương đối (workers chạy trên 1 host, cùng cwd); docker-compose mount volume `checkpoints`
+    # ở /checkpoints cho backend + worker. Workers nhiều hosts → đường dẫn tuyệt đối trên shared storage (NFS...)
+    checkpoint_dir: str = "cache/checkpoints"
+
+    upsert_batch_size: int = 256     # points / request
+    upsert_parallel: int = 4         # requests in-flight cùng lúc
+
+    extract_stage_concurrency: int = 2     # documents / extract stage / process (dùng chung mọi pipeline)
+    extract_stage_timeout: float = 600
+
+    vision_backend: str = "gemini"           # gemini | local (offline stand-in cho tests)
+    vision_model: str = "gemini-2.0-flash-exp"
+    caption_concurrency: int = 8
+    caption_rate_per_sec: float = 4.0        # token bucket: requests/giây trung bình
+    caption_burst: int = 8
+    caption_max_retries: int = 5
+    caption_cache_enabled: bool = True
+    caption_cache_ttl: int = 90 * 24 * 3600
+
+    # Pre-filter ảnh trước khi caption (pixels / Shannon entropy bits / Hamming distance dHash 64-bit)
+    image_min_width: int = 120
+    image_min_height: int = 80
+    image_max_aspect_ratio: float = 6.0
+    image_min_entropy: float = 3.0
+    image_dup_distance: int = 4
+
     debug: bool = False
 
     class Config:
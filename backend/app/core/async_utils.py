@@ -0,0 +1,65 @@
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Optional, Tuple, Type, TypeVar
+
+T = TypeVar("T")
+
+
+async def retry_with_backoff(
+    fn: Callable[[], Awaitable[T]],
+    retry_on: Tuple[Type[BaseException], ...],
+    max_retries: int = 5,
+    base_delay: float = 0.5,
+    max_delay: float = 30.0,
+    label: str = "retry",
+    retry_after: Optional[Callable[[BaseException], Optional[float]]] = None,
+) -> T:
+    """
+    Gọi fn(), retry khi gặp exception trong retry_on với exponential backoff + full jitter.
+
+    Args:
+        fn: Coroutine factory (gọi lại mỗi lần retry)
+        retry_on: Exception types được retry (rate limit, timeout, 5xx...)
+        max_retries: Số lần retry tối đa (không tính lần gọi đầu)
+        base_delay / max_delay: Giới hạn delay (giây) cho backoff
+        retry_after: Optional hàm đọc delay server gợi ý (vd header Retry-After)
+    """
+    attempt = 0
+    while True:
+        try:
+            return await fn()
+        except retry_on as e:
+            attempt += 1
+            if attempt > max_retries:
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            hinted = retry_after(e) if retry_after else None
+            if hinted:
+                delay = max(delay, min(hinted, max_delay))
+            print(f"[{label}] {type(e).__name__}, retry {attempt}/{max_retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+class TokenBucket:
+    """
+    Async token-bucket rate limiter: trung bình `rate` lần/giây, burst tối đa `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
@@ -0,0 +1,83 @@
+import asyncio
+import weakref
+from typing import Dict, Tuple
+
+import httpx
+import redis.asyncio as aioredis
+from openai import AsyncOpenAI
+from qdrant_client import AsyncQdrantClient
+
+from backend.app.config import get_settings
+
+settings = get_settings()
+
+# 1 pooled client cho mỗi event loop: httpx connection pool gắn với loop tạo ra nó,
+# nên Celery (mỗi task 1 loop) và FastAPI (1 loop) đều dùng lại được an toàn.
+_openai_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+
+
+def get_async_openai() -> AsyncOpenAI:
+    """Shared AsyncOpenAI client (keep-alive connection pool) cho event loop hiện tại."""
+    loop = asyncio.get_running_loop()
+    client = _openai_clients.get(loop)
+    if client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.openai_max_connections,
+                max_keepalive_connections=settings.openai_max_connections,
+            ),
+            timeout=httpx.Timeout(settings.openai_timeout, connect=10.0),
+        )
+        client = AsyncOpenAI(api_key=settings.openai_api_key, http_client=http_client)
+        _openai_clients[loop] = client
+    return client
+
+
+_redis_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, bool], aioredis.Redis]]" = weakref.WeakKeyDictionary()
+
+
+def _redis(url: str, decode_responses: bool) -> aioredis.Redis:
+    loop = asyncio.get_running_loop()
+    clients = _redis_clients.setdefault(loop, {})
+    client = clients.get((url, decode_responses))
+    if client is None:
+        client = aioredis.from_url(url, decode_responses=decode_responses)
+        clients[(url, decode_responses)] = client
+    return client
+
+
+def get_async_redis(decode_responses: bool = True) -> aioredis.Redis:
+    """Shared async Redis client (connection pool) cho event loop hiện tại."""
+    return _redis(settings.redis_url, decode_responses)
+
+
+def get_async_cache_redis(decode_responses: bool = True) -> aioredis.Redis:
+    """
+    Redis cho caches (embedding / caption). Instance riêng được phép evict (allkeys-lru);
+    Celery results / chord counters và DocumentRegistry nằm ở redis_url (noeviction).
+    """
+    return _redis(settings.cache_redis_url or settings.redis_url, decode_responses)
+
+
+async def close_async_redis():
+    """Đóng mọi Redis clients của event loop hiện tại."""
+    for client in _redis_clients.pop(asyncio.get_running_loop(), {}).values():
+        await client.aclose()
+
+
+_qdrant_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncQdrantClient]" = weakref.WeakKeyDictionary()
+
+
+def get_async_qdrant() -> AsyncQdrantClient:
+    """Shared AsyncQdrantClient cho event loop hiện tại."""
+    loop = asyncio.get_running_loop()
+    client = _qdrant_clients.get(loop)
+    if client is None:
+        client = AsyncQdrantClient(
+            host=settings.qdrant_host,
+            port=settings.qdrant_port,
+            grpc_port=settings.qdrant_grpc_port,
+            prefer_grpc=settings.qdrant_prefer_grpc,
+        )
+        _qdrant_clients[loop] = client
+    return client
@@ -0,0 +1,219 @@
+import hashlib
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from redis.exceptions import WatchError
+
+from backend.app.core.clients import get_async_redis
+
+# Mỗi document là 1 Redis hash, field value JSON-encoded (giữ int / None đúng kiểu)
+DOC_KEY = "document:{}"
+# Sorted-set indexes, score = created_at (epoch) → listing mới nhất trước, phân trang bằng ZREVRANGE
+INDEX_ALL_KEY = "documents:by_created"
+INDEX_STATUS_KEY = "documents:status:{}"
+INDEX_COMPANY_KEY = "documents:company:{}"
+# Dedupe: sha256(file) → doc_id, và (company, year, quarter, filename) → doc_id
+DOC_HASH_KEY = "doc_hash:{}"
+DOC_NAME_KEY = "doc_name:{}"
+# Format cũ: JSON blob / document + set ids (migrate_legacy chuyển sang hashes)
+LEGACY_DOC_KEY = "doc:{}"
+LEGACY_DOCS_SET_KEY = "docs:all"
+
+STATUSES = ("pending", "processing", "retrying", "completed", "failed")
+
+
+def identity_key(company: str, year: int, quarter: Optional[str], filename: str) -> str:
+    identity = json.dumps([company.strip().lower(), year, (quarter or "").upper(), filename])
+    return DOC_NAME_KEY.format(hashlib.sha256(identity.encode("utf-8")).hexdigest())
+
+
+def company_key(company: str) -> str:
+    return INDEX_COMPANY_KEY.format(company.strip().lower())
+
+
+def _timestamp(created_at: Any) -> float:
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    return created_at.timestamp()
+
+
+def _encode(doc: Dict[str, Any]) -> Dict[str, str]:
+    return {
+        field: json.dumps(value.isoformat() if isinstance(value, datetime) else value, ensure_ascii=False)
+        for field, value in doc.items()
+    }
+
+
+def _decode(raw: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    if not raw:
+        return None
+    return {field: json.loads(value) for field, value in raw.items()}
+
+
+class DocumentRegistry:
+    """
+    Document metadata trong Redis (async client, dùng chung cho API và Celery worker).
+
+    - document:{id}                → hash; đổi status chỉ HSET vài fields, không ghi lại cả document
+    - documents:by_created         → zset tất cả documents
+    - documents:status:{status}    → zset theo status
+    - documents:company:{company}  → zset theo company (lowercase)
+    Listing = ZREVRANGE trên index phù hợp + 1 pipeline HGETALL cho cả trang (không N+1).
+    """
+
+    async def get(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        return _decode(await get_async_redis().hgetall(DOC_KEY.format(doc_id)))
+
+    async def get_many(self, doc_ids: List[str]) -> List[Dict[str, Any]]:
+        if not doc_ids:
+            return []
+        pipe = get_async_redis().pipeline(transaction=False)
+        for doc_id in doc_ids:
+            pipe.hgetall(DOC_KEY.format(doc_id))
+        return [doc for doc in map(_decode, await pipe.execute()) if doc]
+
+    async def create(self, doc: Dict[str, Any]):
+        """Ghi document + indexes trong 1 MULTI. Ghi đè document cùng doc_id (phiên bản mới)."""
+        previous = await self.get(doc["doc_id"])
+        score = _timestamp(doc["created_at"])
+        pipe = get_async_redis().pipeline(transaction=True)
+        if previous:
+            self._unindex(pipe, previous)
+        pipe.delete(DOC_KEY.format(doc["doc_id"]))
+        pipe.hset(DOC_KEY.format(doc["doc_id"]), mapping=_encode(doc))
+        pipe.zadd(INDEX_ALL_KEY, {doc["doc_id"]: score})
+        pipe.zadd(INDEX_STATUS_KEY.format(doc["status"]), {doc["doc_id"]: score})
+        pipe.zadd(company_key(doc["company"]), {doc["doc_id"]: score})
+        await pipe.execute()
+
+    async def update(self, doc_id: str, **fields: Any) -> bool:
+        """
+        HSET các fields thay đổi; đổi status → chuyển doc_id sang index status mới.
+        WATCH document hash: 2 stage workers đổi status cùng lúc → transaction sau bị hủy
+        và đọc lại status, doc_id không bao giờ nằm trong 2 status indexes.
+        """
+        key = DOC_KEY.format(doc_id)
+        async with get_async_redis().pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    current_status, created_at = await pipe.hmget(key, ["status", "created_at"])
+                    if current_status is None:
+                        await pipe.unwatch()
+                        return False
+
+                    pipe.multi()
+                    pipe.hset(key, mapping=_encode(fields))
+                    status = fields.get("status")
+                    if status is not None and status != json.loads(current_status):
+                        pipe.zrem(INDEX_STATUS_KEY.format(json.loads(current_status)), doc_id)
+                        pipe.zadd(INDEX_STATUS_KEY.format(status), {doc_id: _timestamp(json.loads(created_at))})
+                    await pipe.execute()
+                    return True
+                except WatchError:
+                    continue
+
+    async def delete(self, doc_id: str) -> Optional[Dict[str, Any]]:
+        doc = await self.get(doc_id)
+        if doc is None:
+            return None
+        pipe = get_async_redis().pipeline(transaction=True)
+        self._unindex(pipe, doc)
+        pipe.delete(DOC_KEY.format(doc_id))
+        if doc.get("file_hash"):
+            pipe.delete(DOC_HASH_KEY.format(doc["file_hash"]))
+        if doc.get("filename"):
+            pipe.delete(identity_key(doc["company"], doc["year"], doc.get("quarter"), doc["filename"]))
+        await pipe.execute()
+        return doc
+
+    @staticmethod
+    def _unindex(pipe, doc: Dict[str, Any]):
+        pipe.zrem(INDEX_ALL_KEY, doc["doc_id"])
+        pipe.zrem(INDEX_STATUS_KEY.format(doc["status"]), doc["doc_id"])
+        pipe.zrem(company_key(doc["company"]), doc["doc_id"])
+
+    async def list(
+        self,
+        status: Optional[str] = None,
+        company: Optional[str] = None,
+        limit: int = 100,
+        offset: int = 0,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Trang documents mới nhất trước, lọc theo status / company phía Redis.
+
+        Returns:
+            (docs, total) — total = số documents khớp filter (cho X-Total-Count)
+        """
+        client = get_async_redis()
+        keys = []
+        if status:
+            keys.append(INDEX_STATUS_KEY.format(status))
+        if company:
+            keys.append(company_key(company))
+
+        if len(keys) == 2:
+            # Cả 2 filters: ZINTER (score giữ nguyên created_at), phân trang phía app
+            ids = list(reversed(await client.zinter(keys, aggregate="MAX")))
+            total, ids = len(ids), ids[offset:offset + limit]
+        else:
+            key = keys[0] if keys else INDEX_ALL_KEY
+            pipe = client.pipeline(transaction=False)
+            pipe.zcard(key)
+            pipe.zrevrange(key, offset, offset + limit - 1)
+            total, ids = await pipe.execute()
+        return await self.get_many(ids), total
+
+    # ── Dedupe keys ────────────────────────────────────────────────
+
+    async def find_by_hash(self, file_hash: str) -> Optional[Dict[str, Any]]:
+        """Document đã upload với cùng nội dung (bỏ qua bản failed để cho phép upload lại)."""
+        doc_id = await get_async_redis().get(DOC_HASH_KEY.format(file_hash))
+        if not doc_id:
+            return None
+        doc = await self.get(doc_id)
+        if not doc or doc.get("status") == "failed":
+            return None
+        return doc
+
+    async def claim_hash(self, file_hash: str, doc_id: str) -> bool:
+        """SET NX: 2 uploads đồng thời cùng file → chỉ 1 request thắng."""
+        return bool(await get_async_redis().set(DOC_HASH_KEY.format(file_hash), doc_id, nx=True))
+
+    async def set_hash(self, file_hash: str, doc_id: str):
+        await get_async_redis().set(DOC_HASH_KEY.format(file_hash), doc_id)
+
+    async def release_hash(self, file_hash: str):
+        await get_async_redis().delete(DOC_HASH_KEY.format(file_hash))
+
+    async def doc_id_for_identity(self, key: str) -> Optional[str]:
+        return await get_async_redis().get(key)
+
+    async def set_identity(self, key: str, doc_id: str):
+        await get_async_redis().set(key, doc_id)
+
+    # ── Migration ──────────────────────────────────────────────────
+
+    async def migrate_legacy(self) -> int:
+        """
+        Chuyển documents từ format cũ (doc:{id} JSON + set docs:all) sang hashes + indexes.
+        Idempotent: không còn key cũ → không làm gì.
+        """
+        client = get_async_redis()
+        doc_ids = sorted(await client.smembers(LEGACY_DOCS_SET_KEY))
+        if not doc_ids:
+            return 0
+        pipe = client.pipeline(transaction=False)
+        for doc_id in doc_ids:
+            pipe.get(LEGACY_DOC_KEY.format(doc_id))
+        migrated = 0
+        for doc_id, raw in zip(doc_ids, await pipe.execute()):
+            if raw:
+                await self.create(json.loads(raw))
+                migrated += 1
+            await client.delete(LEGACY_DOC_KEY.format(doc_id))
+            await client.srem(LEGACY_DOCS_SET_KEY, doc_id)
+        print(f"[DocumentRegistry] Migrated {migrated} legacy documents to hashes")
+        return migrated
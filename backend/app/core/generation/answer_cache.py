@@ -0,0 +1,239 @@
+import hashlib
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from qdrant_client import QdrantClient
+from qdrant_client.models import (
+    Distance,
+    FieldCondition,
+    Filter,
+    IsEmptyCondition,
+    MatchValue,
+    PayloadField,
+    PayloadSchemaType,
+    PointStruct,
+    Range,
+    VectorParams,
+)
+
+from backend.app.config import get_settings
+from backend.app.core.clients import get_async_qdrant
+from backend.app.core.retrieval.embedding_cache import normalize_text
+from backend.app.core.retrieval.schema import SCHEMA_VERSION
+
+settings = get_settings()
+
+ANSWER_COLLECTION = "answer_cache"
+FILTER_FIELDS = ("company", "year", "quarter")
+CACHE_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "the-smart-analyst/answers")
+
+ANSWER_INDEXES: Dict[str, PayloadSchemaType] = {
+    "scope": PayloadSchemaType.KEYWORD,
+    "corpus_version": PayloadSchemaType.KEYWORD,
+    "created_at": PayloadSchemaType.FLOAT,
+    "filter_keys.company": PayloadSchemaType.KEYWORD,
+    "filter_keys.quarter": PayloadSchemaType.KEYWORD,
+    "filter_keys.year": PayloadSchemaType.INTEGER,
+}
+
+
+def corpus_version(cache_model: str) -> str:
+    """Đổi embedding model/dim, schema, hybrid hay LLM → câu trả lời cũ không còn dùng được."""
+    mode = "hybrid" if settings.hybrid_search else "dense"
+    return f"{cache_model}:v{SCHEMA_VERSION}:{mode}:{settings.llm_model}"
+
+
+def filter_keys(values: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    company / year / quarter đã chuẩn hóa (company lowercase như DocumentRegistry.company_key,
+    quarter uppercase) → filters của entry và metadata của document so sánh được với nhau
+    dù request gửi "vinamilk" còn document lưu "Vinamilk".
+    """
+    keys = {}
+    for name in FILTER_FIELDS:
+        value = (values or {}).get(name)
+        if value is None or value == "":
+            continue
+        if name == "year":
+            keys[name] = int(value)
+        else:
+            value = " ".join(str(value).split())
+            keys[name] = value.lower() if name == "company" else value.upper()
+    return keys
+
+
+def cache_scope(filters: Optional[Dict], top_k: int, entities: Optional[Dict] = None) -> str:
+    """
+    Cùng câu hỏi nhưng khác filters / top_k → context khác → entry riêng.
+    entities (QueryAnalyzer.scope_entities): công ty / kỳ trong chính câu hỏi — đa số requests
+    không gửi filters, nên thiếu phần này thì "... Q3 2025" và "... Q4 2025" dùng chung entry.
+    """
+    key = json.dumps({"filters": filters or {}, "top_k": top_k, "entities": entities or {}}, sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+class AnswerCache:
+    """
+    Semantic answer cache trong Qdrant collection `answer_cache`.
+
+    Lookup = nearest neighbour của query vector (cosine ≥ threshold) trong cùng
+    scope (filters + top_k + công ty / kỳ trong câu hỏi) và corpus version → câu hỏi lặp lại hoặc diễn đạt lại
+    trả lời ngay, không analyzer / search / generation.
+
+    Invalidation: ingest hoặc xóa 1 document → xóa mọi entry có filters khớp với
+    metadata của document đó (kể cả entries không filter), xem invalidate().
+
+    Qdrant lỗi → coi như miss / bỏ qua, query vẫn chạy bình thường.
+    """
+
+    def __init__(
+        self,
+        cache_model: str,
+        threshold: Optional[float] = None,
+        ttl: Optional[int] = None,
+    ):
+        self.version = corpus_version(cache_model)
+        self.threshold = threshold or settings.answer_cache_threshold
+        self.ttl = ttl or settings.answer_cache_ttl
+        self.embedding_dim = settings.embedding_dim
+        self._ready = False
+
+    async def alookup(
+        self,
+        query_vector: List[float],
+        filters: Optional[Dict],
+        top_k: int,
+        entities: Optional[Dict] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Returns:
+            {"question", "answer", "sources", "context_stats", "similarity"} hoặc None
+        """
+        client = get_async_qdrant()
+        try:
+            if not await self._aensure(client):
+                return None
+            response = await client.query_points(
+                collection_name=ANSWER_COLLECTION,
+                query=query_vector,
+                query_filter=Filter(must=[
+                    FieldCondition(key="scope", match=MatchValue(value=cache_scope(filters, top_k, entities))),
+                    FieldCondition(key="corpus_version", match=MatchValue(value=self.version)),
+                    FieldCondition(key="created_at", range=Range(gte=time.time() - self.ttl)),
+                ]),
+                score_threshold=self.threshold,
+                limit=1,
+                with_payload=True,
+            )
+        except Exception as e:
+            print(f"[AnswerCache] Lookup failed: {e}")
+            return None
+        if not response.points:
+            return None
+        hit = response.points[0]
+        return {**hit.payload, "similarity": round(hit.score, 4)}
+
+    async def astore(
+        self,
+        question: str,
+        query_vector: List[float],
+        filters: Optional[Dict],
+        top_k: int,
+        answer: str,
+        sources: List[Dict],
+        context_stats: Optional[Dict] = None,
+        entities: Optional[Dict] = None,
+    ):
+        scope = cache_scope(filters, top_k, entities)
+        point_id = str(uuid.uuid5(CACHE_NAMESPACE, f"{self.version}:{scope}:{normalize_text(question)}"))
+        client = get_async_qdrant()
+        try:
+            if not await self._aensure(client, create=True):
+                return
+            await client.upsert(
+                collection_name=ANSWER_COLLECTION,
+                points=[PointStruct(
+                    id=point_id,
+                    vector=query_vector,
+                    payload={
+                        "question": question,
+                        "answer": answer,
+                        "sources": sources,
+                        "context_stats": context_stats,
+                        "filters": {k: v for k, v in (filters or {}).items() if k in FILTER_FIELDS},
+                        "filter_keys": filter_keys(filters),
+                        "scope": scope,
+                        "corpus_version": self.version,
+                        "created_at": time.time(),
+                    },
+                )],
+                wait=False,
+            )
+        except Exception as e:
+            print(f"[AnswerCache] Store failed: {e}")
+
+    async def _aensure(self, client, create: bool = False) -> bool:
+        """Collection tạo lười ở lần store đầu tiên; lookup trước đó = miss."""
+        if self._ready:
+            return True
+        if await client.collection_exists(ANSWER_COLLECTION):
+            info = await client.get_collection(ANSWER_COLLECTION)
+            if info.config.params.vectors.size == self.embedding_dim:
+                self._ready = True
+                return True
+            if not create:
+                return False
+            # Đổi EMBEDDING_DIM → cache cũ vô dụng, tạo lại
+            await client.delete_collection(ANSWER_COLLECTION)
+        elif not create:
+            return False
+
+        await client.create_collection(
+            collection_name=ANSWER_COLLECTION,
+            vectors_config=VectorParams(size=self.embedding_dim, distance=Distance.COSINE),
+            on_disk_payload=True,
+        )
+        for field_name, schema in ANSWER_INDEXES.items():
+            await client.create_payload_index(
+                collection_name=ANSWER_COLLECTION, field_name=field_name, field_schema=schema,
+            )
+        print(f"[AnswerCache] Created collection {ANSWER_COLLECTION} ({self.embedding_dim}-d)")
+        self._ready = True
+        return True
+
+    @staticmethod
+    def invalidate(client: QdrantClient, metadata: Dict[str, Any]) -> None:
+        """
+        Xóa entries có thể bị ảnh hưởng khi 1 document (company/year/quarter) thay đổi:
+        với mỗi filter field, entry không filter field đó hoặc filter đúng giá trị của document.
+        Entry filter company khác / năm khác giữ nguyên. So sánh trên filter_keys (đã chuẩn hóa);
+        entries cũ chưa có filter_keys bị coi như không filter → luôn bị xóa.
+        """
+        document = filter_keys(metadata)
+        conditions = []
+        for name in FILTER_FIELDS:
+            key = f"filter_keys.{name}"
+            unfiltered = IsEmptyCondition(is_empty=PayloadField(key=key))
+            value = document.get(name)
+            if value is None:
+                conditions.append(unfiltered)
+            else:
+                conditions.append(Filter(should=[unfiltered, FieldCondition(key=key, match=MatchValue(value=value))]))
+        try:
+            if not client.collection_exists(ANSWER_COLLECTION):
+                return
+            client.delete(collection_name=ANSWER_COLLECTION, points_selector=Filter(must=conditions))
+            # Dọn luôn entries hết hạn (lookup đã bỏ qua chúng)
+            client.delete(
+                collection_name=ANSWER_COLLECTION,
+                points_selector=Filter(must=[
+                    FieldCondition(key="created_at", range=Range(lt=time.time() - settings.answer_cache_ttl))
+                ]),
+            )
+        except Exception as e:
+            print(f"[AnswerCache] Invalidation failed: {e}")
+            return
+        print(f"[AnswerCache] Invalidated answers for "
+              f"{ {name: metadata.get(name) for name in FILTER_FIELDS} }")
@@ -1,16 +1,92 @@
-from typing import Any, Dict, List
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from backend.app.config import get_settings
+from backend.app.core.retrieval.embedder import count_tokens, truncate_tokens
+from backend.app.core.retrieval.embedding_cache import normalize_text
+from backend.app.core.retrieval.sparse_encoder import TOKEN_RE, tokenize
+
+settings = get_settings()
+
+SEPARATOR = "\n\n---\n\n"
+SEPARATOR_TOKENS = 3
+SHINGLE_SIZE = 3
+# Đoạn lặp ngắn hơn ngưỡng này coi là trùng hợp, không phải overlap giữa 2 windows
+MIN_OVERLAP_CHARS = 64
+TABLE_SEPARATOR_RE = re.compile(r"^\|?\s*:?-{2,}:?\s*(\|\s*:?-{2,}:?\s*)*\|?$")
+
+
+def _shingles(text: str) -> Set[Tuple[str, ...]]:
+    words = TOKEN_RE.findall(normalize_text(text))
+    if len(words) <= SHINGLE_SIZE:
+        return {tuple(words)}
+    return {tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def _jaccard(a: Set, b: Set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _strip_overlap(kept: str, content: str) -> str:
+    """
+    Bỏ phần `content` trùng với `kept` do SentenceSplitter chồng windows (chunk_overlap):
+    - đầu `content` = đuôi `kept` (window kế tiếp) → cắt phần đầu
+    - đuôi `content` = đầu `kept` (window liền trước) → cắt phần đuôi
+    """
+    probe = content[:MIN_OVERLAP_CHARS]
+    pos = kept.find(probe) if len(probe) == MIN_OVERLAP_CHARS else -1
+    while pos != -1:
+        if content.startswith(kept[pos:]):
+            return content[len(kept) - pos:].lstrip()
+        pos = kept.find(probe, pos + 1)
+
+    probe = kept[:MIN_OVERLAP_CHARS]
+    pos = content.find(probe) if len(probe) == MIN_OVERLAP_CHARS else -1
+    while pos != -1:
+        if kept.startswith(content[pos:]):
+            return content[:pos].rstrip()
+        pos = content.find(probe, pos + 1)
+    return content
+
+
+def _split_row(line: str) -> List[str]:
+    return [cell.strip() for cell in line.strip().strip("|").split("|")]
+
+
+def _join_row(cells: List[str]) -> str:
+    return "| " + " | ".join(cells) + " |"
 
 
 class ContextBuilder:
     """
     Format danh sách chunks thành context string đẹp để đưa vào LLM.
     Phân biệt rõ nguồn: [TEXT], [TABLE], [CHART].
+
+    pack() chọn chunks trước khi build để prompt không phình theo top_k:
+    - Theo score giảm dần, lấp đầy token budget (tiktoken, đếm local)
+    - Bỏ chunks gần trùng nhau (Jaccard trên word shingles) và phần chồng lấn giữa
+      các SentenceSplitter windows cùng trang
+    - Bảng rộng/dài chỉ giữ các hàng/cột liên quan tới câu hỏi
     """
 
+    def __init__(
+        self,
+        token_budget: Optional[int] = None,
+        dedup_threshold: Optional[float] = None,
+        table_max_rows: Optional[int] = None,
+        table_max_cols: Optional[int] = None,
+    ):
+        self.token_budget = token_budget or settings.context_token_budget
+        self.dedup_threshold = dedup_threshold or settings.context_dedup_threshold
+        self.table_max_rows = table_max_rows or settings.context_table_max_rows
+        self.table_max_cols = table_max_cols or settings.context_table_max_cols
+
     def build(self, chunks: List[Dict[str, Any]]) -> str:
         """
         Args:
-            chunks: List từ MultiCollectionRetriever.retrieve()
+            chunks: List từ MultiCollectionRetriever.retrieve() (hoặc từ pack())
 
         Returns:
             Context string dạng:
@@ -31,7 +107,134 @@ class ContextBuilder:
             header = self._format_header(i, chunk)
             parts.append(f"{header}\n{chunk['content']}")
 
-        return "\n\n---\n\n".join(parts)
+        return SEPARATOR.join(parts)
+
+    def pack(
+        self,
+        chunks: List[Dict[str, Any]],
+        question: str = "",
+        token_budget: Optional[int] = None,
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+        """
+        Chọn + rút gọn chunks cho vừa token budget.
+
+        Returns:
+            (packed_chunks, stats)
+            packed_chunks: bản sao chunks (content có thể đã cắt), theo score giảm dần —
+                           dùng cho cả build() và build_citations() để [Source #N] khớp nhau
+            stats: {"chunks_in", "chunks_used", "duplicates", "trimmed_tables",
+                    "over_budget", "tokens_in", "tokens_used", "tokens_saved"}
+        """
+        budget = token_budget or self.token_budget
+        terms = {t for t in tokenize(question) if len(t) > 1}
+        stats = {"chunks_in": len(chunks), "duplicates": 0, "trimmed_tables": 0, "over_budget": 0}
+
+        packed: List[Dict[str, Any]] = []
+        kept_shingles: List[Set] = []
+        used = 0
+        for chunk in sorted(chunks, key=lambda c: c.get("score", 0), reverse=True):
+            content = chunk["content"]
+            if self._is_table(chunk):
+                trimmed = self._trim_table(content, terms)
+                if trimmed != content:
+                    stats["trimmed_tables"] += 1
+                    content = trimmed
+            else:
+                content = self._strip_window_overlaps(chunk, content, packed)
+
+            shingles = _shingles(content)
+            if not content.strip() or any(_jaccard(shingles, s) >= self.dedup_threshold for s in kept_shingles):
+                stats["duplicates"] += 1
+                continue
+
+            header = self._format_header(len(packed) + 1, chunk)
+            header_tokens = count_tokens(header) + SEPARATOR_TOKENS
+            tokens = header_tokens + count_tokens(content)
+            if used + tokens > budget:
+                if packed:
+                    # Chunk nhỏ hơn phía sau có thể vẫn vừa phần budget còn lại
+                    stats["over_budget"] += 1
+                    continue
+                # Chunk tốt nhất tự nó đã vượt budget → cắt bớt thay vì trả context rỗng
+                content = truncate_tokens(content, max(budget - header_tokens, 1))
+                tokens = header_tokens + count_tokens(content)
+
+            packed.append({**chunk, "content": content})
+            kept_shingles.append(shingles)
+            used += tokens
+
+        stats["chunks_used"] = len(packed)
+        stats["tokens_in"] = count_tokens(self.build(chunks)) if chunks else 0
+        stats["tokens_used"] = count_tokens(self.build(packed)) if packed else 0
+        stats["tokens_saved"] = max(stats["tokens_in"] - stats["tokens_used"], 0)
+        return packed, stats
+
+    @staticmethod
+    def _is_table(chunk: Dict[str, Any]) -> bool:
+        meta = chunk.get("metadata") or {}
+        return chunk.get("source_collection") == "table" or meta.get("chunk_type") == "table"
+
+    @staticmethod
+    def _strip_window_overlaps(chunk: Dict[str, Any], content: str, packed: List[Dict[str, Any]]) -> str:
+        meta = chunk.get("metadata") or {}
+        page = meta.get("page_num", meta.get("page"))
+        for kept in packed:
+            kept_meta = kept.get("metadata") or {}
+            if kept_meta.get("doc_id") != meta.get("doc_id"):
+                continue
+            if kept_meta.get("page_num", kept_meta.get("page")) != page:
+                continue
+            content = _strip_overlap(kept["content"], content)
+        return content
+
+    def _trim_table(self, table_md: str, terms: Set[str]) -> str:
+        """
+        Giữ cột đầu (tên chỉ tiêu) + các cột/hàng có từ khóa của câu hỏi (năm, quý, tên chỉ tiêu).
+        Không có hàng/cột nào khớp → giữ các hàng/cột đầu tiên. Bảng nhỏ giữ nguyên.
+        """
+        lines = table_md.strip().split("\n")
+        table_idx = [i for i, line in enumerate(lines) if line.strip().startswith("|")]
+        if len(table_idx) < 2:
+            return table_md
+
+        rows = [_split_row(lines[i]) for i in table_idx]
+        header, body = rows[0], rows[1:]
+        has_separator = bool(body) and TABLE_SEPARATOR_RE.match(lines[table_idx[1]].strip()) is not None
+        if has_separator:
+            body = body[1:]
+        n_cols = max(len(r) for r in rows)
+        if len(body) <= self.table_max_rows and n_cols <= self.table_max_cols:
+            return table_md
+
+        def relevance(cells: List[str]) -> int:
+            return len(terms.intersection(tokenize(" ".join(cells))))
+
+        def most_relevant(indices: List[int], scores: List[int], limit: int) -> List[int]:
+            # Khớp nhiều từ khóa nhất trước, giữ thứ tự gốc trong bảng
+            matched = sorted((i for i in indices if scores[i]), key=lambda i: -scores[i])
+            return sorted(matched[:limit]) or indices[:limit]
+
+        cols = list(range(n_cols))
+        if n_cols > self.table_max_cols:
+            scores = [relevance([header[c]]) if c < len(header) else 0 for c in cols]
+            cols = [0] + most_relevant(cols[1:], scores, self.table_max_cols - 1)
+
+        keep_rows = list(range(len(body)))
+        if len(body) > self.table_max_rows:
+            keep_rows = most_relevant(keep_rows, [relevance(r) for r in body], self.table_max_rows)
+
+        def project(cells: List[str]) -> str:
+            return _join_row([cells[c] if c < len(cells) else "" for c in cols])
+
+        trimmed = [project(header)]
+        if has_separator:
+            trimmed.append(_join_row(["---"] * len(cols)))
+        trimmed += [project(body[i]) for i in keep_rows]
+        trimmed.append(
+            f"(trimmed: {len(keep_rows)}/{len(body)} rows, {len(cols)}/{n_cols} columns relevant to the question)"
+        )
+
+        return "\n".join(lines[: table_idx[0]] + trimmed + lines[table_idx[-1] + 1:])
 
     def _format_header(self, index: int, chunk: Dict) -> str:
         meta = chunk.get("metadata") or {}
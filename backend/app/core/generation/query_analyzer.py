@@ -1,9 +1,9 @@
 import json
-from typing import Any, Dict, List
-
-from openai import OpenAI
+import re
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from backend.app.config import get_settings
+from backend.app.core.clients import get_async_openai
 
 settings = get_settings()
 
@@ -31,17 +31,38 @@ Rules:
 - sub_questions: break complex question into 1-3 simpler ones for retrieval.
 """
 
+YEAR_RE = re.compile(r"\b(20\d{2})\b")
+QUARTER_RE = re.compile(r"\b(?:q|quý|quy|quarter)\s*([1-4])\b", re.IGNORECASE)
+# Câu hỏi so sánh / xu hướng cần sub_questions → để LLM analyzer xử lý
+COMPLEX_CUES = re.compile(
+    r"\b(?:compare|comparison|versus|vs|trend|between|growth over|so sánh|xu hướng|qua các năm|giai đoạn)\b",
+    re.IGNORECASE,
+)
+TABLE_CUES = re.compile(
+    r"\d|%|\b(?:revenue|profit|margin|eps|ratio|doanh thu|lợi nhuận|biên|tỷ lệ|bao nhiêu)\b",
+    re.IGNORECASE,
+)
+IMAGE_CUES = re.compile(r"\b(?:chart|graph|biểu đồ)\b", re.IGNORECASE)
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+FINANCE_ACRONYMS = {"eps", "roe", "roa", "npat", "ebit", "ebitda", "yoy", "qoq", "fy", "usd", "vnd", "ir", "gdp", "cagr", "pe", "pb"}
+# Từ hay viết hoa ở đầu câu / tiêu đề nhưng không phải tên riêng
+GENERIC_WORDS = {
+    "what", "how", "which", "who", "when", "where", "why", "show", "list", "give", "tell", "please",
+    "is", "are", "was", "were", "did", "does", "do", "can", "the", "in", "for", "of", "and",
+    "revenue", "net", "gross", "total", "profit", "sales", "operating", "earnings", "cash",
+    "dividend", "margin", "quarter", "year", "fiscal", "annual", "report",
+    "doanh", "thu", "lợi", "nhuận", "tổng", "biên", "cho", "hãy", "năm", "quý", "trong", "theo",
+    "tỷ", "giá", "chi", "phí", "kết", "quả", "báo", "cáo", "công", "ty", "của", "là", "bao", "nhiêu",
+}
+
 
 class QueryAnalyzer:
     """
     Analyze user question to extract intent, entities, data types needed, and sub-questions for retrieval.
-    Use GPT-4o-mini
+    Use GPT-4o-mini (AsyncOpenAI, shared connection pool)
     """
 
-    def __init__(self):
-        self.client = OpenAI(api_key=settings.openai_api_key)
-
-    def analyze(self, question: str) -> Dict[str, Any]:
+    async def analyze(self, question: str) -> Dict[str, Any]:
         """
         Analyze user question.
 
@@ -57,7 +78,7 @@ class QueryAnalyzer:
             }
         """
         try:
-            response = self.client.chat.completions.create(
+            response = await get_async_openai().chat.completions.create(
                 model=settings.llm_model,
                 messages=[
                     {"role": "system", "content": ANALYZER_PROMPT},
@@ -78,6 +99,86 @@ class QueryAnalyzer:
                 "sub_questions": [question],
             }
 
+    def analyze_local(self, question: str) -> Optional[Dict[str, Any]]:
+        """
+        Rule-based extractor (regex, không gọi LLM) cho câu hỏi đơn giản.
+
+        Returns:
+            Analysis cùng format với analyze(), hoặc None nếu câu hỏi phức tạp
+            (nhiều năm, so sánh, xu hướng) hoặc nhắc tới mã/tên riêng không có trong
+            company_aliases → cần LLM analyzer. Chỉ trả về analysis khi công ty đã
+            resolve được, hoặc câu hỏi không nhắc tới tên riêng nào.
+        """
+        years = sorted({int(y) for y in YEAR_RE.findall(question)})
+        if len(years) > 1 or COMPLEX_CUES.search(question):
+            return None
+
+        company, known = self._match_company(question)
+
+        # Từ viết hoa chưa biết (ticker FPT/HPG, tên "Hoa Phat", "Masan"...) → có thể là công ty
+        # ngoài company_aliases; bỏ qua LLM lúc này sẽ retrieve không có company filter
+        if self._unknown_entities(question, known):
+            return None
+
+        quarter = QUARTER_RE.search(question)
+        data_types = ["text"]
+        if TABLE_CUES.search(question):
+            data_types.append("table")
+        if IMAGE_CUES.search(question):
+            data_types.append("image")
+
+        return {
+            "intent": "fact_lookup",
+            "entities": {
+                "company": company,
+                "year": years[0] if years else None,
+                "years": None,
+                "quarter": f"Q{quarter.group(1)}" if quarter else None,
+                "metric": None,
+            },
+            "data_types_needed": data_types,
+            "sub_questions": [question],
+            "source": "local",
+        }
+
+    def scope_entities(self, question: str) -> Dict[str, Any]:
+        """
+        Công ty + kỳ báo cáo nhắc tới trong câu hỏi (regex, không gọi LLM) — phần scope của
+        AnswerCache: "Vinamilk revenue Q3 2025" và "... Q4 2025" gần như trùng vector nhưng
+        khác câu trả lời. Tên riêng chưa biết (ngoài company_aliases) cũng được giữ lại.
+        """
+        company, known = self._match_company(question)
+        entities = {
+            "company": company,
+            "years": sorted({int(y) for y in YEAR_RE.findall(question)}),
+            "quarters": sorted({f"Q{q}" for q in QUARTER_RE.findall(question)}),
+            "names": sorted({w.lower() for w in self._unknown_entities(question, known)}),
+        }
+        return {key: value for key, value in entities.items() if value}
+
+    @staticmethod
+    def _match_company(question: str) -> Tuple[Optional[str], Set[str]]:
+        """(tên chuẩn của công ty đầu tiên khớp company_aliases, mọi từ trong aliases)."""
+        company = None
+        known: Set[str] = set()
+        lowered = question.lower()
+        for name, aliases in settings.company_aliases.items():
+            names = [name, *aliases]
+            known.update(w for n in names for w in WORD_RE.findall(n.lower()))
+            if company is None and any(re.search(rf"\b{re.escape(n.lower())}\b", lowered) for n in names):
+                company = name
+        return company, known
+
+    @staticmethod
+    def _unknown_entities(question: str, known: set) -> List[str]:
+        """Tokens viết hoa (tên riêng / ticker) không thuộc aliases, acronyms tài chính hay từ thông dụng."""
+        return [
+            word for word in WORD_RE.findall(question)
+            if word[0].isupper()
+            and word.lower() not in known | FINANCE_ACRONYMS | GENERIC_WORDS
+            and not QUARTER_RE.fullmatch(word)
+        ]
+
     def build_filters(self, analysis: Dict) -> Dict:
         """
         Convert entities to Qdrant filter dict.
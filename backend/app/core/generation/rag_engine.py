@@ -1,11 +1,13 @@
-from typing import Any, Dict, List, Optional
-
-from openai import OpenAI
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
 from backend.app.config import get_settings
+from backend.app.core.clients import get_async_openai
 from backend.app.core.retrieval.retriever import MultiCollectionRetriever
 from backend.app.core.generation.query_analyzer import QueryAnalyzer
 from backend.app.core.generation.context_builder import ContextBuilder
+from backend.app.core.generation.answer_cache import AnswerCache
 
 settings = get_settings()
 
@@ -16,23 +18,34 @@ If the context doesn't contain enough information, say so clearly.
 Be precise with numbers and percentages.
 Respond in the same language as the user's question."""
 
+# Cached answer gửi lại qua SSE theo từng đoạn (không delay) để frontend render như stream thường
+CACHED_TOKEN_CHARS = 256
+
 
 class RAGEngine:
     """
     Agentic RAG Engine — multi-collection, with query analysis.
 
     Flow:
+    0. AnswerCache: câu hỏi (hoặc diễn đạt lại) đã trả lời với cùng filters + công ty / kỳ → trả ngay
     1. QueryAnalyzer: detect intent, extract entities
+       - filters truyền vào / rule-based extractor đủ dùng → bỏ qua LLM analyzer
+       - còn lại: LLM analyzer chạy song song với retrieval không filter (speculative)
     2. MultiCollectionRetriever: search text + table + image collections
-    3. ContextBuilder: format context
+    3. ContextBuilder: pack chunks vào token budget (dedupe, trim bảng) rồi format context
     4. LLM: synthesize answer with citations
+
+    Toàn bộ I/O là async (AsyncOpenAI + AsyncQdrantClient dùng chung connection pool),
+    nên 1 LLM call chậm không chặn các request khác trên cùng uvicorn worker.
     """
 
     def __init__(self):
-        self.llm = OpenAI(api_key=settings.openai_api_key)
         self.retriever = MultiCollectionRetriever()
         self.analyzer = QueryAnalyzer()
         self.context_builder = ContextBuilder()
+        self.answer_cache = (
+            AnswerCache(self.retriever.embedder.cache_model) if settings.answer_cache_enabled else None
+        )
 
     async def query(
         self,
@@ -52,48 +65,141 @@ class RAGEngine:
             {
                 "answer": "...",
                 "sources": [...],
-                "analysis": {...}  # query analysis result
+                "analysis": {...},      # query analysis result
+                "context_stats": {...}, # ContextBuilder.pack() stats (tokens_saved, ...)
+                "cached": False         # True khi trả từ AnswerCache
             }
         """
-        # 1. Analyze query
-        analysis = self.analyzer.analyze(question)
-        print(f"[RAG] Intent: {analysis.get('intent')}, Types needed: {analysis.get('data_types_needed')}")
-
-        # 2. Build filters (từ analysis nếu không có override)
-        if filters is None:
-            filters = self.analyzer.build_filters(analysis) or None
+        cached = await self._cached_answer(question, top_k, filters)
+        if cached is not None:
+            return {
+                "answer": cached["answer"],
+                "sources": cached["sources"],
+                "analysis": {"intent": "other", "entities": {}, "source": "answer_cache",
+                             "similarity": cached["similarity"]},
+                "context_stats": cached.get("context_stats"),
+                "cached": True,
+            }
 
-        # 3. Multi-collection retrieval
-        chunks = self.retriever.retrieve(
-            question=question,
-            top_k_text=3,
-            top_k_table=top_k,
-            top_k_image=2,
-            filters=filters,
-        )
+        # 1-3. Analyze query + multi-collection retrieval
+        analysis, chunks = await self._analyze_and_retrieve(question, top_k, filters)
+        print(f"[RAG] Intent: {analysis.get('intent')}, Types needed: {analysis.get('data_types_needed')}")
 
         if not chunks:
             return {
                 "answer": "Không tìm thấy thông tin liên quan trong tài liệu.",
                 "sources": [],
                 "analysis": analysis,
+                "context_stats": None,
+                "cached": False,
             }
 
-        # 4. Build context
-        context = self.context_builder.build(chunks)
-        citations = self.context_builder.build_citations(chunks)
+        # 4. Pack + build context (citations theo đúng thứ tự chunks trong context)
+        packed, context_stats = self.context_builder.pack(chunks, question)
+        context = self.context_builder.build(packed)
+        citations = self.context_builder.build_citations(packed)
+        print(f"[RAG] Context: {context_stats['chunks_used']}/{context_stats['chunks_in']} chunks, "
+              f"{context_stats['tokens_used']} tokens ({context_stats['tokens_saved']} saved)")
 
         # 5. LLM synthesis
-        answer = self._synthesize(question, context)
+        answer = await self._synthesize(question, context)
+        await self._store_answer(question, top_k, filters, answer, citations, context_stats)
 
         return {
             "answer": answer,
             "sources": citations,
             "analysis": analysis,
+            "context_stats": context_stats,
+            "cached": False,
         }
 
-    def _synthesize(self, question: str, context: str) -> str:
+    async def _cached_answer(self, question: str, top_k: int, filters: Optional[Dict]) -> Optional[Dict[str, Any]]:
+        """Query vector đi qua QueryVectorCache → cache miss không phải embed lại lúc retrieve."""
+        if self.answer_cache is None:
+            return None
+        query_vector = await self.retriever.embed_question(question)
+        entities = self.analyzer.scope_entities(question)
+        cached = await self.answer_cache.alookup(query_vector, filters, top_k, entities)
+        if cached is not None:
+            print(f"[RAG] Answer cache hit (similarity={cached['similarity']}): {cached['question']!r}")
+        return cached
+
+    async def _store_answer(
+        self,
+        question: str,
+        top_k: int,
+        filters: Optional[Dict],
+        answer: str,
+        citations: List[Dict],
+        context_stats: Dict[str, int],
+    ):
+        if self.answer_cache is None or not answer:
+            return
+        query_vector = await self.retriever.embed_question(question)
+        await self.answer_cache.astore(
+            question, query_vector, filters, top_k, answer, citations, context_stats,
+            entities=self.analyzer.scope_entities(question),
+        )
+
+    async def _analyze_and_retrieve(
+        self,
+        question: str,
+        top_k: int,
+        filters: Optional[Dict],
+    ) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Chọn filters + retrieve, tránh để LLM analyzer nằm trên critical path.
+
+        - filters truyền vào (request có company/year) → không cần analyzer
+        - analyze_local xử lý được → dùng luôn filters từ regex
+        - còn lại: chạy LLM analyzer song song với retrieval không filter; nếu analyzer
+          tìm ra filters thì lọc lại kết quả speculative, thiếu thì search lại có filter
+          (query vector đã cache → chỉ tốn thêm vector search)
+        """
+        limits = {"top_k_text": 3, "top_k_table": top_k, "top_k_image": 2}
+
+        if filters is not None:
+            analysis = {"intent": "other", "entities": {}, "source": "request_filters"}
+            return analysis, await self.retriever.retrieve(question=question, filters=filters, **limits)
+
+        analysis = self.analyzer.analyze_local(question)
+        if analysis is not None:
+            filters = self.analyzer.build_filters(analysis) or None
+            return analysis, await self.retriever.retrieve(question=question, filters=filters, **limits)
+
+        retrieval = asyncio.create_task(self.retriever.retrieve(question=question, filters=None, **limits))
+        try:
+            analysis = await self.analyzer.analyze(question)
+            chunks = await retrieval
+        finally:
+            retrieval.cancel()
+
+        filters = self.analyzer.build_filters(analysis)
+        if not filters:
+            return analysis, chunks
+
+        matching = [c for c in chunks if self._matches_filters(c, filters)]
+        if len(matching) == len(chunks):
+            return analysis, chunks
+        print(f"[RAG] Analyzer filters {filters} dropped {len(chunks) - len(matching)} speculative hits, re-searching")
+        return analysis, await self.retriever.retrieve(question=question, filters=filters, **limits)
+
+    @staticmethod
+    def _matches_filters(chunk: Dict[str, Any], filters: Dict) -> bool:
+        meta = chunk.get("metadata") or {}
+        return all(meta.get(key) == value for key, value in filters.items())
+
+    async def _synthesize(self, question: str, context: str) -> str:
         """Gọi LLM để generate answer từ context."""
+        response = await get_async_openai().chat.completions.create(
+            model=settings.llm_model,
+            messages=self._build_messages(question, context),
+            temperature=0.1,
+            max_tokens=1500,
+        )
+        return response.choices[0].message.content
+
+    def _build_messages(self, question: str, context: str) -> List[Dict[str, str]]:
         user_message = f"""Context from financial documents:
 {context}
 
@@ -102,16 +208,10 @@ Question: {question}
 
 Please answer based on the context above. Cite sources using [Source #N] format."""
 
-        response = self.llm.chat.completions.create(
-            model=settings.llm_model,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_message},
-            ],
-            temperature=0.1,
-            max_tokens=1500,
-        )
-        return response.choices[0].message.content
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_message},
+        ]
 
     def _build_context(self, chunks: List[Dict]) -> str:
         """Legacy method — giữ để backward compat."""
@@ -122,44 +222,83 @@ Please answer based on the context above. Cite sources using [Source #N] format.
         question: str,
         top_k: int = 5,
         filters: Optional[Dict] = None,
-    ):
+    ) -> AsyncIterator[Dict[str, Any]]:
         """
-        Streaming version — yield từng token để dùng với SSE.
-        """
-        from typing import AsyncGenerator
-
-        analysis = self.analyzer.analyze(question)
-        if filters is None:
-            filters = self.analyzer.build_filters(analysis) or None
+        Streaming version — yield typed events để endpoint SSE format:
+            {"event": "sources", "data": {"sources": [...]}}   # trước tokens, từ build_citations
+            {"event": "token",   "data": {"token": "..."}}
+            {"event": "done",    "data": {"timings": {"retrieval": 0.41, "first_token": 0.93, ...},
+                                             "context": {"tokens_saved": 812, ...},
+                                             "cached": false}}
 
-        chunks = self.retriever.retrieve(
-            question=question, top_k_text=3, top_k_table=top_k, top_k_image=2, filters=filters
-        )
+        Frontend dùng sources event cho citations → mỗi lượt chat chỉ 1 lần retrieval + 1 lần generation.
+        Nếu consumer dừng (client disconnect → generator bị aclose/cancel),
+        OpenAI stream được đóng ngay để không tiếp tục sinh/trả tiền tokens.
+        Cache hit → cùng chuỗi events (sources đã lưu + answer chia đoạn), không gọi LLM.
+        """
+        started = time.perf_counter()
+        timings: Dict[str, float] = {}
 
-        if not chunks:
-            yield "Không tìm thấy thông tin liên quan trong tài liệu."
+        cached = await self._cached_answer(question, top_k, filters)
+        if cached is not None:
+            timings["cache_lookup"] = time.perf_counter() - started
+            yield {"event": "sources", "data": {"sources": cached["sources"]}}
+            answer = cached["answer"]
+            for i in range(0, len(answer), CACHED_TOKEN_CHARS):
+                yield {"event": "token", "data": {"token": answer[i:i + CACHED_TOKEN_CHARS]}}
+            timings["total"] = time.perf_counter() - started
+            yield {"event": "done", "data": {
+                "timings": self._round_timings(timings),
+                "context": cached.get("context_stats"),
+                "cached": True,
+            }}
             return
 
-        context = self.context_builder.build(chunks)
-        user_message = f"""Context from financial documents:
-{context}
+        analysis, chunks = await self._analyze_and_retrieve(question, top_k, filters)
+        timings["retrieval"] = time.perf_counter() - started
 
----
-Question: {question}
+        packed, context_stats = self.context_builder.pack(chunks, question)
+        citations = self.context_builder.build_citations(packed)
+        yield {"event": "sources", "data": {"sources": citations}}
 
-Please answer based on the context above. Cite sources using [Source #N] format."""
+        if not packed:
+            yield {"event": "token", "data": {"token": "Không tìm thấy thông tin liên quan trong tài liệu."}}
+            timings["total"] = time.perf_counter() - started
+            yield {"event": "done", "data": {"timings": self._round_timings(timings), "cached": False}}
+            return
 
-        stream = self.llm.chat.completions.create(
+        context = self.context_builder.build(packed)
+        stream = await get_async_openai().chat.completions.create(
             model=settings.llm_model,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_message},
-            ],
+            messages=self._build_messages(question, context),
             temperature=0.1,
             max_tokens=1500,
             stream=True,
         )
-        for chunk in stream:
-            delta = chunk.choices[0].delta.content
-            if delta:
-                yield delta
+        parts: List[str] = []
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if "first_token" not in timings:
+                        timings["first_token"] = time.perf_counter() - started
+                    parts.append(delta)
+                    yield {"event": "token", "data": {"token": delta}}
+        finally:
+            await stream.close()
+
+        timings["total"] = time.perf_counter() - started
+        timings["generation"] = timings["total"] - timings["retrieval"]
+        # Chỉ cache câu trả lời đã stream hết (client disconnect → generator dừng trước dòng này)
+        await self._store_answer(question, top_k, filters, "".join(parts), citations, context_stats)
+        yield {"event": "done", "data": {
+            "timings": self._round_timings(timings),
+            "context": context_stats,
+            "cached": False,
+        }}
+
+    @staticmethod
+    def _round_timings(timings: Dict[str, float]) -> Dict[str, float]:
+        return {name: round(seconds, 3) for name, seconds in timings.items()}
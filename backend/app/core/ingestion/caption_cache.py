@@ -0,0 +1,67 @@
+import json
+from typing import Dict, List, Optional
+
+import redis
+
+from backend.app.config import get_settings
+from backend.app.core.clients import get_async_cache_redis
+
+settings = get_settings()
+
+KEY_PREFIX = "caption"
+STATS_KEY = "caption_cache:stats"
+
+
+def cache_key(model: str, digest: str) -> str:
+    return f"{KEY_PREFIX}:{model}:{digest}"
+
+
+class CaptionCache:
+    """
+    Redis-backed caption cache, key = (vision model, sha256 nội dung ảnh).
+
+    Không key theo perceptual hash: 2 charts cùng template khác số liệu (cùng báo cáo
+    qua các quý) có thể trùng dHash → caption / key_data của chart này gán nhầm cho chart kia.
+
+    Lưu cả kết quả `non_chart` → logo/ảnh trang trí đã gặp ở document khác
+    không bao giờ gửi lại vision model. TTL trượt giống EmbeddingCache.
+
+    Redis lỗi → coi như miss, captioning vẫn chạy bình thường.
+    """
+
+    def __init__(self, ttl: Optional[int] = None):
+        self.ttl = ttl or settings.caption_cache_ttl
+
+    async def aget_many(self, model: str, digests: List[str]) -> List[Optional[Dict]]:
+        if not digests:
+            return []
+        client = get_async_cache_redis()
+        try:
+            pipe = client.pipeline(transaction=False)
+            for digest in digests:
+                pipe.getex(cache_key(model, digest), ex=self.ttl)
+            raws = await pipe.execute()
+
+            hits = sum(1 for raw in raws if raw)
+            pipe = client.pipeline(transaction=False)
+            if hits:
+                pipe.hincrby(STATS_KEY, "hits", hits)
+            if len(raws) - hits:
+                pipe.hincrby(STATS_KEY, "misses", len(raws) - hits)
+            await pipe.execute()
+        except redis.RedisError as e:
+            print(f"[CaptionCache] Lookup failed: {e}")
+            return [None] * len(digests)
+        return [json.loads(raw) if raw else None for raw in raws]
+
+    async def aset_many(self, model: str, digests: List[str], captions: List[Dict]):
+        if not digests:
+            return
+        client = get_async_cache_redis()
+        try:
+            pipe = client.pipeline(transaction=False)
+            for digest, caption in zip(digests, captions):
+                pipe.set(cache_key(model, digest), json.dumps(caption, ensure_ascii=False), ex=self.ttl)
+            await pipe.execute()
+        except redis.RedisError as e:
+            print(f"[CaptionCache] Store failed: {e}")
@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import struct
+from typing import Any, Iterator, List, Optional
+
+from backend.app.config import get_settings
+from backend.app.models.parsed_document import ParsedDocument
+
+settings = get_settings()
+
+# Thứ tự các stage trong Celery chain; mỗi stage đọc checkpoint của các stage trước
+INGEST_STAGES = ("parse", "extract", "caption", "embed", "upsert")
+
+
+class CheckpointMissing(Exception):
+    """Checkpoint của stage trước không có trên disk (bị xoá / worker không dùng chung checkpoint_dir)."""
+
+
+class CheckpointStore:
+    """
+    Kết quả trung gian của từng ingestion stage trên disk, key theo doc_id / stage.
+    Celery message chỉ mang doc_id + metadata; stage retry đọc lại input từ đây
+    thay vì chạy lại LlamaParse / Gemini / embedding từ đầu.
+
+    Layout ({checkpoint_dir}/{doc_id}/):
+        parse.json          ParsedDocument
+        extract.json        {"text": [chunks], "table": [chunks]}
+        caption.json        {"image": [chunks]}
+        embed.json          {"dim": 1536, "collections": {name: [chunk ids]}, "stale": {name: [ids]}}
+        embed-{name}.f32    vectors float32 little-endian, nối tiếp theo thứ tự chunk ids
+
+    Ghi file tạm rồi os.replace → stage chỉ được coi là xong khi checkpoint ghi trọn vẹn.
+    checkpoint_dir phải dùng chung giữa các workers của mọi ingestion queues.
+    """
+
+    def __init__(self, doc_id: str, root: Optional[str] = None):
+        self.doc_id = doc_id
+        self.path = os.path.join(root or settings.checkpoint_dir, doc_id)
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def has(self, stage: str) -> bool:
+        return os.path.exists(self._file(f"{stage}.json"))
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    # ── JSON checkpoints ───────────────────────────────────────────
+
+    def save(self, stage: str, data: Any):
+        self._write(f"{stage}.json", json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+    def load(self, stage: str) -> Any:
+        try:
+            with open(self._file(f"{stage}.json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise CheckpointMissing(f"No '{stage}' checkpoint for doc_id={self.doc_id}")
+
+    def save_parsed(self, parsed: ParsedDocument):
+        self._write("parse.json", parsed.model_dump_json().encode("utf-8"))
+
+    def load_parsed(self) -> ParsedDocument:
+        return ParsedDocument.model_validate(self.load("parse"))
+
+    def _write(self, name: str, payload: bytes):
+        os.makedirs(self.path, exist_ok=True)
+        path = self._file(name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+    # ── Vectors ────────────────────────────────────────────────────
+
+    def vector_writer(self, collection: str, dim: int) -> "VectorWriter":
+        os.makedirs(self.path, exist_ok=True)
+        return VectorWriter(self._file(f"embed-{collection}.f32"), dim)
+
+    def iter_vectors(self, collection: str, dim: int, batch_size: int) -> Iterator[List[List[float]]]:
+        """Đọc lại vectors theo batch → upsert stage không cần giữ cả document trong RAM."""
+        row = struct.Struct(f"<{dim}f")
+        try:
+            f = open(self._file(f"embed-{collection}.f32"), "rb")
+        except FileNotFoundError:
+            raise CheckpointMissing(f"No vectors for {collection}, doc_id={self.doc_id}")
+        with f:
+            while True:
+                block = f.read(row.size * batch_size)
+                if not block:
+                    return
+                yield [list(values) for values in row.iter_unpack(block)]
+
+
+class VectorWriter:
+    """Append vectors (packed float32) vào file tạm; commit() rename khi embed xong cả collection."""
+
+    def __init__(self, path: str, dim: int):
+        self.path = path
+        self.tmp_path = f"{path}.{os.getpid()}.tmp"
+        self.row = struct.Struct(f"<{dim}f")
+        self.count = 0
+        self._f = open(self.tmp_path, "wb")
+
+    def write(self, vectors: List[List[float]]):
+        self._f.write(b"".join(self.row.pack(*vector) for vector in vectors))
+        self.count += len(vectors)
+
+    def commit(self):
+        self._f.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self._f.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
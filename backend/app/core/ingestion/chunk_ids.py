@@ -0,0 +1,29 @@
+import hashlib
+import uuid
+from typing import Any, Dict, List
+
+# Namespace cố định → cùng (doc, chunk) luôn ra cùng UUID giữa các lần ingest
+CHUNK_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "the-smart-analyst/chunks")
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def assign_chunk_ids(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Gán ID deterministic (UUIDv5) cho chunks của 1 document:
+        doc_id + chunk_type + page + sha256(content) + thứ tự lặp lại trong trang
+
+    Chunk không đổi nội dung/vị trí giữ nguyên ID khi re-ingest → chỉ chunks mới/sửa
+    được upsert, chunks cũ không còn xuất hiện bị xóa.
+    """
+    occurrences: Dict[str, int] = {}
+    for chunk in chunks:
+        meta = chunk["metadata"]
+        page = meta.get("page", meta.get("page_num"))
+        base = f"{meta.get('doc_id')}:{meta.get('chunk_type')}:{page}:{content_hash(chunk['content'])}"
+        n = occurrences.get(base, 0)
+        occurrences[base] = n + 1
+        chunk["id"] = str(uuid.uuid5(CHUNK_NAMESPACE, f"{base}:{n}"))
+    return chunks
@@ -0,0 +1,127 @@
+import base64
+import os
+import tempfile
+from typing import Any, Dict, List, Optional
+
+from llama_parse import LlamaParse
+
+from backend.app.config import get_settings
+from backend.app.core.ingestion.parse_cache import ParseCache, file_sha256
+from backend.app.models.parsed_document import ParsedDocument, ParsedImage, ParsedPage
+
+settings = get_settings()
+
+
+class DocumentParser:
+    """
+    Parse PDF qua LlamaParse đúng 1 lần → ParsedDocument (pages, markdown, tables, images).
+    TextProcessor, TableProcessor và ImageProcessor đều đọc từ kết quả này.
+
+    Kết quả được cache trên disk theo hash nội dung file (ParseCache):
+    upload lại cùng 1 PDF sẽ không gọi LlamaParse nữa.
+    """
+
+    def __init__(self, cache: Optional[ParseCache] = None):
+        self.parser_settings = {
+            "result_type": "markdown",
+            "language": settings.parse_language,
+            "extract_images": True,
+        }
+        self.parser = LlamaParse(
+            api_key=settings.llama_cloud_api_key,
+            verbose=False,
+            **self.parser_settings,
+        )
+        if cache is None and settings.parse_cache_enabled:
+            cache = ParseCache()
+        self.cache = cache
+
+    async def parse(self, file_path: str) -> ParsedDocument:
+        """
+        Args:
+            file_path: Path to PDF file
+
+        Returns:
+            ParsedDocument với 1 ParsedPage cho mỗi trang PDF
+        """
+        if self.cache is None:
+            return await self._parse_remote(file_path)
+
+        key = ParseCache.make_key(file_sha256(file_path), self.parser_settings)
+        cached = self.cache.get(key)
+        if cached is not None:
+            print(f"[DocumentParser] Cache hit for {os.path.basename(file_path)} ({key[:12]})")
+            return cached.model_copy(update={"file_path": file_path})
+
+        parsed = await self._parse_remote(file_path)
+        self.cache.put(key, parsed)
+        return parsed
+
+    async def _parse_remote(self, file_path: str) -> ParsedDocument:
+        json_result = await self.parser.aget_json(file_path)
+        image_paths = await self._download_images(json_result)
+
+        pages = []
+        job_id = None
+        for result in json_result:
+            job_id = job_id or result.get("job_id")
+            # aget_json trả về [{"job_id", "pages": [...]}]; bản cũ trả thẳng list pages
+            for i, page_data in enumerate(result.get("pages", [result])):
+                pages.append(self._build_page(page_data, i + 1, image_paths))
+
+        print(f"[DocumentParser] Parsed {len(pages)} pages from {os.path.basename(file_path)}")
+        return ParsedDocument(file_path=file_path, job_id=job_id, pages=pages)
+
+    async def _download_images(self, json_result: List[Dict[str, Any]]) -> Dict[str, str]:
+        """Tải image blobs của job về thư mục tạm, trả về {image name: base64}."""
+        if not any(page.get("images") for r in json_result for page in r.get("pages", [])):
+            return {}
+
+        blobs = {}
+        with tempfile.TemporaryDirectory(prefix="hyena_images_") as download_path:
+            try:
+                assets = await self.parser.aget_images(json_result, download_path=download_path)
+            except Exception as e:
+                print(f"[DocumentParser] Image download failed: {e}")
+                return {}
+            for asset in assets:
+                path = asset.get("path")
+                if path and os.path.exists(path):
+                    with open(path, "rb") as f:
+                        blobs[asset["name"]] = base64.b64encode(f.read()).decode("ascii")
+        return blobs
+
+    def _build_page(
+        self,
+        page_data: Dict[str, Any],
+        fallback_page_num: int,
+        image_blobs: Dict[str, str],
+    ) -> ParsedPage:
+        page_num = int(page_data.get("page", fallback_page_num))
+
+        tables = [
+            item["md"].strip()
+            for item in page_data.get("items", [])
+            if item.get("type") == "table" and item.get("md")
+        ]
+
+        images = []
+        for img_idx, img in enumerate(page_data.get("images", [])):
+            data = img.get("data") or image_blobs.get(img.get("name", ""))
+            if not data:
+                continue
+            images.append(ParsedImage(
+                page_num=page_num,
+                index=img_idx,
+                name=img.get("name"),
+                data=data,
+                width=img.get("width"),
+                height=img.get("height"),
+            ))
+
+        return ParsedPage(
+            page_num=page_num,
+            markdown=page_data.get("md") or page_data.get("text", ""),
+            tables=tables,
+            images=images,
+        )
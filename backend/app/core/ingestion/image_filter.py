@@ -0,0 +1,110 @@
+import hashlib
+import io
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from backend.app.config import get_settings
+
+settings = get_settings()
+
+
+def dhash(img: Image.Image, size: int = 8) -> int:
+    """
+    Difference hash 64-bit: so sánh độ sáng các pixel kề nhau trên ảnh grayscale 9x8.
+    Ảnh giống nhau (resize, nén lại, đổi màu nhẹ) → hash gần nhau theo Hamming distance.
+    """
+    small = img.convert("L").resize((size + 1, size), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+@dataclass
+class FilteredImage:
+    image_bytes: bytes
+    phash: str     # dHash — chỉ dùng để bỏ ảnh lặp trong document
+    sha256: str    # hash nội dung — key của CaptionCache
+
+
+@dataclass
+class FilterResult:
+    kept: List[Tuple[int, FilteredImage]] = field(default_factory=list)  # (index trong input, image)
+    dropped: Dict[str, int] = field(default_factory=dict)               # reason → count
+
+    def drop(self, reason: str):
+        self.dropped[reason] = self.dropped.get(reason, 0) + 1
+
+
+class ImagePreFilter:
+    """
+    Lọc ảnh local (Pillow) trước khi gọi vision model:
+    - Quá nhỏ / tỉ lệ quá dẹt → icon, đường kẻ, banner
+    - Entropy màu thấp → ảnh gần như 1 màu, logo đơn giản
+    - Perceptual hash trùng (Hamming ≤ image_dup_distance) với ảnh trước đó trong document
+      → logo/header lặp lại trên mọi trang chỉ giữ lần đầu
+    """
+
+    def __init__(
+        self,
+        min_width: Optional[int] = None,
+        min_height: Optional[int] = None,
+        max_aspect_ratio: Optional[float] = None,
+        min_entropy: Optional[float] = None,
+        dup_distance: Optional[int] = None,
+    ):
+        self.min_width = min_width if min_width is not None else settings.image_min_width
+        self.min_height = min_height if min_height is not None else settings.image_min_height
+        self.max_aspect_ratio = max_aspect_ratio if max_aspect_ratio is not None else settings.image_max_aspect_ratio
+        self.min_entropy = min_entropy if min_entropy is not None else settings.image_min_entropy
+        self.dup_distance = dup_distance if dup_distance is not None else settings.image_dup_distance
+
+    def run(self, images: List[bytes]) -> FilterResult:
+        """CPU-bound (decode + resize) → gọi qua asyncio.to_thread."""
+        result = FilterResult()
+        seen: List[int] = []
+
+        for i, image_bytes in enumerate(images):
+            try:
+                img = Image.open(io.BytesIO(image_bytes))
+                img.load()
+            except Exception:
+                result.drop("unreadable")
+                continue
+
+            width, height = img.size
+            if width < self.min_width or height < self.min_height:
+                result.drop("too_small")
+                continue
+            if max(width, height) / max(1, min(width, height)) > self.max_aspect_ratio:
+                result.drop("aspect_ratio")
+                continue
+
+            img.thumbnail((256, 256))
+            if img.convert("RGB").entropy() < self.min_entropy:
+                result.drop("low_entropy")
+                continue
+
+            value = dhash(img)
+            if any(hamming(value, other) <= self.dup_distance for other in seen):
+                result.drop("duplicate")
+                continue
+            seen.append(value)
+
+            result.kept.append((i, FilteredImage(
+                image_bytes=image_bytes,
+                phash=f"{value:016x}",
+                sha256=hashlib.sha256(image_bytes).hexdigest(),
+            )))
+
+        return result
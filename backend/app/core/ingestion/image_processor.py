@@ -1,11 +1,18 @@
+import asyncio
 import base64
-import uuid
-from typing import Any, Dict, List
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
 
 import google.generativeai as genai
-from llama_parse import LlamaParse
+from google.api_core import exceptions as google_exceptions
 
 from backend.app.config import get_settings
+from backend.app.core.async_utils import TokenBucket, retry_with_backoff
+from backend.app.core.ingestion.caption_cache import CaptionCache
+from backend.app.core.ingestion.chunk_ids import assign_chunk_ids
+from backend.app.core.ingestion.image_filter import ImagePreFilter
+from backend.app.models.parsed_document import ParsedDocument
 
 settings = get_settings()
 
@@ -27,34 +34,104 @@ If this is not a chart/graph (e.g. logo, signature, photo), respond:
 {"caption": null, "key_data": null, "chart_type": "non_chart"}
 """
 
+# Lỗi tạm thời của Gemini API → retry với backoff; lỗi khác (ảnh hỏng, JSON sai) → bỏ qua ảnh
+RETRYABLE_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+)
+
+
+def parse_caption_response(text: str) -> Dict:
+    text = text.strip()
+    # Bỏ markdown code block nếu có
+    if text.startswith("```"):
+        text = text.split("```")[1]
+        if text.startswith("json"):
+            text = text[4:]
+    return json.loads(text)
+
+
+class GeminiVisionBackend:
+    """Caption ảnh bằng Gemini (async generate_content_async, không block event loop)."""
+
+    def __init__(self, model: Optional[str] = None):
+        genai.configure(api_key=settings.google_api_key)
+        self.model = model or settings.vision_model
+        self.vision_model = genai.GenerativeModel(self.model)
+
+    async def caption(self, image_bytes: bytes) -> Dict:
+        response = await self.vision_model.generate_content_async(
+            [
+                CAPTION_PROMPT,
+                {"mime_type": "image/png", "data": image_bytes},
+            ]
+        )
+        return parse_caption_response(response.text)
+
+
+class LocalVisionBackend:
+    """
+    Stand-in vision backend chạy local, không gọi network — dùng cho tests/dev.
+    Caption deterministic theo nội dung ảnh; `latency` giả lập thời gian round-trip.
+    """
+
+    def __init__(self, latency: float = 0.0, model: str = "local-vision"):
+        self.latency = latency
+        self.model = model
+
+    async def caption(self, image_bytes: bytes) -> Dict:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        digest = hashlib.sha256(image_bytes).hexdigest()[:12]
+        return {
+            "caption": f"Chart {digest} ({len(image_bytes)} bytes)",
+            "key_data": f"sha256:{digest}",
+            "chart_type": "other",
+        }
+
+
+def get_vision_backend():
+    if settings.vision_backend == "local":
+        return LocalVisionBackend()
+    return GeminiVisionBackend()
+
 
 class ImageProcessor:
     """
-    Extract images từ PDF qua LlamaParse → dùng Gemini 2.0 Flash caption.
+    Lấy images từ ParsedDocument (LlamaParse) → dùng Gemini 2.0 Flash caption.
     Chỉ lưu chunks cho ảnh có ý nghĩa (charts/graphs), bỏ qua logo/ảnh trang trí.
+
+    Pre-filter local (ImagePreFilter) bỏ icon/logo/ảnh lặp lại (perceptual hash) trước khi gọi model;
+    caption lưu theo sha256 nội dung ảnh (CaptionCache) → dùng lại giữa các documents.
+
+    Captioning chạy đồng thời:
+    - Tối đa `caption_concurrency` requests in-flight (semaphore)
+    - Token bucket giới hạn tốc độ gửi (`caption_rate_per_sec`, burst `caption_burst`)
+    - Retry quota/5xx/timeout với exponential backoff + jitter
     """
 
-    def __init__(self):
-        self.parser = LlamaParse(
-            api_key=settings.llama_cloud_api_key,
-            result_type="markdown",
-            language="vi",
-            verbose=False,
-            extract_images=True,
-        )
-        genai.configure(api_key=settings.google_api_key)
-        self.vision_model = genai.GenerativeModel("gemini-2.0-flash-exp")
+    def __init__(self, backend=None, cache: Optional[CaptionCache] = None):
+        self.backend = backend or get_vision_backend()
+        if cache is None and settings.caption_cache_enabled:
+            cache = CaptionCache()
+        self.cache = cache
+        self.prefilter = ImagePreFilter()
+        self.concurrency = settings.caption_concurrency
+        self.max_retries = settings.caption_max_retries
+        self.rate_limiter = TokenBucket(settings.caption_rate_per_sec, settings.caption_burst)
 
     async def process(
         self,
-        file_path: str,
+        parsed: ParsedDocument,
         metadata: Dict[str, Any],
     ) -> List[Dict[str, Any]]:
         """
         Extract images và generate captions.
 
         Returns:
-            List of image chunks với caption làm content:
+            List of image chunks với caption làm content, theo thứ tự page/image:
             [
                 {
                     "id": "uuid",
@@ -68,64 +145,90 @@ class ImageProcessor:
                 }
             ]
         """
-        # LlamaParse trả về images kèm theo documents
-        json_result = await self.parser.aget_json(file_path)
-        chunks = []
-
-        for page_data in json_result:
-            page_num = page_data.get("page", 1)
-            images = page_data.get("images", [])
-
-            for img_idx, img_data in enumerate(images):
-                # img_data chứa base64 image
-                img_b64 = img_data.get("data", "")
-                if not img_b64:
-                    continue
-
-                caption_data = self._caption_image(img_b64)
-
-                # Bỏ qua ảnh không phải chart
-                if not caption_data.get("caption"):
-                    continue
-
-                content = f"{caption_data['caption']}\n\nKey data: {caption_data.get('key_data', '')}"
-                img_path = f"uploads/{metadata.get('doc_id', 'unknown')}_page{page_num}_img{img_idx}.png"
+        images = [image for page in parsed.pages for image in page.images]
+        decoded = []
+        for image in images:
+            try:
+                decoded.append(base64.b64decode(image.data))
+            except Exception:
+                decoded.append(b"")
+
+        # Decode + hash bằng Pillow là CPU-bound → chạy trong thread
+        filtered = await asyncio.to_thread(self.prefilter.run, decoded)
+        kept = filtered.kept
+        digests = [item.sha256 for _, item in kept]
+
+        cached = await self.cache.aget_many(self.backend.model, digests) if self.cache else [None] * len(kept)
+        missing = [k for k, caption in enumerate(cached) if caption is None]
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _run(image_bytes: bytes) -> Optional[Dict]:
+            async with semaphore:
+                return await self._caption_image(image_bytes)
+
+        # gather giữ thứ tự input → chunks vẫn theo page order
+        fresh = await asyncio.gather(*(_run(kept[k][1].image_bytes) for k in missing))
+        for k, caption_data in zip(missing, fresh):
+            cached[k] = caption_data
+
+        # Chỉ cache kết quả thật từ model (kể cả non_chart), không cache lỗi
+        stored = [(k, caption) for k, caption in zip(missing, fresh) if caption is not None]
+        if self.cache and stored:
+            await self.cache.aset_many(
+                self.backend.model,
+                [digests[k] for k, _ in stored],
+                [caption for _, caption in stored],
+            )
 
-                chunk = {
-                    "id": str(uuid.uuid4()),
-                    "content": content,
-                    "metadata": {
-                        **metadata,
-                        "page_num": page_num,
-                        "chunk_type": "image_caption",
-                        "chart_type": caption_data.get("chart_type", "other"),
-                        "image_path": img_path,
-                    },
-                }
-                chunks.append(chunk)
+        dropped = ", ".join(f"{reason}={n}" for reason, n in sorted(filtered.dropped.items())) or "none"
+        print(
+            f"[ImageProcessor] {len(images)} images: dropped {sum(filtered.dropped.values())} by pre-filter ({dropped}), "
+            f"{len(kept) - len(missing)} cached, {len(missing)} sent to vision model"
+        )
 
-        print(f"[ImageProcessor] Captioned {len(chunks)} image chunks")
+        chunks = []
+        for (i, _), caption_data in zip(kept, cached):
+            image = images[i]
+            # Bỏ qua ảnh không phải chart / caption lỗi
+            if not caption_data or not caption_data.get("caption"):
+                continue
+
+            content = f"{caption_data['caption']}\n\nKey data: {caption_data.get('key_data', '')}"
+            img_path = f"uploads/{metadata.get('doc_id', 'unknown')}_page{image.page_num}_img{image.index}.png"
+
+            chunk = {
+                "content": content,
+                "metadata": {
+                    **metadata,
+                    "page_num": image.page_num,
+                    "chunk_type": "image_caption",
+                    "chart_type": caption_data.get("chart_type", "other"),
+                    "image_path": img_path,
+                },
+            }
+            chunks.append(chunk)
+        assign_chunk_ids(chunks)
+
+        print(f"[ImageProcessor] Captioned {len(chunks)}/{len(images)} image chunks")
         return chunks
 
-    def _caption_image(self, image_b64: str) -> Dict:
-        """Gọi Gemini để caption ảnh."""
-        import json
+    async def _caption_image(self, image_bytes: bytes) -> Optional[Dict]:
+        """Caption 1 ảnh qua vision backend (rate-limited, retry lỗi tạm thời). Lỗi → None."""
+
+        async def _call():
+            await self.rate_limiter.acquire()
+            return await self.backend.caption(image_bytes)
 
         try:
-            image_bytes = base64.b64decode(image_b64)
-            response = self.vision_model.generate_content(
-                [
-                    CAPTION_PROMPT,
-                    {"mime_type": "image/png", "data": image_bytes},
-                ]
+            return await retry_with_backoff(
+                _call,
+                retry_on=RETRYABLE_ERRORS,
+                max_retries=self.max_retries,
+                base_delay=1.0,
+                max_delay=60.0,
+                label="ImageProcessor",
             )
-            text = response.text.strip()
-            # Bỏ markdown code block nếu có
-            if text.startswith("```"):
-                text = text.split("```")[1]
-                if text.startswith("json"):
-                    text = text[4:]
-            return json.loads(text)
         except Exception as e:
             print(f"[ImageProcessor] Caption failed: {e}")
-            return {"caption": None, "key_data": None, "chart_type": "non_chart"}
\ No newline at end of file
+            return None
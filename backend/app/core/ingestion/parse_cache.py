@@ -0,0 +1,173 @@
+import fcntl
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from backend.app.config import get_settings
+from backend.app.models.parsed_document import ParsedDocument
+
+settings = get_settings()
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(file_path: str) -> str:
+    """SHA-256 của nội dung file, đọc theo từng chunk 1MB."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ParseCache:
+    """
+    Content-addressed on-disk cache cho ParsedDocument.
+
+    Key = sha256(file bytes) + sha256(parser settings), nên cùng 1 PDF upload nhiều lần
+    (khác tên/doc_id) chỉ parse qua LlamaParse 1 lần. Đổi parser settings → key mới.
+
+    Layout:
+        {cache_dir}/{key}.json   ParsedDocument JSON, mtime = lần dùng gần nhất (LRU)
+        {cache_dir}/stats.json   hit/miss/eviction counters, dùng chung giữa các worker process
+    """
+
+    STATS_FILE = "stats.json"
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.cache_dir = cache_dir or settings.parse_cache_dir
+        self.max_bytes = max_bytes if max_bytes is not None else settings.parse_cache_max_mb * 1024 * 1024
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(file_hash: str, parser_settings: Dict[str, Any]) -> str:
+        fingerprint = hashlib.sha256(
+            json.dumps(parser_settings, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+        return f"{file_hash}-{fingerprint[:16]}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[ParsedDocument]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                parsed = ParsedDocument.model_validate_json(f.read())
+        except FileNotFoundError:
+            self._bump("misses")
+            return None
+        except ValueError as e:
+            print(f"[ParseCache] Corrupt entry {key}: {e}, dropping")
+            self.delete(key)
+            self._bump("misses")
+            return None
+
+        os.utime(path)  # đánh dấu vừa dùng cho LRU
+        self._bump("hits")
+        return parsed
+
+    def put(self, key: str, parsed: ParsedDocument):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(parsed.model_dump_json())
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def delete(self, key: str) -> bool:
+        try:
+            os.remove(self._path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Danh sách entries, mới dùng gần nhất trước."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json") or name == self.STATS_FILE:
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append({
+                "key": name[:-len(".json")],
+                "size_bytes": st.st_size,
+                "last_used": st.st_mtime,
+            })
+        entries.sort(key=lambda e: e["last_used"], reverse=True)
+        return entries
+
+    def evict(self) -> int:
+        """Xoá entries ít dùng nhất đến khi tổng dung lượng <= max_bytes."""
+        entries = self.entries()
+        total = sum(e["size_bytes"] for e in entries)
+        evicted = 0
+        while entries and total > self.max_bytes:
+            oldest = entries.pop()
+            if self.delete(oldest["key"]):
+                total -= oldest["size_bytes"]
+                evicted += 1
+        if evicted:
+            self._bump("evictions", evicted)
+            print(f"[ParseCache] Evicted {evicted} entries")
+        return evicted
+
+    def purge(self, older_than_seconds: Optional[float] = None) -> int:
+        cutoff = time.time() - older_than_seconds if older_than_seconds is not None else None
+        removed = 0
+        for entry in self.entries():
+            if cutoff is None or entry["last_used"] < cutoff:
+                removed += self.delete(entry["key"])
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._locked_stats() as counters:
+            counters = dict(counters)
+        entries = self.entries()
+        lookups = counters.get("hits", 0) + counters.get("misses", 0)
+        return {
+            "cache_dir": os.path.abspath(self.cache_dir),
+            "entries": len(entries),
+            "size_bytes": sum(e["size_bytes"] for e in entries),
+            "max_bytes": self.max_bytes,
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "evictions": counters.get("evictions", 0),
+            "hit_rate": round(counters.get("hits", 0) / lookups, 4) if lookups else 0.0,
+        }
+
+    def reset_stats(self):
+        with self._locked_stats() as counters:
+            counters.clear()
+
+    def _bump(self, counter: str, amount: int = 1):
+        try:
+            with self._locked_stats() as counters:
+                counters[counter] = counters.get(counter, 0) + amount
+        except OSError as e:
+            print(f"[ParseCache] Failed to update stats: {e}")
+
+    @contextmanager
+    def _locked_stats(self):
+        """Đọc-sửa-ghi stats.json dưới flock để nhiều worker process không ghi đè nhau."""
+        path = os.path.join(self.cache_dir, self.STATS_FILE)
+        with open(path, "a+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                counters = json.loads(raw) if raw.strip() else {}
+                before = dict(counters)
+                yield counters
+                if counters != before:
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(counters))
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -1,10 +1,37 @@
-from typing import Any, Dict
+import asyncio
+import time
+import weakref
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 
+from backend.app.config import get_settings
+from backend.app.core.generation.answer_cache import AnswerCache
+from backend.app.core.ingestion.document_parser import DocumentParser
 from backend.app.core.ingestion.text_processor import TextProcessor
 from backend.app.core.ingestion.table_processor import TableProcessor
 from backend.app.core.ingestion.image_processor import ImageProcessor
-from backend.app.core.retrieval.embedder import Embedder
+from backend.app.core.ingestion.progress import ProgressReporter
+from backend.app.core.retrieval.embedder import AsyncEmbedder
 from backend.app.core.retrieval.qdrant_client import QdrantClientWrapper
+from backend.app.core.retrieval.sparse_encoder import SparseEncoder
+from backend.app.models.parsed_document import ParsedDocument
+
+settings = get_settings()
+
+EXTRACT_STAGES = ("text", "table", "image")
+
+# Giới hạn số document chạy cùng 1 extract stage trong cả process (mọi IngestionPipeline dùng chung).
+# Semaphore gắn với event loop tạo ra nó → cache theo loop giống clients.py.
+_stage_limits: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+
+def get_stage_limit(stage: str) -> asyncio.Semaphore:
+    """Process-level semaphore (extract_stage_concurrency) cho extract stage trên event loop hiện tại."""
+    loop = asyncio.get_running_loop()
+    limits = _stage_limits.get(loop)
+    if limits is None:
+        limits = {s: asyncio.Semaphore(settings.extract_stage_concurrency) for s in EXTRACT_STAGES}
+        _stage_limits[loop] = limits
+    return limits[stage]
 
 
 class IngestionPipeline:
@@ -12,17 +39,25 @@ class IngestionPipeline:
     Orchestrator cho toàn bộ ingestion pipeline.
 
     Flow:
-    1. Parse PDF → text chunks + table chunks + image chunks (song song)
-    2. Embed tất cả chunks
-    3. Upsert vào các Qdrant collections tương ứng
+    1. Parse PDF 1 lần (DocumentParser) → ParsedDocument dùng chung
+    2. Extract text chunks + table chunks + image chunks (song song), chunk IDs deterministic
+    3. Diff với chunks đã có của document → chỉ embed chunks mới/đổi nội dung
+    4. Embed + bulk upsert (streaming, batches song song), xóa chunks cũ không còn trong document
+    5. Corpus đổi → xóa cached answers có filters khớp với document (AnswerCache.invalidate)
+
+    Mỗi bước publish progress events (ProgressReporter → Redis pub/sub + registry).
+    process_document chạy cả flow trong 1 process; Celery chain (workers/tasks.py) gọi
+    từng stage method (parse / extract / caption / diff + embed / store) trên queue riêng.
     """
 
     def __init__(self):
+        self.parser = DocumentParser()
         self.text_processor = TextProcessor()
         self.table_processor = TableProcessor()
         self.image_processor = ImageProcessor()
-        self.embedder = Embedder()
+        self.embedder = AsyncEmbedder()
         self.qdrant = QdrantClientWrapper()
+        self.sparse_encoder = SparseEncoder() if settings.hybrid_search else None
 
         # Đảm bảo collections tồn tại
         self.qdrant.ensure_collections()
@@ -32,6 +67,7 @@ class IngestionPipeline:
         file_path: str,
         doc_id: str,
         metadata: Dict[str, Any],
+        progress: Optional[ProgressReporter] = None,
     ) -> Dict[str, Any]:
         """
         Process 1 document hoàn chỉnh qua 3 pipelines.
@@ -40,6 +76,7 @@ class IngestionPipeline:
             file_path: Đường dẫn file PDF
             doc_id: UUID document
             metadata: {company, year, quarter, original_filename}
+            progress: reporter dùng chung với Celery task (None → tạo mới cho doc_id)
 
         Returns:
             {
@@ -48,50 +85,63 @@ class IngestionPipeline:
                 "text_chunks": 45,
                 "table_chunks": 20,
                 "image_chunks": 15,
-                "status": "completed"
+                "upserted_chunks": 12,    # mới / đổi nội dung
+                "unchanged_chunks": 68,   # đã có trong Qdrant, không embed lại
+                "deleted_chunks": 3,      # không còn trong document
+                "upsert_points_per_sec": 950.0,
+                "status": "completed",
+                "timings": {"parse": 12.4, "extract_text": 0.3, ..., "total": 31.2}  # seconds
             }
         """
         metadata["doc_id"] = doc_id
+        progress = progress or ProgressReporter(doc_id)
         print(f"\n[Pipeline] Starting ingestion for doc_id={doc_id}")
+        timings: Dict[str, float] = {}
+        started = time.perf_counter()
 
-        # ── 1. Extract ──────────────────────────────────────────────
-        print("[Pipeline] Step 1/3: Extracting content...")
-        text_chunks = await self.text_processor.process(file_path, metadata)
-        table_chunks = await self.table_processor.process(file_path, metadata)
-        image_chunks = await self.image_processor.process(file_path, metadata)
+        # ── 1. Parse ────────────────────────────────────────────────
+        print("[Pipeline] Step 1/4: Parsing PDF...")
+        parsed = await self.parse(file_path, timings, progress)
 
-        print(f"[Pipeline] Extracted: {len(text_chunks)} text, {len(table_chunks)} tables, {len(image_chunks)} images")
+        # ── 2. Extract ──────────────────────────────────────────────
+        print("[Pipeline] Step 2/4: Extracting content...")
+        t0 = time.perf_counter()
+        (text_chunks, table_chunks), image_chunks = await asyncio.gather(
+            self.extract(parsed, metadata, timings, progress),
+            self.caption(parsed, metadata, timings, progress),
+        )
+        timings["extract"] = time.perf_counter() - t0
 
-        # ── 2. Embed ────────────────────────────────────────────────
-        print("[Pipeline] Step 2/3: Embedding chunks...")
-
-        def _embed_and_attach(chunks):
-            if not chunks:
-                return
-            contents = [c["content"] for c in chunks]
-            embeddings = self.embedder.embed_batch(contents)
-            for chunk, vector in zip(chunks, embeddings):
-                chunk["vector"] = vector
-                chunk["payload"] = {
-                    "content": chunk["content"],
-                    "metadata": chunk["metadata"],
-                }
+        print(f"[Pipeline] Extracted: {len(text_chunks)} text, {len(table_chunks)} tables, {len(image_chunks)} images")
 
-        _embed_and_attach(text_chunks)
-        _embed_and_attach(table_chunks)
-        _embed_and_attach(image_chunks)
+        # ── 3. Diff ─────────────────────────────────────────────────
+        print("[Pipeline] Step 3/4: Diffing against stored chunks...")
+        collections = self.collections(text_chunks, table_chunks, image_chunks)
+        new_chunks, stale_ids = await self.diff(collections, doc_id, timings)
+        progress.start_store(sum(len(chunks) for chunks in new_chunks.values()))
 
-        # ── 3. Store ────────────────────────────────────────────────
-        print("[Pipeline] Step 3/3: Storing to Qdrant...")
-        if text_chunks:
-            self.qdrant.upsert_chunks(self.qdrant.TEXT_COLLECTION, text_chunks)
-        if table_chunks:
-            self.qdrant.upsert_chunks(self.qdrant.TABLE_COLLECTION, table_chunks)
-        if image_chunks:
-            self.qdrant.upsert_chunks(self.qdrant.IMAGE_COLLECTION, image_chunks)
+        # ── 4. Embed + Store (streaming) ────────────────────────────
+        print("[Pipeline] Step 4/4: Embedding + storing to Qdrant...")
+        timings["embed"] = 0.0
+        # Embed từng slice và stream thẳng vào bulk loader → vectors không giữ lại cho cả document
+        await self.store(
+            {
+                name: self.points(self.embed(chunks, timings, progress))
+                for name, chunks in new_chunks.items()
+                if chunks
+            },
+            stale_ids,
+            metadata,
+            timings,
+            progress,
+        )
+        timings["total"] = time.perf_counter() - started
 
         total = len(text_chunks) + len(table_chunks) + len(image_chunks)
-        print(f"[Pipeline] Completed! Total chunks stored: {total}")
+        upserted = sum(len(chunks) for chunks in new_chunks.values())
+        deleted = sum(len(ids) for ids in stale_ids.values())
+        print(f"[Pipeline] Completed! {total} chunks: {upserted} upserted, {total - upserted} unchanged, {deleted} stale deleted")
+        print(f"[Pipeline] Timings: {self._round_timings(timings)}")
 
         return {
             "doc_id": doc_id,
@@ -99,5 +149,213 @@ class IngestionPipeline:
             "text_chunks": len(text_chunks),
             "table_chunks": len(table_chunks),
             "image_chunks": len(image_chunks),
+            "upserted_chunks": upserted,
+            "unchanged_chunks": total - upserted,
+            "deleted_chunks": deleted,
+            "upsert_points_per_sec": round(upserted / timings["store"], 1) if upserted else 0.0,
             "status": "completed",
-        }
\ No newline at end of file
+            "timings": self._round_timings(timings),
+        }
+
+    # ── Stages (dùng bởi process_document và các Celery stage tasks) ──
+
+    async def parse(
+        self,
+        file_path: str,
+        timings: Dict[str, float],
+        progress: ProgressReporter,
+    ) -> ParsedDocument:
+        t0 = time.perf_counter()
+        await progress.stage("parse", "Parsing PDF", fraction=0.0)
+        parsed = await self.parser.parse(file_path)
+        timings["parse"] = time.perf_counter() - t0
+        await progress.stage("parse", f"Parsed {len(parsed.pages)} pages", pages=len(parsed.pages))
+        return parsed
+
+    async def extract(
+        self,
+        parsed: ParsedDocument,
+        metadata: Dict[str, Any],
+        timings: Dict[str, float],
+        progress: ProgressReporter,
+    ) -> List[List[Dict[str, Any]]]:
+        """Text + table chunks (local, không gọi API trả phí)."""
+        return await self._extract(("text", "table"), parsed, metadata, timings, progress)
+
+    async def caption(
+        self,
+        parsed: ParsedDocument,
+        metadata: Dict[str, Any],
+        timings: Dict[str, float],
+        progress: ProgressReporter,
+    ) -> List[Dict[str, Any]]:
+        """Image chunks: pre-filter + caption qua vision backend (Gemini)."""
+        (image_chunks,) = await self._extract(("image",), parsed, metadata, timings, progress)
+        return image_chunks
+
+    def collections(
+        self,
+        text_chunks: List[Dict[str, Any]],
+        table_chunks: List[Dict[str, Any]],
+        image_chunks: List[Dict[str, Any]],
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        return {
+            self.qdrant.TEXT_COLLECTION: text_chunks,
+            self.qdrant.TABLE_COLLECTION: table_chunks,
+            self.qdrant.IMAGE_COLLECTION: image_chunks,
+        }
+
+    async def diff(
+        self,
+        collections: Dict[str, List[Dict[str, Any]]],
+        doc_id: str,
+        timings: Dict[str, float],
+    ) -> Tuple[Dict[str, List[Dict[str, Any]]], Dict[str, List[str]]]:
+        """
+        Chunk IDs deterministic → chunk đã có trong Qdrant (cùng nội dung + vị trí) không cần embed/upsert lại.
+
+        Returns:
+            (new_chunks, stale_ids) theo collection
+        """
+        t0 = time.perf_counter()
+        existing = await asyncio.gather(
+            *(asyncio.to_thread(self.qdrant.existing_ids, name, doc_id) for name in collections)
+        )
+        new_chunks: Dict[str, List[Dict[str, Any]]] = {}
+        stale_ids: Dict[str, List[str]] = {}
+        for (name, chunks), existing_ids in zip(collections.items(), existing):
+            current_ids = {c["id"] for c in chunks}
+            new_chunks[name] = [c for c in chunks if c["id"] not in existing_ids]
+            stale_ids[name] = sorted(existing_ids - current_ids)
+        timings["diff"] = time.perf_counter() - t0
+        return new_chunks, stale_ids
+
+    async def embed(
+        self,
+        chunks: List[Dict[str, Any]],
+        timings: Dict[str, float],
+        progress: ProgressReporter,
+    ) -> AsyncIterator[Tuple[List[Dict[str, Any]], List[List[float]]]]:
+        """Async generator: embed chunks theo slice (upsert_batch_size * upsert_parallel), yield (chunks, vectors)."""
+        step = settings.upsert_batch_size * settings.upsert_parallel
+        for i in range(0, len(chunks), step):
+            t0 = time.perf_counter()
+            batch = chunks[i:i + step]
+            vectors = await self.embedder.embed_batch([c["content"] for c in batch])
+            timings["embed"] = timings.get("embed", 0.0) + time.perf_counter() - t0
+            await progress.advance("embed", len(batch))
+            yield batch, vectors
+
+    async def points(
+        self,
+        batches: AsyncIterator[Tuple[List[Dict[str, Any]], List[List[float]]]],
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        (chunks, vectors) → points {id, vector, sparse_vector, payload} cho aupsert_stream.
+        BM25 sparse vectors (hybrid search) tính local trong thread, không cần checkpoint.
+        """
+        async for batch, vectors in batches:
+            contents = [c["content"] for c in batch]
+            if self.sparse_encoder:
+                sparse_vectors = await asyncio.to_thread(self.sparse_encoder.encode_documents, contents)
+            else:
+                sparse_vectors = [None] * len(batch)
+            for chunk, vector, sparse_vector in zip(batch, vectors, sparse_vectors):
+                yield {
+                    "id": chunk["id"],
+                    "vector": vector,
+                    "sparse_vector": sparse_vector,
+                    "payload": {
+                        "content": chunk["content"],
+                        "metadata": chunk["metadata"],
+                    },
+                }
+
+    async def store(
+        self,
+        streams: Dict[str, AsyncIterator[Dict[str, Any]]],
+        stale_ids: Dict[str, List[str]],
+        metadata: Dict[str, Any],
+        timings: Dict[str, float],
+        progress: ProgressReporter,
+    ) -> Tuple[int, int]:
+        """
+        Bulk upsert points của từng collection (song song), xóa chunks cũ, invalidate answer cache.
+        Chỉ truyền streams của collections có chunks mới.
+
+        Returns:
+            (upserted, deleted)
+        """
+        t0 = time.perf_counter()
+        results = await asyncio.gather(
+            *(
+                self.qdrant.aupsert_stream(name, stream, on_batch=lambda n: progress.advance("upsert", n))
+                for name, stream in streams.items()
+            )
+        )
+        for name, ids in stale_ids.items():
+            # Xóa sau khi upsert → không có khoảng trống document mất hết chunks
+            await asyncio.to_thread(self.qdrant.delete_ids, name, ids)
+        timings["store"] = time.perf_counter() - t0
+
+        upserted = sum(result["points"] for result in results)
+        deleted = sum(len(ids) for ids in stale_ids.values())
+        if upserted or deleted:
+            await asyncio.to_thread(AnswerCache.invalidate, self.qdrant.client, metadata)
+        await progress.stage("finalize", f"Stored {upserted} new chunks, removed {deleted} stale")
+        return upserted, deleted
+
+    async def _extract(
+        self,
+        stages: Tuple[str, ...],
+        parsed: ParsedDocument,
+        metadata: Dict[str, Any],
+        timings: Dict[str, float],
+        progress: ProgressReporter,
+    ) -> List[List[Dict[str, Any]]]:
+        """Chạy đồng thời các processors (text / table / image) trên cùng ParsedDocument."""
+        processors = {
+            "text": self.text_processor.process,
+            "table": self.table_processor.process,
+            "image": self.image_processor.process,
+        }
+        results = await asyncio.gather(
+            *(
+                self._run_stage(stage, processors[stage], parsed, metadata, timings, progress)
+                for stage in stages
+            ),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results
+
+    async def _run_stage(
+        self,
+        stage: str,
+        process: Callable[..., Awaitable[List[Dict[str, Any]]]],
+        parsed: ParsedDocument,
+        metadata: Dict[str, Any],
+        timings: Dict[str, float],
+        progress: ProgressReporter,
+    ) -> List[Dict[str, Any]]:
+        async with get_stage_limit(stage):
+            t0 = time.perf_counter()
+            try:
+                chunks = await asyncio.wait_for(
+                    process(parsed, metadata),
+                    timeout=settings.extract_stage_timeout,
+                )
+            except asyncio.TimeoutError:
+                raise TimeoutError(
+                    f"Extract stage '{stage}' timed out after {settings.extract_stage_timeout}s"
+                )
+            finally:
+                timings[f"extract_{stage}"] = time.perf_counter() - t0
+        await progress.stage(f"extract_{stage}", f"Extracted {len(chunks)} {stage} chunks", chunks=len(chunks))
+        return chunks
+
+    @staticmethod
+    def _round_timings(timings: Dict[str, float]) -> Dict[str, float]:
+        return {name: round(seconds, 3) for name, seconds in timings.items()}
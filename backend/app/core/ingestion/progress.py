@@ -0,0 +1,110 @@
+import json
+import time
+from typing import Any, Dict, Iterable, Optional
+
+import redis
+
+from backend.app.core.clients import get_async_redis
+from backend.app.core.document_registry import DocumentRegistry
+
+# Pub/sub channel mỗi document; GET /documents/{doc_id}/events subscribe và đẩy xuống client qua SSE
+EVENTS_CHANNEL = "document:{}:events"
+
+# Tỉ trọng (%) của từng stage trong tiến độ tổng
+STAGE_WEIGHTS: Dict[str, float] = {
+    "parse": 30,
+    "extract_text": 5,
+    "extract_table": 5,
+    "extract_image": 5,
+    "embed": 25,
+    "upsert": 25,
+    "finalize": 5,
+}
+# Stages có đếm n/m (chunks) — tổng đặt bằng start_store()
+COUNTED_STAGES = ("embed", "upsert")
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+def events_channel(doc_id: str) -> str:
+    return EVENTS_CHANNEL.format(doc_id)
+
+
+class ProgressReporter:
+    """
+    Publish tiến độ ingestion của 1 document lên Redis pub/sub + lưu vào DocumentRegistry
+    (fields `progress`, `progress_percent`) để client kết nối muộn / polling vẫn thấy.
+
+    Events (JSON):
+        {"type": "progress", "doc_id": "...", "stage": "embed", "done": 120, "total": 300,
+         "percent": 61, "message": "Embedding 120/300 chunks", "ts": 1718000000.1}
+        {"type": "status", "doc_id": "...", "status": "completed", "percent": 100, ..., "ts": ...}
+
+    Events n/m chỉ publish khi percent tổng đổi → số events không tỉ lệ với số batches.
+    Redis lỗi → log rồi bỏ qua, không làm fail ingestion.
+    """
+
+    def __init__(self, doc_id: str, registry: Optional[DocumentRegistry] = None):
+        self.doc_id = doc_id
+        self.registry = registry or DocumentRegistry()
+        self._fractions = {stage: 0.0 for stage in STAGE_WEIGHTS}
+        self._counts = {stage: [0, 0] for stage in COUNTED_STAGES}
+        self._published_percent = -1
+
+    @property
+    def percent(self) -> int:
+        return int(sum(STAGE_WEIGHTS[stage] * fraction for stage, fraction in self._fractions.items()))
+
+    async def stage(self, stage: str, message: str, fraction: float = 1.0, **data: Any):
+        """Đánh dấu stage hoàn thành `fraction` (0..1) và publish event."""
+        self._fractions[stage] = max(0.0, min(fraction, 1.0))
+        await self._publish({"type": "progress", "stage": stage, "message": message, **data})
+
+    def resume(self, stages: Iterable[str]):
+        """Stages đã xong ở task trước (Celery chain) → percent tiếp tục từ đó thay vì về 0."""
+        for stage in stages:
+            self._fractions[stage] = 1.0
+
+    def start_store(self, total: int, stages: Iterable[str] = COUNTED_STAGES):
+        """Tổng số chunks sẽ embed + upsert; 0 → các stages coi như xong."""
+        for stage in stages:
+            self._counts[stage] = [0, total]
+            self._fractions[stage] = 0.0 if total else 1.0
+
+    async def advance(self, stage: str, n: int):
+        """`n` chunks nữa đã xong ở stage embed / upsert (gọi từ nhiều collections song song)."""
+        counts = self._counts[stage]
+        counts[0] = min(counts[0] + n, counts[1])
+        done, total = counts
+        self._fractions[stage] = done / total if total else 1.0
+        if self.percent == self._published_percent and done < total:
+            return
+        verb = "Embedding" if stage == "embed" else "Upserting"
+        await self._publish({
+            "type": "progress",
+            "stage": stage,
+            "done": done,
+            "total": total,
+            "message": f"{verb} {done}/{total} chunks",
+        })
+
+    async def status(self, status: str, **fields: Any):
+        """Đổi status trong registry (kèm fields như chunk counts / error) và publish status event."""
+        if status == "completed":
+            self._fractions = {stage: 1.0 for stage in STAGE_WEIGHTS}
+        message = {"processing": "Processing started", "completed": "Completed"}.get(status, status)
+        if status in ("failed", "retrying"):
+            message = f"{status.capitalize()}: {fields.get('error')}"
+        await self._publish({"type": "status", "status": status, "message": message, **fields}, fields=fields)
+
+    async def _publish(self, event: Dict[str, Any], fields: Optional[Dict[str, Any]] = None):
+        percent = self.percent
+        self._published_percent = percent
+        event = {"doc_id": self.doc_id, **event, "percent": percent, "ts": round(time.time(), 3)}
+        record = {"progress": event["message"], "progress_percent": percent, **(fields or {})}
+        if event["type"] == "status":
+            record["status"] = event["status"]
+        try:
+            await self.registry.update(self.doc_id, **record)
+            await get_async_redis().publish(events_channel(self.doc_id), json.dumps(event, ensure_ascii=False))
+        except redis.RedisError as e:
+            print(f"[Progress] Failed to publish {event['type']} for doc_id={self.doc_id}: {e}")
@@ -1,36 +1,23 @@
+import asyncio
 import re
-import uuid
 from typing import Any, Dict, List
 
-from llama_parse import LlamaParse
-
-from backend.app.config import get_settings
-
-settings = get_settings()
+from backend.app.core.ingestion.chunk_ids import assign_chunk_ids
+from backend.app.models.parsed_document import ParsedDocument
 
 
 class TableProcessor:
     """
-    Extract tables từ PDF qua LlamaParse → lưu dưới dạng Markdown.
+    Extract tables từ ParsedDocument (LlamaParse) → lưu dưới dạng Markdown.
 
     LlamaParse trả về Markdown, trong đó tables được render thành
     chuẩn Markdown table (| col1 | col2 |).
     Ta tách riêng từng bảng và tạo chunk độc lập.
     """
 
-    def __init__(self):
-        self.parser = LlamaParse(
-            api_key=settings.llama_cloud_api_key,
-            result_type="markdown",
-            language="vi",       # Hỗ trợ tiếng Việt
-            verbose=False,
-            # Yêu cầu LlamaParse giữ nguyên cấu trúc bảng
-            extract_tables=True,
-        )
-
     async def process(
         self,
-        file_path: str,
+        parsed: ParsedDocument,
         metadata: Dict[str, Any],
     ) -> List[Dict[str, Any]]:
         """
@@ -56,19 +43,27 @@ class TableProcessor:
                 }
             ]
         """
-        documents = await self.parser.aload_data(file_path)
+        chunks = await asyncio.to_thread(self._extract_chunks, parsed, metadata)
+        print(f"[TableProcessor] Extracted {len(chunks)} table chunks")
+        return chunks
+
+    def _extract_chunks(
+        self,
+        parsed: ParsedDocument,
+        metadata: Dict[str, Any],
+    ) -> List[Dict[str, Any]]:
         chunks = []
 
-        for i, doc in enumerate(documents):
-            page_num = int(doc.metadata.get("page_label", doc.metadata.get("page", i + 1)))
-            tables = self._extract_tables_from_markdown(doc.text)
+        for page in parsed.pages:
+            page_num = page.page_num
+            # Ưu tiên bảng LlamaParse đã nhận diện, fallback regex trên markdown
+            tables = page.tables or self._extract_tables_from_markdown(page.markdown)
 
             for table_idx, table_md in enumerate(tables):
                 headers, row_count, col_count = self._parse_table_info(table_md)
-                title = self._infer_title(table_md, doc.text)
+                title = self._infer_title(table_md, page.markdown)
 
                 chunk = {
-                    "id": str(uuid.uuid4()),
                     "content": table_md,
                     "metadata": {
                         **metadata,
@@ -83,8 +78,7 @@ class TableProcessor:
                 }
                 chunks.append(chunk)
 
-        print(f"[TableProcessor] Extracted {len(chunks)} table chunks")
-        return chunks
+        return assign_chunk_ids(chunks)
 
     def _extract_tables_from_markdown(self, text: str) -> List[str]:
         """Tách các Markdown tables từ text."""
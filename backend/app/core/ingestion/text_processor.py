@@ -1,25 +1,21 @@
-from llama_parse import LlamaParse
+import asyncio
+
+from llama_index.core import Document
 from llama_index.core.node_parser import SentenceSplitter
 from typing import List, Dict, Any
-import uuid
 from backend.app.config import get_settings
+from backend.app.core.ingestion.chunk_ids import assign_chunk_ids
+from backend.app.models.parsed_document import ParsedDocument
 
 settings = get_settings()
 
 class TextProcessor: 
     """
     Text processor from PDF: 
-    1. Parse PDF with LlamaParse
+    1. Read pages from the shared ParsedDocument (parsed once by DocumentParser)
     2. Chunk text with hierarchy
-    3. 
     """
     def __init__(self):
-        self.parser = LlamaParse(
-            api_key=settings.llama_cloud_api_key, 
-            result_type="markdown",
-            language="en",
-            verbose=True
-        )
         self.splitter = SentenceSplitter(
             chunk_size=settings.chunk_size,
             chunk_overlap=settings.chunk_overlap
@@ -27,14 +23,14 @@ class TextProcessor:
 
     async def process(
         self,
-        file_path: str, 
+        parsed: ParsedDocument, 
         metadata: Dict[str, Any]
     ) -> List[Dict[str, Any]]:
         """
-        Process PDF to text chunk
+        Process parsed PDF to text chunk
 
         Args: 
-            file_path: Path to PDF file
+            parsed: ParsedDocument from DocumentParser
             metadata: Dict content company, year, etc
         Returns: 
             List of text chunks (without embedding)
@@ -52,17 +48,26 @@ class TextProcessor:
                 }
             ]
         """
-        documents = await self.parser.aload_data(file_path)
+        # SentenceSplitter chạy CPU-bound → đẩy sang thread để không block event loop
+        chunks = await asyncio.to_thread(self._chunk_pages, parsed, metadata)
+        print(f"Processed {len(chunks)} text chunks")
+        return chunks
 
+    def _chunk_pages(
+        self,
+        parsed: ParsedDocument,
+        metadata: Dict[str, Any]
+    ) -> List[Dict[str, Any]]:
         chunks = []
 
-        for i, doc in enumerate(documents):
-            # LlamaParse dùng key "page_label" (string), fallback sang "page", rồi dùng index
-            page_num = int(doc.metadata.get("page_label", doc.metadata.get("page", i + 1)))
+        for page in parsed.pages:
+            if not page.markdown.strip():
+                continue
+            page_num = page.page_num
+            doc = Document(text=page.markdown, metadata={"page_label": str(page_num)})
             nodes = self.splitter.get_nodes_from_documents([doc])
             for node in nodes:
                 chunk = {
-                    "id": str(uuid.uuid4()),
                     "content": node.text,
                     "metadata": {
                         **metadata,  # doc_id, company, year, quarter
@@ -71,6 +76,4 @@ class TextProcessor:
                     }
                 }
                 chunks.append(chunk)
-        print(f"Processed {len(chunks)} text chunks")
-        return chunks
-        return chunks
\ No newline at end of file
+        return assign_chunk_ids(chunks)
\ No newline at end of file
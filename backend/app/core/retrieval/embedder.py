@@ -1,52 +1,231 @@
-from openai import OpenAI
-from typing import List
+from functools import lru_cache
+from typing import List, Optional
 import asyncio
+import hashlib
+import math
+import re
+
+import openai
 
 from backend.app.config import get_settings
+from backend.app.core.async_utils import retry_with_backoff
+from backend.app.core.clients import get_async_openai
+from backend.app.core.retrieval.embedding_cache import EmbeddingCache
 
 settings = get_settings()
 
-class Embedder: 
-    """ Wrapper for OpenAI Embeddings API.
+MAX_INPUT_TOKENS = 8191      # giới hạn 1 input của text-embedding-3-*
+MAX_BATCH_ITEMS = 2048       # giới hạn số inputs / request
+
+# Số chiều gốc của từng model; text-embedding-3-* hỗ trợ rút gọn (Matryoshka) qua param `dimensions`
+NATIVE_DIMS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+    "local-hashing": 1536,
+}
+
+
+def dimensions_kwargs(model: str, dim: int) -> dict:
+    """Chỉ gửi `dimensions` khi khác số chiều gốc (ada-002 không nhận param này)."""
+    return {} if dim == NATIVE_DIMS.get(model, dim) else {"dimensions": dim}
+
+
+def cache_model_name(model: str, dim: int) -> str:
+    """Namespace cho embedding/query caches: vectors khác số chiều không được dùng chung."""
+    return model if dim == NATIVE_DIMS.get(model, dim) else f"{model}@{dim}"
+
 
+def shorten_embedding(vector: List[float], dim: int) -> List[float]:
     """
-    def __init__(self):
-        self.client = OpenAI(api_key=settings.openai_api_key)
-        self.model = settings.embedding_model
-    def embed_documents(self, text: str) -> List[float]:
-        """
-        Embed 1 text
-        Args: 
-            text: Text to embed
-        Returns: 
-            List of floats (1536 dims)
-        """
-        response = self.client.embeddings.create(
+    Matryoshka: giữ `dim` chiều đầu rồi L2-normalize lại — tương đương embedding
+    API trả về với `dimensions=dim`, nên dùng được để migrate vectors đã lưu.
+    """
+    head = vector[:dim]
+    norm = math.sqrt(sum(v * v for v in head)) or 1.0
+    return [v / norm for v in head]
+
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+def _retry_after_seconds(error: BaseException) -> Optional[float]:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+@lru_cache
+def _get_encoding():
+    """tiktoken encoding cho text-embedding-3-*; None nếu không load được (offline)."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"[Embedder] tiktoken unavailable ({e}), using approximate token counts")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return max(1, len(text) // 3)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int = MAX_INPUT_TOKENS) -> str:
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[: max_tokens * 3]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def pack_by_token_budget(
+    texts: List[str],
+    max_tokens: int,
+    max_items: int = MAX_BATCH_ITEMS,
+) -> List[List[int]]:
+    """
+    Chia texts thành các batch (list index) sao cho tổng token mỗi batch <= max_tokens
+    và số item <= max_items. Giữ nguyên thứ tự.
+    """
+    batches: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for i, text in enumerate(texts):
+        n = min(count_tokens(text), MAX_INPUT_TOKENS)
+        if current and (current_tokens + n > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += n
+    if current:
+        batches.append(current)
+    return batches
+
+
+class OpenAIEmbeddingBackend:
+    """Gọi OpenAI Embeddings API qua shared AsyncOpenAI client (pooled)."""
+
+    def __init__(self, model: Optional[str] = None, dim: Optional[int] = None):
+        self.model = model or settings.embedding_model
+        self.dim = dim or settings.embedding_dim
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        client = get_async_openai().with_options(max_retries=0)  # retry/backoff do AsyncEmbedder lo
+        response = await client.embeddings.create(
             model=self.model,
-            input=text
+            input=[truncate_tokens(t) for t in texts],
+            **dimensions_kwargs(self.model, self.dim),
         )
-        return response.data[0].embedding
-    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+
+class LocalEmbeddingBackend:
+    """
+    Stand-in embedding backend chạy local, không gọi network — dùng cho tests/dev.
+    Feature hashing trên tokens → vector L2-normalized, deterministic theo nội dung.
+    Luôn hash ra NATIVE_DIM chiều rồi rút gọn giống OpenAI `dimensions` (shorten_embedding).
+    """
+
+    TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+    NATIVE_DIM = 1536
+
+    def __init__(self, dim: Optional[int] = None, model: str = "local-hashing"):
+        self.dim = dim or settings.embedding_dim
+        self.model = model
+
+    def embed_one(self, text: str) -> List[float]:
+        vector = [0.0] * self.NATIVE_DIM
+        for token in self.TOKEN_RE.findall(text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            sign = 1.0 if value & 1 else -1.0
+            vector[(value >> 1) % self.NATIVE_DIM] += sign
+        return shorten_embedding(vector, self.dim)
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_one(t) for t in texts]
+
+
+def get_embedding_backend():
+    if settings.embedding_backend == "local":
+        return LocalEmbeddingBackend()
+    return OpenAIEmbeddingBackend()
+
+
+class AsyncEmbedder:
+    """
+    Async embedder cho ingestion/retrieval:
+    - Pack batches theo token budget (không theo số item)
+    - Nhiều requests in-flight cùng lúc (semaphore embedding_concurrency)
+    - Retry rate limit / timeout / 5xx với exponential backoff + jitter
+    - Chỉ embed cache misses (EmbeddingCache)
+    """
+
+    def __init__(self, backend=None, cache: Optional[EmbeddingCache] = None):
+        self.backend = backend or get_embedding_backend()
+        self.model = self.backend.model
+        self.dim = self.backend.dim
+        self.cache_model = cache_model_name(self.model, self.dim)
+        if cache is None and settings.embedding_cache_enabled:
+            cache = EmbeddingCache()
+        self.cache = cache
+        self.batch_tokens = settings.embedding_batch_tokens
+        self.concurrency = settings.embedding_concurrency
+        self.max_retries = settings.embedding_max_retries
+
+    async def embed_query(self, text: str) -> List[float]:
+        return (await self.embed_batch([text]))[0]
+
+    async def embed_batch(self, texts: List[str]) -> List[List[float]]:
         """
-        Embed a list of texts
-        Args: 
-            texts: List of texts to embed
-        Returns: 
-            List of vectors
-        Note: 
-            OpenAI limits batch size to 2048 
-            If texts > 2048, we will split it into multiple batches
+        Embed list texts, trả về vectors đúng thứ tự input.
         """
-        batch_size = 2048
-        all_embeddings = []
-
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i+batch_size]
-            response = self.client.embeddings.create(
-                model=self.model, 
-                input=batch
-            )
-            embeddings = [item.embedding for item in response.data]
-            all_embeddings.extend(embeddings)
-        
-        return all_embeddings
\ No newline at end of file
+        if not texts:
+            return []
+
+        if self.cache is None:
+            return await self._embed_uncached(texts)
+
+        results = await self.cache.aget_many(self.cache_model, texts)
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            vectors = await self._embed_uncached(missing_texts)
+            await self.cache.aset_many(self.cache_model, missing_texts, vectors)
+            for i, vector in zip(missing, vectors):
+                results[i] = vector
+        return results
+
+    async def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        batches = pack_by_token_budget(texts, self.batch_tokens)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results: List[Optional[List[float]]] = [None] * len(texts)
+
+        async def _run(indices: List[int]):
+            async with semaphore:
+                vectors = await retry_with_backoff(
+                    lambda: self.backend.embed([texts[i] for i in indices]),
+                    retry_on=RETRYABLE_ERRORS,
+                    max_retries=self.max_retries,
+                    label="Embedder",
+                    retry_after=_retry_after_seconds,
+                )
+            for i, vector in zip(indices, vectors):
+                results[i] = vector
+
+        await asyncio.gather(*(_run(batch) for batch in batches))
+        return results
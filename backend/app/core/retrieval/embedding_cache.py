@@ -0,0 +1,105 @@
+import hashlib
+import unicodedata
+from array import array
+from typing import Any, Dict, List, Optional, Sequence
+
+import redis
+
+from backend.app.config import get_settings
+from backend.app.core.clients import get_async_cache_redis
+
+settings = get_settings()
+
+KEY_PREFIX = "emb"
+STATS_KEY = "emb_cache:stats"
+
+
+def normalize_text(text: str) -> str:
+    """NFC + gộp whitespace — để 'Doanh thu  Q4' và 'Doanh thu Q4' dùng chung 1 entry."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model: str, text: str) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{KEY_PREFIX}:{model}:{digest}"
+
+
+def pack_vector(vector: Sequence[float]) -> bytes:
+    """List[float] → packed float32 bytes (1536 dims = 6KB thay vì ~30KB JSON)."""
+    return array("f", vector).tobytes()
+
+
+def unpack_vector(raw: bytes) -> List[float]:
+    values = array("f")
+    values.frombytes(raw)
+    return values.tolist()
+
+
+class EmbeddingCache:
+    """
+    Redis-backed embedding cache, key = (model, sha256(normalized text)).
+
+    - Value: packed float32 bytes
+    - TTL trượt: mỗi lần hit gia hạn TTL (GETEX) → entries hay dùng sống lâu,
+      Redis cache (`cache_redis_url`, `maxmemory-policy allkeys-lru`) lo phần LRU khi đầy bộ nhớ
+    - Hit/miss counters lưu trong hash `emb_cache:stats` (dùng chung API + worker)
+
+    Redis lỗi/không kết nối được → mọi lookup coi như miss, không làm hỏng embedding.
+    """
+
+    def __init__(self, ttl: Optional[int] = None):
+        self.ttl = ttl or settings.embedding_cache_ttl
+
+    async def aget_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        if not texts:
+            return []
+        client = get_async_cache_redis(decode_responses=False)
+        try:
+            pipe = client.pipeline(transaction=False)
+            for text in texts:
+                pipe.getex(cache_key(model, text), ex=self.ttl)
+            raws = await pipe.execute()
+            await self._record(client.pipeline(transaction=False), raws).execute()
+        except redis.RedisError as e:
+            print(f"[EmbeddingCache] Lookup failed: {e}")
+            return [None] * len(texts)
+        return [unpack_vector(raw) if raw else None for raw in raws]
+
+    async def aset_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        if not texts:
+            return
+        client = get_async_cache_redis(decode_responses=False)
+        try:
+            pipe = client.pipeline(transaction=False)
+            for text, vector in zip(texts, vectors):
+                pipe.set(cache_key(model, text), pack_vector(vector), ex=self.ttl)
+            await pipe.execute()
+        except redis.RedisError as e:
+            print(f"[EmbeddingCache] Store failed: {e}")
+
+    # ── metrics ─────────────────────────────────────────────────────
+    @staticmethod
+    def _record(pipe, raws: List[Optional[bytes]]):
+        hits = sum(1 for raw in raws if raw)
+        if hits:
+            pipe.hincrby(STATS_KEY, "hits", hits)
+        if len(raws) - hits:
+            pipe.hincrby(STATS_KEY, "misses", len(raws) - hits)
+        return pipe
+
+    async def stats(self) -> Dict[str, Any]:
+        client = get_async_cache_redis()
+        counters = {k: int(v) for k, v in (await client.hgetall(STATS_KEY)).items()}
+        hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+        memory = await client.info("memory")
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            "ttl_seconds": self.ttl,
+            "redis_used_memory": memory.get("used_memory_human"),
+            "redis_maxmemory_policy": memory.get("maxmemory_policy"),
+        }
+
+    async def reset_stats(self):
+        await get_async_cache_redis().delete(STATS_KEY)
@@ -1,8 +1,12 @@
 from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct
-from typing import List, Dict, Any, Optional
+from qdrant_client.models import Fusion, FusionQuery, PointStruct, Prefetch, SparseVector
+from typing import List, Dict, Any, AsyncIterable, Awaitable, Callable, Iterable, Optional, Set, Union
+import asyncio
+import time
 import uuid
 from backend.app.config import get_settings
+from backend.app.core.clients import get_async_qdrant
+from backend.app.core.retrieval.schema import SPARSE_VECTOR, SchemaManager, search_params
 
 settings = get_settings()
 
@@ -13,31 +17,43 @@ class QdrantClientWrapper:
             host=settings.qdrant_host,
             port=settings.qdrant_port
         )
-        self.embedding_dim = 1536
+        self.embedding_dim = settings.embedding_dim
 
         self.TEXT_COLLECTION = "text_chunks"
         self.TABLE_COLLECTION = "table_chunks"
         self.IMAGE_COLLECTION = "image_chunks"
 
-    def ensure_collections(self):
-        collection = [
+        self.schema = SchemaManager(self.client, embedding_dim=self.embedding_dim)
+        # None khi không quantize; ngược lại oversampling + rescore trên vectors gốc
+        self.search_params = search_params(self.schema.quantization)
+        # collection → có sparse vector `bm25` không (collections trước schema v3 thì không)
+        self._sparse: Dict[str, bool] = {}
+
+    def ensure_collections(self) -> Dict[str, List[str]]:
+        """Tạo / migrate 3 collections theo schema hiện tại (xem SchemaManager)."""
+        return self.schema.ensure([
             self.TEXT_COLLECTION,
             self.TABLE_COLLECTION,
             self.IMAGE_COLLECTION
-        ]
+        ])
+    
+    def sparse_enabled(self, collection_name: str) -> bool:
+        if collection_name not in self._sparse:
+            self._remember_sparse(collection_name, self.client.get_collection(collection_name))
+        return self._sparse[collection_name]
 
-        existing = {col.name for col in self.client.get_collections().collections}
-        for collection_name in collection: 
-            if collection_name not in existing:
-                self.client.create_collection(
-                    collection_name=collection_name,
-                    vectors_config=VectorParams(size=self.embedding_dim, distance=Distance.COSINE)
+    async def asparse_enabled(self, collection_name: str) -> bool:
+        if collection_name not in self._sparse:
+            self._remember_sparse(collection_name, await get_async_qdrant().get_collection(collection_name))
+        return self._sparse[collection_name]
+
+    def _remember_sparse(self, collection_name: str, info):
+        enabled = SPARSE_VECTOR in (info.config.params.sparse_vectors or {})
+        if not enabled and settings.hybrid_search:
+            print(f"[Qdrant] WARNING: {collection_name} has no '{SPARSE_VECTOR}' sparse vector, "
+                  f"using dense-only search/upserts for it (rebuild: python scripts/migrate_dims.py --rebuild)")
+        self._sparse[collection_name] = enabled
 
-                )
-                print(f"created collection: {collection_name}")
-            else: 
-                print(f"Collection already exists: {collection_name}")
-    
     def upsert_chunks(
         self, 
         collection_name: str,
@@ -50,7 +66,8 @@ class QdrantClientWrapper:
             collection_name: "text_chunks", "table_chunks", or "image_chunks"
             chunks: List of dicts, for each dict: 
                 id: str(uuid)
-                vector: List[float] (1526 dims)
+                vector: List[float] (settings.embedding_dim dims)
+                sparse_vector: SparseVector (optional, BM25 cho hybrid search)
                 payload: Dict (content+metadata)
 
         Example: 
@@ -69,14 +86,8 @@ class QdrantClientWrapper:
                 }
             ]
         """
-        points = [
-            PointStruct(
-                id=chunk["id"],
-                vector=chunk["vector"],
-                payload=chunk["payload"]
-            )
-            for chunk in chunks
-        ]
+        sparse = self.sparse_enabled(collection_name)
+        points = [self._to_point(chunk, sparse) for chunk in chunks]
         self.client.upsert(
             collection_name=collection_name,
             points = points
@@ -84,33 +95,188 @@ class QdrantClientWrapper:
 
         print(f"Upserted {len(chunks)} chunks to {collection_name}")
     
+    async def aupsert_stream(
+        self,
+        collection_name: str,
+        chunks: Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]],
+        batch_size: Optional[int] = None,
+        parallel: Optional[int] = None,
+        on_batch: Optional[Callable[[int], Awaitable[None]]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Streaming bulk upsert: chia chunks thành batches, gửi song song qua AsyncQdrantClient (gRPC).
+
+        - Nhận list / generator / async generator → không cần giữ cả document đã embed trong RAM
+        - Tối đa `parallel` batches in-flight; generator chỉ được đọc tiếp khi có slot trống (backpressure)
+        - Các batches gửi với wait=False; batch cuối gửi wait=True sau khi tất cả đã được nhận
+          → Qdrant apply updates theo thứ tự WAL, nên batch cuối applied = toàn bộ đã applied
+        - 1 batch lỗi → raise (không gửi batch cuối), các batches còn in-flight bị cancel
+        - on_batch(n): gọi sau mỗi batch Qdrant đã nhận (progress reporting)
+
+        Returns:
+            {"points": 1200, "batches": 5, "seconds": 0.8, "points_per_sec": 1500.0}
+        """
+        batch_size = batch_size or settings.upsert_batch_size
+        parallel = parallel or settings.upsert_parallel
+        client = get_async_qdrant()
+        sparse = await self.asparse_enabled(collection_name)
+        slots = asyncio.Semaphore(parallel)
+        # Giữ mọi task đã dispatch (kể cả đã xong) → exception của batch lỗi không bị mất trước barrier
+        dispatched: List[asyncio.Task] = []
+        errors: List[BaseException] = []
+        started = time.perf_counter()
+        total = 0
+        batches = 0
+
+        async def _send(points: List[PointStruct], wait: bool):
+            try:
+                await client.upsert(collection_name=collection_name, points=points, wait=wait)
+                if on_batch is not None:
+                    await on_batch(len(points))
+            finally:
+                slots.release()
+
+        async def _dispatch(points: List[PointStruct]):
+            await slots.acquire()  # backpressure: chờ slot trước khi đọc tiếp generator
+            if errors:  # batch trước đã lỗi → dừng, không gửi tiếp
+                slots.release()
+                raise errors[0]
+            task = asyncio.create_task(_send(points, wait=False))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception() is None or errors.append(t.exception()))
+            dispatched.append(task)
+
+        batch: List[PointStruct] = []
+        last: List[PointStruct] = []  # luôn giữ lại 1 batch để gửi cuối cùng làm barrier
+        try:
+            async for chunk in self._aiter(chunks):
+                batch.append(self._to_point(chunk, sparse))
+                total += 1
+                if len(batch) >= batch_size:
+                    if last:
+                        await _dispatch(last)
+                        batches += 1
+                    last, batch = batch, []
+            if batch:
+                if last:
+                    await _dispatch(last)
+                    batches += 1
+                last = batch
+
+            # Barrier: đợi mọi batch wait=False được nhận, rồi batch cuối wait=True
+            await asyncio.gather(*dispatched)
+            if last:
+                await slots.acquire()
+                await _send(last, wait=True)
+                batches += 1
+        except BaseException:
+            for task in dispatched:
+                task.cancel()
+            raise
+
+        seconds = time.perf_counter() - started
+        stats = {
+            "points": total,
+            "batches": batches,
+            "seconds": round(seconds, 3),
+            "points_per_sec": round(total / seconds, 1) if seconds > 0 else 0.0,
+        }
+        print(f"Upserted {total} chunks to {collection_name} in {batches} batches ({stats['points_per_sec']} points/s)")
+        return stats
+
+    @staticmethod
+    async def _aiter(items):
+        if hasattr(items, "__aiter__"):
+            async for item in items:
+                yield item
+        else:
+            for item in items:
+                yield item
+
+    @staticmethod
+    def _to_point(chunk: Dict[str, Any], sparse: bool = True) -> PointStruct:
+        vector = chunk["vector"]
+        if sparse and chunk.get("sparse_vector") is not None:
+            vector = {"": vector, SPARSE_VECTOR: chunk["sparse_vector"]}
+        return PointStruct(id=chunk["id"], vector=vector, payload=chunk["payload"])
+
     def search(
         self, 
         collection_name: str,
         query_vector: List[float], 
         limit: int=5, 
-        filters: Optional[Dict] = None
+        filters: Optional[Dict] = None,
+        sparse_vector: Optional[SparseVector] = None,
     ) -> List[Dict]:
         """
         Search chunks trong collection.
 
         Args: 
             collection_name: Collection for search
-            query_vector: Query vector (1526 dims)
+            query_vector: Query vector (settings.embedding_dim dims)
             limit: Number of results to return
             filters: Qdrant filter (optional)
                 Example: {"company": "Vinamilk", "year": 2025}
+            sparse_vector: BM25 query vector (SparseEncoder.encode_query) → hybrid search,
+                dense + sparse gộp bằng reciprocal rank fusion trong 1 query phía server
         
         Returns: 
-            List of dicts: score + payload
+            List of dicts: score + payload (hybrid: score là RRF score)
         """
+        if sparse_vector is not None and not self.sparse_enabled(collection_name):
+            sparse_vector = None
         results = self.client.query_points(
             collection_name=collection_name, 
-            query=query_vector, 
-            limit=limit, 
-            query_filter=filters
+            **self._query_kwargs(query_vector, limit, filters, sparse_vector),
         ).points
 
+        return self._to_hits(results)
+
+    async def asearch(
+        self, 
+        collection_name: str,
+        query_vector: List[float], 
+        limit: int=5, 
+        filters: Optional[Dict] = None,
+        sparse_vector: Optional[SparseVector] = None,
+    ) -> List[Dict]:
+        """
+        Async version của search() — dùng shared AsyncQdrantClient, không block event loop.
+        """
+        if sparse_vector is not None and not await self.asparse_enabled(collection_name):
+            sparse_vector = None
+        response = await get_async_qdrant().query_points(
+            collection_name=collection_name, 
+            **self._query_kwargs(query_vector, limit, filters, sparse_vector),
+        )
+        return self._to_hits(response.points)
+
+    def _query_kwargs(
+        self,
+        query_vector: List[float],
+        limit: int,
+        filters,
+        sparse_vector: Optional[SparseVector],
+    ) -> Dict[str, Any]:
+        if sparse_vector is None or not sparse_vector.indices:
+            return {
+                "query": query_vector,
+                "limit": limit,
+                "query_filter": filters,
+                "search_params": self.search_params,
+            }
+        # Hybrid: 2 nhánh prefetch (cùng filter) → fuse RRF, chỉ 1 round-trip
+        prefetch_limit = limit * settings.hybrid_prefetch
+        return {
+            "prefetch": [
+                Prefetch(query=query_vector, limit=prefetch_limit, filter=filters, params=self.search_params),
+                Prefetch(query=sparse_vector, using=SPARSE_VECTOR, limit=prefetch_limit, filter=filters),
+            ],
+            "query": FusionQuery(fusion=Fusion.RRF),
+            "limit": limit,
+        }
+
+    @staticmethod
+    def _to_hits(points) -> List[Dict]:
         return [
             {
                 "id": hit.id, 
@@ -118,19 +284,45 @@ class QdrantClientWrapper:
                 "content":hit.payload.get("content"), 
                 "metadata":hit.payload.get("metadata")
             }
-            for hit in results
+            for hit in points
         ]
 
-    def delete_by_doc_id(self, doc_id: str):
+    def existing_ids(self, collection_name: str, doc_id: str) -> Set[str]:
         """
-        Delete all chunks belong to a document
-
-        Args: 
-            doc_id: Document ID to delete
+        IDs của tất cả points thuộc 1 document (scroll, không lấy payload/vector).
+        Dùng để diff khi re-ingest: chỉ upsert chunks mới, xóa chunks cũ.
         """
+        ids: Set[str] = set()
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=collection_name,
+                scroll_filter=self._doc_filter(doc_id),
+                limit=1000,
+                offset=offset,
+                with_payload=False,
+                with_vectors=False,
+            )
+            ids.update(str(point.id) for point in points)
+            if offset is None:
+                return ids
+
+    def delete_ids(self, collection_name: str, ids: List[str]):
+        if not ids:
+            return
+        from qdrant_client.models import PointIdsList
+
+        self.client.delete(
+            collection_name=collection_name,
+            points_selector=PointIdsList(points=list(ids)),
+        )
+        print(f"Deleted {len(ids)} stale chunks from {collection_name}")
+
+    @staticmethod
+    def _doc_filter(doc_id: str):
         from qdrant_client.models import Filter, FieldCondition, MatchValue
 
-        filter_condition = Filter(
+        return Filter(
             must=[
                 FieldCondition(
                     key="metadata.doc_id",
@@ -139,6 +331,15 @@ class QdrantClientWrapper:
             ]
         )
 
+    def delete_by_doc_id(self, doc_id: str):
+        """
+        Delete all chunks belong to a document
+
+        Args: 
+            doc_id: Document ID to delete
+        """
+        filter_condition = self._doc_filter(doc_id)
+
         for collection in [self.TEXT_COLLECTION, self.TABLE_COLLECTION, self.IMAGE_COLLECTION]:
             self.client.delete(
                 collection_name=collection,
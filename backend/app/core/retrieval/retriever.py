@@ -1,18 +1,41 @@
+import asyncio
+import heapq
+import traceback
 from typing import Any, Dict, List, Optional
-from backend.app.core.retrieval.embedder import Embedder
+
+from qdrant_client.models import SparseVector
+
+from backend.app.config import get_settings
+from backend.app.core.retrieval.embedder import AsyncEmbedder
 from backend.app.core.retrieval.qdrant_client import QdrantClientWrapper
+from backend.app.core.retrieval.query_cache import QueryVectorCache
+from backend.app.core.retrieval.sparse_encoder import SparseEncoder
+
+settings = get_settings()
+
+# Dùng chung cho mọi retriever trong process (API tạo retriever mới ở /similar)
+query_vector_cache = QueryVectorCache(maxsize=settings.query_vector_cache_size)
 
 class MultiCollectionRetriever: 
     """
-    Search at the same time 3 collections: text, table, image. 
+    Search at the same time 3 collections: text, table, image (concurrent fan-out). 
     Return all results labeled with chunk_type.
+    Hybrid mode (settings.hybrid_search): dense + BM25 sparse, fused by RRF trong Qdrant.
     """
 
     def __init__(self):
-        self.embedder = Embedder()
+        self.embedder = AsyncEmbedder()
         self.qdrant = QdrantClientWrapper()
+        self.sparse_encoder = SparseEncoder() if settings.hybrid_search else None
+
+    async def embed_question(self, question: str) -> List[float]:
+        """Query vector qua in-process LRU + single-flight, rồi mới tới EmbeddingCache/OpenAI."""
+        key = QueryVectorCache.make_key(self.embedder.cache_model, question)
+        return await query_vector_cache.get_or_compute(
+            key, lambda: self.embedder.embed_query(question)
+        )
 
-    def retrieve(
+    async def retrieve(
         self, 
         question: str, 
         top_k_text: int = 3, 
@@ -36,40 +59,87 @@ class MultiCollectionRetriever:
             Each chunk has field "chunk_type" to indicate.
         """
 
-        query_vector = self.embedder.embed_documents(question)
-        qdrant_filters = self._build_filter(filters) if filters else None
-
-        text_results = self.qdrant.search(
-            collection_name=self.qdrant.TEXT_COLLECTION,
-            query_vector=query_vector,
-            limit=top_k_text,
-            filters=qdrant_filters,
+        query_vector = await self.embed_question(question)
+        sparse_vector = self.sparse_encoder.encode_query(question) if self.sparse_encoder else None
+        return await self.search(
+            query_vector,
+            top_k_text=top_k_text,
+            top_k_table=top_k_table,
+            top_k_image=top_k_image,
+            filters=filters,
+            sparse_vector=sparse_vector,
         )
-        table_results = self.qdrant.search(
-            collection_name=self.qdrant.TABLE_COLLECTION,
-            query_vector=query_vector,
-            limit=top_k_table,
-            filters=qdrant_filters,
-        )
-        image_results = self.qdrant.search(
-            collection_name=self.qdrant.IMAGE_COLLECTION,
-            query_vector=query_vector,
-            limit=top_k_image,
-            filters=qdrant_filters,
+
+    async def search(
+        self,
+        query_vector: List[float],
+        top_k_text: int = 3,
+        top_k_table: int = 5,
+        top_k_image: int = 2,
+        filters: Optional[Dict] = None,
+        sparse_vector: Optional[SparseVector] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Fan-out search song song trên 3 collections (AsyncQdrantClient), mỗi collection
+        có timeout riêng: collection chậm/lỗi → log + bỏ qua, không chặn cả câu trả lời.
+        Mọi collection đều lỗi → raise (không trả về [] như thể không có kết quả).
+        Kết quả mỗi collection đã sort sẵn → k-way heap merge theo score.
+        """
+        qdrant_filters = self._build_filter(filters) if filters else None
+        searches = [
+            ("text", self.qdrant.TEXT_COLLECTION, top_k_text),
+            ("table", self.qdrant.TABLE_COLLECTION, top_k_table),
+            ("image", self.qdrant.IMAGE_COLLECTION, top_k_image),
+        ]
+        searches = [(label, collection, limit) for label, collection, limit in searches if limit > 0]
+        results = await asyncio.gather(
+            *(
+                self._search_collection(label, collection, query_vector, limit, qdrant_filters, sparse_vector)
+                for label, collection, limit in searches
+            ),
+            return_exceptions=True,
         )
 
-        for r in text_results:
-            r["source_collection"] = "text"
-        for r in table_results:
-            r["source_collection"] = "table"
-        for r in image_results:
-            r["source_collection"] = "image"
+        errors = []
+        for (_, collection, _), result in zip(searches, results):
+            if isinstance(result, BaseException):
+                print(f"[Retriever] {collection} search failed: {type(result).__name__}: {result}")
+                traceback.print_exception(result)
+                errors.append(result)
+        if errors and len(errors) == len(searches):
+            raise errors[0]
+
+        hits = [result for result in results if not isinstance(result, BaseException)]
+        return list(heapq.merge(*hits, key=lambda x: x["score"], reverse=True))
+
+    async def _search_collection(
+        self,
+        label: str,
+        collection_name: str,
+        query_vector: List[float],
+        limit: int,
+        qdrant_filters,
+        sparse_vector: Optional[SparseVector] = None,
+    ) -> List[Dict[str, Any]]:
+        try:
+            hits = await asyncio.wait_for(
+                self.qdrant.asearch(
+                    collection_name=collection_name,
+                    query_vector=query_vector,
+                    limit=limit,
+                    filters=qdrant_filters,
+                    sparse_vector=sparse_vector,
+                ),
+                timeout=settings.search_timeout,
+            )
+        except asyncio.TimeoutError:
+            print(f"[Retriever] {collection_name} timed out after {settings.search_timeout}s, skipping")
+            return []
 
-        all_results = text_results + table_results + image_results
-        all_results.sort(key=lambda x: x["score"], reverse=True)
+        for hit in hits:
+            hit["source_collection"] = label
+        return hits
 
-        return all_results
-    
     def _build_filter(self, filters: Dict) -> Dict:
         """
         Convert dict đơn giản sang Qdrant Filter object.
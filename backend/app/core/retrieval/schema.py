@@ -0,0 +1,339 @@
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from qdrant_client import QdrantClient
+from qdrant_client.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    CollectionParamsDiff,
+    Disabled,
+    Distance,
+    HnswConfigDiff,
+    Modifier,
+    PayloadSchemaType,
+    PointIdsList,
+    PointStruct,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    SparseVectorParams,
+    VectorParams,
+    VectorParamsDiff,
+)
+
+from backend.app.config import get_settings
+
+settings = get_settings()
+
+# Tăng khi thay đổi schema bên dưới; migrate() đưa collections cũ về đúng schema hiện tại
+#   v1: payload indexes company / year / quarter / doc_id
+#   v2: quantization (opt-in), vectors gốc on disk khi quantize
+#   v3: sparse vector `bm25` cho hybrid search (chỉ có được bằng rebuild)
+SCHEMA_VERSION = 3
+SPARSE_SCHEMA_VERSION = 3
+
+# Tên sparse vector (BM25, IDF tính phía server) bên cạnh dense vector mặc định
+SPARSE_VECTOR = "bm25"
+
+# Sidecar collection lưu schema version của từng collection (Qdrant v1.12 chưa có collection metadata)
+SCHEMA_COLLECTION = "schema_versions"
+SCHEMA_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "the-smart-analyst/schema")
+
+# Các fields mà retriever filter / delete_by_doc_id dùng → cần payload index
+PAYLOAD_INDEXES: Dict[str, PayloadSchemaType] = {
+    "metadata.company": PayloadSchemaType.KEYWORD,
+    "metadata.quarter": PayloadSchemaType.KEYWORD,
+    "metadata.doc_id": PayloadSchemaType.KEYWORD,
+    "metadata.year": PayloadSchemaType.INTEGER,
+}
+
+
+QUANTIZATION_MODES = ("none", "scalar", "binary")
+
+
+def quantization_config(mode: str):
+    """
+    Quantization config cho collection:
+    - scalar: int8 (4x nhỏ hơn float32), quantile 0.99 cắt outliers
+    - binary: 1 bit/dim (32x nhỏ hơn), cần oversampling + rescore để giữ recall
+    Bản quantized luôn nằm trong RAM; vectors gốc on disk chỉ đọc khi rescore.
+    """
+    if mode == "scalar":
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if mode == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    if mode == "none":
+        return None
+    raise ValueError(f"Unknown quantization mode '{mode}', expected one of {QUANTIZATION_MODES}")
+
+
+def quantization_mode(config) -> str:
+    if isinstance(config, ScalarQuantization):
+        return "scalar"
+    if isinstance(config, BinaryQuantization):
+        return "binary"
+    return "none"
+
+
+def search_params(
+    mode: Optional[str] = None,
+    oversampling: Optional[float] = None,
+    rescore: Optional[bool] = None,
+) -> Optional[SearchParams]:
+    """SearchParams cho query: oversampling + rescore bằng vectors gốc khi collection đã quantize."""
+    mode = mode or settings.qdrant_quantization
+    if mode == "none":
+        return None
+    return SearchParams(
+        quantization=QuantizationSearchParams(
+            ignore=False,
+            rescore=settings.search_rescore if rescore is None else rescore,
+            oversampling=oversampling or settings.search_oversampling,
+        )
+    )
+
+
+class SchemaManager:
+    """
+    Quản lý schema của các Qdrant collections (versioned, migrate tại chỗ).
+
+    Schema gồm:
+    - Vector params (size, cosine)
+    - HNSW m / ef_construct
+    - on_disk_payload
+    - Quantization (opt-in: scalar / binary, vectors gốc on disk)
+    - Sparse vector `bm25` (modifier IDF) cho hybrid search
+    - Payload indexes cho company / year / quarter / doc_id
+
+    Version của từng collection lưu trong sidecar collection `schema_versions`;
+    migrate() chạy các bước từ version đã lưu lên SCHEMA_VERSION rồi đồng bộ phần
+    cấu hình theo settings (HNSW, on_disk_payload, quantization, indexes). Chạy lại
+    bao nhiêu lần cũng được, không cần recreate, không mất points.
+    """
+
+    def __init__(
+        self,
+        client: QdrantClient,
+        embedding_dim: Optional[int] = None,
+        quantization: Optional[str] = None,
+        hybrid: Optional[bool] = None,
+    ):
+        self.client = client
+        self.embedding_dim = embedding_dim or settings.embedding_dim
+        self.hnsw_m = settings.hnsw_m
+        self.hnsw_ef_construct = settings.hnsw_ef_construct
+        self.on_disk_payload = settings.qdrant_on_disk_payload
+        self.quantization = quantization if quantization is not None else settings.qdrant_quantization
+        quantization_config(self.quantization)  # validate sớm
+        self.hybrid = hybrid if hybrid is not None else settings.hybrid_search
+        self._versions_ready = False
+
+    def ensure(self, collection_names: List[str]) -> Dict[str, List[str]]:
+        """Tạo collections còn thiếu, migrate collections đã có. Trả về các thay đổi đã áp dụng."""
+        existing = {col.name for col in self.client.get_collections().collections}
+        existing.update(self.aliases())
+        changes = {}
+        for name in collection_names:
+            if name not in existing:
+                self.create(name)
+                changes[name] = ["created"]
+            else:
+                changes[name] = self.migrate(name)
+            print(f"[Schema] {name} (v{self.stored_version(name)}): {', '.join(changes[name]) or 'up to date'}")
+        return changes
+
+    def create(self, name: str):
+        self.client.create_collection(
+            collection_name=name,
+            vectors_config=VectorParams(
+                size=self.embedding_dim,
+                distance=Distance.COSINE,
+                on_disk=self.quantization != "none",
+            ),
+            hnsw_config=HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct),
+            on_disk_payload=self.on_disk_payload,
+            quantization_config=quantization_config(self.quantization),
+            sparse_vectors_config=(
+                {SPARSE_VECTOR: SparseVectorParams(modifier=Modifier.IDF)} if self.hybrid else None
+            ),
+        )
+        self.create_payload_indexes(name)
+        self.record_version(name, SCHEMA_VERSION if self.hybrid else SPARSE_SCHEMA_VERSION - 1)
+
+    def drop(self, name: str):
+        """Xóa collection cùng version đã lưu của nó."""
+        self.forget(name)
+        self.client.delete_collection(name)
+
+    def migrate(self, name: str) -> List[str]:
+        info = self.client.get_collection(name)
+        changes = []
+
+        size = info.config.params.vectors.size
+        if size != self.embedding_dim:
+            # Số chiều không đổi được tại chỗ → cần copy/re-project sang collection mới
+            raise RuntimeError(
+                f"Collection '{name}' has {size}-d vectors but embedding_dim={self.embedding_dim}. "
+                f"Run: python scripts/migrate_dims.py --dim {self.embedding_dim}"
+            )
+
+        stored = self.stored_version(name)
+        detected = stored is None
+        if detected:
+            # Collection tạo trước khi có version tracking → suy ra từ cấu hình thực tế 1 lần
+            stored = self.detect_version(info)
+            changes.append(f"detected v{stored}")
+        if stored > SCHEMA_VERSION:
+            raise RuntimeError(
+                f"Collection '{name}' is at schema v{stored}, newer than this code (v{SCHEMA_VERSION})"
+            )
+
+        version = stored
+        if version < 1:
+            created = self.create_payload_indexes(name, existing=info.payload_schema or {})
+            changes.append(f"v1: indexes {', '.join(created) or 'present'}")
+            version = 1
+        if version < 2:
+            # Quantization là cấu hình theo settings, áp dụng ở phần đồng bộ bên dưới
+            changes.append("v2")
+            version = 2
+        if version < SPARSE_SCHEMA_VERSION and self.hybrid:
+            # Sparse vectors phải được tính từ content của từng point → không thêm tại chỗ được;
+            # QdrantClientWrapper dùng dense-only cho collection này tới khi rebuild
+            print(
+                f"[Schema] WARNING: {name} has no '{SPARSE_VECTOR}' sparse vector (schema v{version}), "
+                f"hybrid search falls back to dense-only. Run: python scripts/migrate_dims.py --rebuild"
+            )
+        if detected or version != stored:
+            self.record_version(name, version)
+            info = self.client.get_collection(name)
+
+        changes.extend(self._sync_config(name, info))
+        return changes
+
+    def _sync_config(self, name: str, info) -> List[str]:
+        """Đồng bộ phần cấu hình lấy từ settings (không gắn với version)."""
+        changes = []
+        hnsw = info.config.hnsw_config
+        if hnsw.m != self.hnsw_m or hnsw.ef_construct != self.hnsw_ef_construct:
+            self.client.update_collection(
+                collection_name=name,
+                hnsw_config=HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct),
+            )
+            changes.append(f"hnsw m={self.hnsw_m} ef_construct={self.hnsw_ef_construct}")
+
+        if bool(info.config.params.on_disk_payload) != self.on_disk_payload:
+            self.client.update_collection(
+                collection_name=name,
+                collection_params=CollectionParamsDiff(on_disk_payload=self.on_disk_payload),
+            )
+            changes.append(f"on_disk_payload={self.on_disk_payload}")
+
+        current_mode = quantization_mode(info.config.quantization_config)
+        if current_mode != self.quantization:
+            # Quantized → vectors gốc xuống disk (chỉ đọc khi rescore); tắt quantization → về lại RAM
+            self.client.update_collection(
+                collection_name=name,
+                vectors_config={"": VectorParamsDiff(on_disk=self.quantization != "none")},
+                quantization_config=quantization_config(self.quantization) or Disabled.DISABLED,
+            )
+            changes.append(f"quantization {current_mode} → {self.quantization}")
+
+        created = self.create_payload_indexes(name, existing=info.payload_schema or {})
+        if created:
+            changes.append(f"indexes {', '.join(created)}")
+        return changes
+
+    @staticmethod
+    def detect_version(info) -> int:
+        """Version suy ra từ layout của collection chưa có version lưu (tạo trước khi có sidecar)."""
+        if SPARSE_VECTOR in (info.config.params.sparse_vectors or {}):
+            return SPARSE_SCHEMA_VERSION
+        indexed = info.payload_schema or {}
+        if all(field_name in indexed for field_name in PAYLOAD_INDEXES):
+            return 2
+        return 0
+
+    # ── version sidecar ─────────────────────────────────────────────
+    def _ensure_versions(self):
+        if self._versions_ready:
+            return
+        if not self.client.collection_exists(SCHEMA_COLLECTION):
+            self.client.create_collection(
+                collection_name=SCHEMA_COLLECTION,
+                vectors_config=VectorParams(size=1, distance=Distance.DOT),
+            )
+        self._versions_ready = True
+
+    def aliases(self) -> Dict[str, str]:
+        """alias → collection thật (scripts/migrate_dims.py build `<name>_vN` rồi trỏ alias `<name>` sang)."""
+        return {a.alias_name: a.collection_name for a in self.client.get_aliases().aliases}
+
+    def resolve(self, name: str) -> str:
+        return self.aliases().get(name, name)
+
+    def _version_id(self, name: str) -> str:
+        # Version thuộc về collection thật, không phải alias đang trỏ vào nó
+        return str(uuid.uuid5(SCHEMA_NAMESPACE, self.resolve(name)))
+
+    def stored_version(self, name: str) -> Optional[int]:
+        if not self.client.collection_exists(SCHEMA_COLLECTION):
+            return None
+        points = self.client.retrieve(SCHEMA_COLLECTION, ids=[self._version_id(name)], with_payload=True)
+        return points[0].payload["version"] if points else None
+
+    def record_version(self, name: str, version: int):
+        self._ensure_versions()
+        self.client.upsert(
+            collection_name=SCHEMA_COLLECTION,
+            points=[PointStruct(
+                id=self._version_id(name),
+                vector=[1.0],
+                payload={"collection": name, "version": version, "updated_at": time.time()},
+            )],
+        )
+
+    def forget(self, name: str):
+        if self.client.collection_exists(SCHEMA_COLLECTION):
+            self.client.delete(SCHEMA_COLLECTION, points_selector=PointIdsList(points=[self._version_id(name)]))
+
+    def create_payload_indexes(self, name: str, existing: Dict[str, Any] = None) -> List[str]:
+        existing = existing or {}
+        created = []
+        for field_name, schema in PAYLOAD_INDEXES.items():
+            current = existing.get(field_name)
+            if current is not None and current.data_type == schema:
+                continue
+            if current is not None:
+                # Sai kiểu (vd year đang là keyword) → xóa index cũ rồi tạo lại
+                self.client.delete_payload_index(collection_name=name, field_name=field_name)
+            self.client.create_payload_index(
+                collection_name=name,
+                field_name=field_name,
+                field_schema=schema,
+                wait=True,
+            )
+            created.append(field_name)
+        return created
+
+    def describe(self, name: str) -> Dict[str, Any]:
+        info = self.client.get_collection(name)
+        return {
+            "schema_version": self.stored_version(name),
+            "latest_schema_version": SCHEMA_VERSION,
+            "points_count": info.points_count,
+            "embedding_dim": info.config.params.vectors.size,
+            "status": str(info.status),
+            "hnsw": {"m": info.config.hnsw_config.m, "ef_construct": info.config.hnsw_config.ef_construct},
+            "on_disk_payload": info.config.params.on_disk_payload,
+            "quantization": quantization_mode(info.config.quantization_config),
+            "sparse_vectors": sorted(info.config.params.sparse_vectors or {}),
+            "payload_indexes": {
+                field_name: str(schema.data_type) for field_name, schema in (info.payload_schema or {}).items()
+            },
+        }
@@ -0,0 +1,61 @@
+import hashlib
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional
+
+from qdrant_client.models import SparseVector
+
+from backend.app.config import get_settings
+
+settings = get_settings()
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# 17,045 / 17.045 (dấu phân cách hàng nghìn kiểu Anh/Việt) → 17045, để số liệu khớp chính xác
+THOUSANDS_RE = re.compile(r"(?<![\d.,])\d{1,3}(?:[.,]\d{3})+(?![.,]?\d)")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    NFC + lowercase, gộp số có dấu phân cách hàng nghìn, tách theo \\w+ (giữ dấu tiếng Việt).
+    Thêm bigrams vì tiếng Việt ghép từ theo âm tiết: "doanh thu" → "doanh_thu".
+    """
+    text = unicodedata.normalize("NFC", text).lower()
+    text = THOUSANDS_RE.sub(lambda m: re.sub(r"[.,]", "", m.group(0)), text)
+    words = TOKEN_RE.findall(text)
+    return words + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+
+def token_index(token: str) -> int:
+    """Feature hashing → uint32 index cho Qdrant sparse vector (không cần vocabulary)."""
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+class SparseEncoder:
+    """
+    BM25-style sparse encoder chạy local (không model, không vocabulary):
+    - Document: trọng số = BM25 term-frequency saturation (k1, b, độ dài tương đối)
+    - Query: mỗi term trọng số 1
+    - IDF do Qdrant tính phía server (sparse vector `modifier=IDF`) từ thống kê collection
+    """
+
+    def __init__(self, k1: Optional[float] = None, b: Optional[float] = None, avg_doc_len: Optional[float] = None):
+        self.k1 = k1 if k1 is not None else settings.bm25_k1
+        self.b = b if b is not None else settings.bm25_b
+        self.avg_doc_len = avg_doc_len or settings.bm25_avg_doc_len
+
+    def encode_document(self, text: str) -> SparseVector:
+        tokens = tokenize(text)
+        norm = self.k1 * (1 - self.b + self.b * len(tokens) / self.avg_doc_len)
+        weights: Dict[int, float] = {}
+        for token, tf in Counter(tokens).items():
+            index = token_index(token)
+            weights[index] = weights.get(index, 0.0) + tf * (self.k1 + 1) / (tf + norm)
+        return SparseVector(indices=list(weights), values=list(weights.values()))
+
+    def encode_documents(self, texts: List[str]) -> List[SparseVector]:
+        return [self.encode_document(text) for text in texts]
+
+    def encode_query(self, text: str) -> SparseVector:
+        indices = sorted({token_index(token) for token in tokenize(text)})
+        return SparseVector(indices=indices, values=[1.0] * len(indices))
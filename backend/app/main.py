@@ -2,14 +2,22 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
+from backend.app.api.limits import UploadSizeLimitMiddleware
 from backend.app.api.v1.router import api_router
 from backend.app.config import get_settings
+from backend.app.core.document_registry import DocumentRegistry
 
 settings = get_settings()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Starting Hyena API...")
+    # Documents lưu theo format cũ (doc:{id} JSON) → chuyển sang registry hashes + indexes.
+    # Redis chưa sẵn sàng không được chặn API khởi động (health, query không cần registry)
+    try:
+        await DocumentRegistry().migrate_legacy()
+    except Exception as e:
+        print(f"[Startup] Legacy document migration skipped: {e}")
     yield
     print("Shutting down Hyena API...")
 
@@ -26,6 +34,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count"],
+)
+
+# 413 theo Content-Length trước khi FastAPI spool multipart body ra disk
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    paths=["/api/v1/documents/upload"],
+    max_bytes=settings.max_upload_mb * 1024 * 1024,
 )
 
 app.include_router(api_router, prefix="/api/v1")
@@ -15,7 +15,7 @@ class DocumentResponse(BaseModel):
     company: str
     year: int
     quarter: Optional[str] = None
-    status: str  # pending | processing | completed | failed
+    status: str  # pending | processing | retrying | completed | failed
     created_at: datetime
     message: str
 
@@ -31,13 +31,15 @@ class DocumentListItem(BaseModel):
     text_chunks: Optional[int] = 0
     table_chunks: Optional[int] = 0
     image_chunks: Optional[int] = 0
+    progress_percent: Optional[int] = None
     created_at: datetime
 
 
 class DocumentStatusResponse(BaseModel):
     doc_id: str
     status: str
-    progress: Optional[str] = None
+    progress: Optional[str] = None          # stage hiện tại, vd "Embedding 120/300 chunks"
+    progress_percent: Optional[int] = None
     total_chunks: int = 0
     text_chunks: int = 0
     table_chunks: int = 0
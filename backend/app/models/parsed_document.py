@@ -0,0 +1,41 @@
+from pydantic import BaseModel
+from typing import List, Optional
+
+
+class ParsedImage(BaseModel):
+    """1 ảnh extract từ PDF — data là base64 (PNG/JPG)"""
+    page_num: int
+    index: int
+    name: Optional[str] = None
+    data: str
+    width: Optional[float] = None
+    height: Optional[float] = None
+
+
+class ParsedPage(BaseModel):
+    page_num: int
+    markdown: str = ""
+    tables: List[str] = []        # Markdown tables LlamaParse đã nhận diện sẵn
+    images: List[ParsedImage] = []
+
+
+class ParsedDocument(BaseModel):
+    """
+    Kết quả parse PDF 1 lần duy nhất — dùng chung cho
+    TextProcessor, TableProcessor và ImageProcessor.
+    """
+    file_path: str
+    job_id: Optional[str] = None
+    pages: List[ParsedPage] = []
+
+    @property
+    def markdown(self) -> str:
+        return "\n\n".join(page.markdown for page in self.pages)
+
+    @property
+    def tables(self) -> List[str]:
+        return [table for page in self.pages for table in page.tables]
+
+    @property
+    def images(self) -> List[ParsedImage]:
+        return [img for page in self.pages for img in page.images]
@@ -23,4 +23,6 @@ class QueryResponse(BaseModel):
     """Response model for query endpoint"""
     answer: str
     sources: List[SourceDocument]
-    question: str
\ No newline at end of file
+    question: str
+    context_stats: Optional[Dict[str, int]] = None   # ContextBuilder.pack(): tokens_used, tokens_saved, ...
+    cached: bool = False                             # True khi trả từ semantic answer cache
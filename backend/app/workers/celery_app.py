@@ -1,5 +1,8 @@
 from celery import Celery
+from celery.signals import worker_process_init, worker_process_shutdown
+from kombu import Queue
 from backend.app.config import get_settings
+from backend.app.core.ingestion.checkpoints import INGEST_STAGES
 
 settings = get_settings()
 
@@ -21,4 +24,24 @@ celery_app.conf.update(
     task_soft_time_limit=600,
     task_time_limit=900,
     broker_transport_options={"visibility_timeout": 3600},
-)
\ No newline at end of file
+    # Mỗi ingestion stage 1 queue riêng → worker chạy `-Q ingest.caption` scale / tune concurrency độc lập.
+    # Worker không truyền -Q consume tất cả queues dưới đây.
+    task_default_queue="celery",
+    task_queues=[Queue("celery"), *(Queue(f"ingest.{stage}") for stage in INGEST_STAGES)],
+    task_routes={f"tasks.ingest.{stage}": {"queue": f"ingest.{stage}"} for stage in INGEST_STAGES},
+)
+
+
+@worker_process_init.connect
+def _init_worker_process(**kwargs):
+    """Mỗi child process (sau fork) tạo event loop, pooled clients và IngestionPipeline riêng."""
+    from backend.app.workers.runtime import init_worker_resources
+
+    init_worker_resources()
+
+
+@worker_process_shutdown.connect
+def _shutdown_worker_process(**kwargs):
+    from backend.app.workers.runtime import shutdown_worker_resources
+
+    shutdown_worker_resources()
@@ -0,0 +1,93 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Optional
+
+from backend.app.core.clients import close_async_redis, get_async_openai, get_async_qdrant, get_async_redis
+
+# Tài nguyên sống cùng 1 worker process (tạo trong worker_process_init, sau khi fork)
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_pipeline = None
+
+
+async def _warm_clients():
+    """Tạo sẵn pooled clients gắn với loop của process (get_async_* cache theo loop)."""
+    get_async_openai()
+    get_async_qdrant()
+    await get_async_redis().ping()
+
+
+def init_worker_resources():
+    """
+    Gọi 1 lần / worker process:
+    - 1 event loop dùng cho mọi task → AsyncOpenAI / AsyncQdrantClient / Redis pools được dùng lại
+    - IngestionPipeline singleton (LlamaParse, vision backend, Qdrant client) + ensure_collections 1 lần
+    """
+    global _loop, _pipeline
+    from backend.app.core.ingestion.pipeline import IngestionPipeline
+
+    t0 = time.perf_counter()
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    try:
+        _loop.run_until_complete(_warm_clients())
+    except Exception as e:
+        # Redis chưa sẵn sàng không nên làm worker chết; task đầu tiên sẽ kết nối lại
+        print(f"[Worker] Client warm-up failed: {e}")
+    try:
+        _pipeline = IngestionPipeline()
+    except Exception as e:
+        # Qdrant chưa sẵn sàng (depends_on không đợi ready) → get_pipeline() tạo lại ở task đầu tiên
+        print(f"[Worker] Pipeline init failed, retrying on first task: {e}")
+        _pipeline = None
+    print(f"[Worker] Resources ready in {time.perf_counter() - t0:.2f}s")
+
+
+def shutdown_worker_resources():
+    global _loop, _pipeline
+    if _loop is None or _loop.is_closed():
+        return
+    try:
+        _loop.run_until_complete(_close_clients())
+    finally:
+        _loop.close()
+        _loop, _pipeline = None, None
+
+
+async def _close_clients():
+    await get_async_openai().close()
+    await get_async_qdrant().close()
+    await close_async_redis()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    # Pool không gửi worker_process_init (solo/threads, task_always_eager) → khởi tạo lười
+    if _loop is None or _loop.is_closed():
+        init_worker_resources()
+    return _loop
+
+
+def get_pipeline():
+    global _pipeline
+    from backend.app.core.ingestion.pipeline import IngestionPipeline
+
+    get_loop()
+    if _pipeline is None:
+        # Lỗi ở đây → task fail + retry như mọi lỗi của stage; lần sau thử lại
+        _pipeline = IngestionPipeline()
+    return _pipeline
+
+
+def run(coro: Awaitable[Any]) -> Any:
+    """Chạy coroutine trên loop của worker; lỗi / time limit → cancel task để loop sạch cho task sau."""
+    loop = get_loop()
+    task = loop.create_task(coro)
+    try:
+        return loop.run_until_complete(task)
+    except BaseException:
+        if not task.done():
+            task.cancel()
+            try:
+                loop.run_until_complete(task)
+            except BaseException:
+                pass
+        raise
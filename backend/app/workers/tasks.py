@@ -1,63 +1,258 @@
 import asyncio
-from typing import Any, Dict
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+from celery import chain, chord, group
+
+from backend.app.workers import runtime
 from backend.app.workers.celery_app import celery_app
 
+# Ingestion stage → progress stages (ProgressReporter) hoàn thành khi stage đó xong
+STAGE_PROGRESS = {
+    "parse": ("parse",),
+    "extract": ("extract_text", "extract_table"),
+    "caption": ("extract_image",),
+    "embed": ("embed",),
+    "upsert": ("upsert", "finalize"),
+}
+
+# Ingestion stage → stages phải xong trước nó. extract / caption chỉ cần parse → chạy song song (chord)
+STAGE_DEPENDENCIES = {
+    "parse": (),
+    "extract": ("parse",),
+    "caption": ("parse",),
+    "embed": ("parse", "extract", "caption"),
+    "upsert": ("parse", "extract", "caption", "embed"),
+}
+
+STAGE_TASK_OPTIONS = {"bind": True, "max_retries": 3, "default_retry_delay": 30}
+
 def _run_async(coro):
-    """Run coroutine from Celery (sync context)"""
-    loop = asyncio.new_event_loop()
-    try: 
-        return loop.run_until_complete(coro)
-    finally:        
-        loop.close()
-
-@celery_app.task(
-    bind=True,
-    max_retries=3,
-    default_retry_delay=30,
-    name="tasks.process_document",
-)
-
-def process_document_task(
-    self,
-    doc_id: str,
-    file_path: str,
-    metadata: Dict[str, Any],
-):
-    """
-    Background Celery task: 
-    1. Call IngestionPipeline.process_document() to process the document and store chunks in Qdrant.
-    2. Update status about document store
-    """
-    from backend.app.core.ingestion.pipeline import IngestionPipeline
-    from backend.app.api.v1.documents import update_doc_status
+    """Run coroutine from Celery (sync context) trên event loop persistent của worker process"""
+    return runtime.run(coro)
 
+def _local_path(file_path: str) -> str:
     # Translate Docker path → local path if worker runs outside container
     # Docker: /project/Docs/xxx.pdf → Local: /home/yennguyen/Hyena/Docs/xxx.pdf
-    import os
     if not os.path.exists(file_path):
         project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
         local_path = file_path.replace("/project/", project_root + "/")
         if os.path.exists(local_path):
-            file_path = local_path
+            return local_path
+    return file_path
+
+def ingest_document(doc_id: str, file_path: str, metadata: Dict[str, Any]):
+    """
+    Khởi chạy ingestion chain: parse → (extract | caption) → embed → upsert.
+    extract và caption chỉ cần checkpoint của parse → group trong chord, embed chạy khi cả 2 xong
+    (chord cần result backend: Redis, xem celery_app).
+    Mỗi stage chạy trên queue riêng (ingest.<stage>, xem celery_app.task_routes) → scale /
+    tune concurrency từng stage độc lập. Giữa các stages chỉ truyền `job` nhỏ
+    ({doc_id, metadata, timings}); chunks / vectors nằm trong CheckpointStore.
+
+    Returns:
+        AsyncResult của task cuối (upsert)
+    """
+    return chain(
+        parse_stage_task.s(doc_id, file_path, metadata),
+        chord(group(extract_stage_task.s(), caption_stage_task.s()), embed_stage_task.s()),
+        upsert_stage_task.s(),
+    ).apply_async()
+
+def _run_stage(
+    task,
+    stage: str,
+    job: Dict[str, Any],
+    body: Callable[..., Awaitable[Optional[Dict[str, Any]]]],
+) -> Dict[str, Any]:
+    """
+    Chạy 1 stage của chain:
+    - Progress tiếp tục từ các stages trước (ProgressReporter.resume)
+    - Checkpoint của stage đã có (task chết sau khi ghi xong) → bỏ qua, chuyển tiếp luôn
+    - Lỗi → self.retry: chỉ chạy lại stage này, input đọc từ checkpoints. Status `retrying`
+      khi còn lượt retry; `failed` khi hết lượt hoặc input không còn (CheckpointMissing)
+    """
+    from backend.app.core.ingestion.checkpoints import CheckpointMissing, CheckpointStore
+    from backend.app.core.ingestion.progress import ProgressReporter
+
+    doc_id = job["doc_id"]
+    checkpoints = CheckpointStore(doc_id)
+    done = STAGE_DEPENDENCIES[stage]
+
+    async def _stage():
+        progress = ProgressReporter(doc_id)
+        progress.resume(name for previous in done for name in STAGE_PROGRESS[previous])
+        try:
+            if not done or task.request.retries:
+                await progress.status("processing", error=None)
+            if checkpoints.has(stage):
+                print(f"[Celery] doc_id={doc_id}: '{stage}' checkpoint found, skipping")
+                return job
+            print(f"[Celery] doc_id={doc_id}: stage '{stage}' (attempt {task.request.retries + 1})")
+            t0 = time.perf_counter()
+            timings = dict(job["timings"])
+            updates = await body(runtime.get_pipeline(), checkpoints, progress, timings)
+            timings[f"stage_{stage}"] = time.perf_counter() - t0
+            return {**job, **(updates or {}), "timings": {k: round(v, 3) for k, v in timings.items()}}
+        except Exception as exc:
+            print(f"[Celery] Failed doc_id={doc_id} at stage '{stage}': {exc}")
+            exhausted = task.request.retries >= task.max_retries
+            await progress.status("failed" if exhausted or isinstance(exc, CheckpointMissing) else "retrying", error=str(exc))
+            raise
 
     try:
-        update_doc_status(doc_id, "processing")
-        print(f"[Celery] Starting ingestion for doc_id={doc_id}")
-
-        pipeline = IngestionPipeline()
-        result = _run_async(
-            pipeline.process_document(
-                file_path=file_path,
-                doc_id=doc_id,
-                metadata=metadata,
-            )
+        return _run_async(_stage())
+    except CheckpointMissing:
+        # Input của stage không còn (document bị xoá / upload lại) → retry cũng không giúp được
+        raise
+    except Exception as exc:
+        raise task.retry(exc=exc)
+
+def _merge_jobs(jobs: Union[Dict[str, Any], List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """Kết quả chord (1 job / header task) → 1 job, gộp timings của extract và caption."""
+    if isinstance(jobs, dict):
+        return jobs
+    timings = {}
+    for job in jobs:
+        timings.update(job["timings"])
+    return {**jobs[0], "timings": timings}
+
+async def _load_chunks(checkpoints) -> Dict[str, Any]:
+    extracted, captioned = await asyncio.gather(
+        asyncio.to_thread(checkpoints.load, "extract"),
+        asyncio.to_thread(checkpoints.load, "caption"),
+    )
+    return {**extracted, **captioned}
+
+@celery_app.task(name="tasks.ingest.parse", soft_time_limit=600, time_limit=900, **STAGE_TASK_OPTIONS)
+def parse_stage_task(self, doc_id: str, file_path: str, metadata: Dict[str, Any]):
+    """LlamaParse → checkpoint ParsedDocument. Lần chạy đầu xoá checkpoints cũ của doc_id (version trước)."""
+    if not self.request.retries:
+        from backend.app.core.ingestion.checkpoints import CheckpointStore
+
+        CheckpointStore(doc_id).clear()
+
+    async def _parse(pipeline, checkpoints, progress, timings):
+        parsed = await pipeline.parse(_local_path(file_path), timings, progress)
+        await asyncio.to_thread(checkpoints.save_parsed, parsed)
+
+    job = {"doc_id": doc_id, "metadata": {**metadata, "doc_id": doc_id}, "timings": {}}
+    return _run_stage(self, "parse", job, _parse)
+
+@celery_app.task(name="tasks.ingest.extract", soft_time_limit=300, time_limit=420, **STAGE_TASK_OPTIONS)
+def extract_stage_task(self, job: Dict[str, Any]):
+    """Text + table chunks từ ParsedDocument đã checkpoint."""
+
+    async def _extract(pipeline, checkpoints, progress, timings):
+        parsed = await asyncio.to_thread(checkpoints.load_parsed)
+        text_chunks, table_chunks = await pipeline.extract(parsed, job["metadata"], timings, progress)
+        await asyncio.to_thread(checkpoints.save, "extract", {"text": text_chunks, "table": table_chunks})
+
+    return _run_stage(self, "extract", job, _extract)
+
+@celery_app.task(name="tasks.ingest.caption", soft_time_limit=900, time_limit=1200, **STAGE_TASK_OPTIONS)
+def caption_stage_task(self, job: Dict[str, Any]):
+    """Image chunks (pre-filter + Gemini captions) từ ParsedDocument đã checkpoint."""
+
+    async def _caption(pipeline, checkpoints, progress, timings):
+        parsed = await asyncio.to_thread(checkpoints.load_parsed)
+        image_chunks = await pipeline.caption(parsed, job["metadata"], timings, progress)
+        await asyncio.to_thread(checkpoints.save, "caption", {"image": image_chunks})
+
+    return _run_stage(self, "caption", job, _caption)
+
+@celery_app.task(name="tasks.ingest.embed", soft_time_limit=600, time_limit=900, **STAGE_TASK_OPTIONS)
+def embed_stage_task(self, jobs: Union[Dict[str, Any], List[Dict[str, Any]]]):
+    """
+    Body của chord extract | caption (nhận list jobs).
+    Diff với Qdrant → embed chunks mới, ghi vectors (packed float32) theo collection.
+    Checkpoint `embed` (ids + stale ids) chỉ ghi sau khi mọi collection đã embed xong.
+    """
+    job = _merge_jobs(jobs)
+
+    async def _embed(pipeline, checkpoints, progress, timings):
+        chunks = await _load_chunks(checkpoints)
+        collections = pipeline.collections(chunks["text"], chunks["table"], chunks["image"])
+        new_chunks, stale_ids = await pipeline.diff(collections, job["doc_id"], timings)
+        progress.start_store(sum(len(c) for c in new_chunks.values()), stages=("embed",))
+
+        dim = pipeline.embedder.dim
+        for name, pending in new_chunks.items():
+            writer = checkpoints.vector_writer(name, dim)
+            try:
+                async for _, vectors in pipeline.embed(pending, timings, progress):
+                    await asyncio.to_thread(writer.write, vectors)
+            except BaseException:
+                writer.abort()
+                raise
+            writer.commit()
+
+        await asyncio.to_thread(checkpoints.save, "embed", {
+            "dim": dim,
+            "collections": {name: [c["id"] for c in pending] for name, pending in new_chunks.items()},
+            "stale": stale_ids,
+        })
+
+    return _run_stage(self, "embed", job, _embed)
+
+@celery_app.task(name="tasks.ingest.upsert", soft_time_limit=300, time_limit=420, **STAGE_TASK_OPTIONS)
+def upsert_stage_task(self, job: Dict[str, Any]):
+    """
+    Bulk upsert vectors đã checkpoint (đọc lại theo batch), xoá chunks cũ, status completed.
+    Point IDs deterministic → retry giữa chừng upsert lại cùng points, không tạo bản trùng.
+    """
+    from backend.app.config import get_settings
+    from backend.app.core.ingestion.checkpoints import CheckpointMissing
+
+    settings = get_settings()
+
+    async def _batches(checkpoints, name, pending, dim):
+        batch_size = settings.upsert_batch_size
+        vectors = checkpoints.iter_vectors(name, dim, batch_size)
+        for i in range(0, len(pending), batch_size):
+            batch = pending[i:i + batch_size]
+            batch_vectors = await asyncio.to_thread(next, vectors, [])
+            if len(batch_vectors) != len(batch):
+                raise CheckpointMissing(f"Incomplete vectors for {name}, doc_id={job['doc_id']}")
+            yield batch, batch_vectors
+
+    async def _upsert(pipeline, checkpoints, progress, timings):
+        plan, chunks = await asyncio.gather(asyncio.to_thread(checkpoints.load, "embed"), _load_chunks(checkpoints))
+        by_id = {c["id"]: c for kind in ("text", "table", "image") for c in chunks[kind]}
+        pending = {name: [by_id[i] for i in ids] for name, ids in plan["collections"].items() if ids}
+        progress.start_store(sum(len(c) for c in pending.values()), stages=("upsert",))
+
+        upserted, deleted = await pipeline.store(
+            {name: pipeline.points(_batches(checkpoints, name, c, plan["dim"])) for name, c in pending.items()},
+            plan["stale"],
+            job["metadata"],
+            timings,
+            progress,
         )
+        counts = {f"{kind}_chunks": len(chunks[kind]) for kind in ("text", "table", "image")}
+        counts["total_chunks"] = sum(counts.values())
+        await progress.status("completed", **counts)
+        await asyncio.to_thread(checkpoints.clear)
+        print(f"[Celery] Completed doc_id={job['doc_id']}: {upserted} upserted, {deleted} stale deleted")
+        return {**counts, "upserted_chunks": upserted, "deleted_chunks": deleted, "status": "completed"}
 
-        update_doc_status(doc_id, "completed", result=result)
-        print(f"[Celery] Completed doc_id={doc_id} with result: {result}")
-        return result
-    except Exception as exc:
-        error_msg = str(exc)
-        print(f"[Celery] Failed doc_id={doc_id}: {error_msg}")
-        update_doc_status(doc_id, "failed", error=error_msg)
-        raise self.retry(exc=exc)
\ No newline at end of file
+    return _run_stage(self, "upsert", job, _upsert)
+
+@celery_app.task(name="tasks.process_document")
+def process_document_task(doc_id: str, file_path: str, metadata: Dict[str, Any]) -> str:
+    """
+    Entry point cũ (1 task chạy cả pipeline). Giữ lại cho messages đã nằm trong queue
+    trước khi deploy → chuyển sang ingestion chain, trả về id của task cuối.
+    """
+    return ingest_document(doc_id, file_path, metadata).id
+
+@celery_app.task(name="tasks.parse_cache_stats")
+def parse_cache_stats_task() -> Dict[str, Any]:
+    """
+    Hit/miss counters của ParseCache trên worker host.
+    Usage: celery_app.send_task("tasks.parse_cache_stats").get()
+    """
+    from backend.app.core.ingestion.parse_cache import ParseCache
+
+    return ParseCache().stats()
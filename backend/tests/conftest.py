@@ -0,0 +1,157 @@
+import os
+
+# Settings đọc env lúc import → đặt trước khi test modules import backend.app.*
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("LLAMA_CLOUD_API_KEY", "test")
+os.environ.setdefault("GOOGLE_API_KEY", "test")
+os.environ.setdefault("EMBEDDING_BACKEND", "local")
+os.environ.setdefault("VISION_BACKEND", "local")
+os.environ.setdefault("EMBEDDING_CACHE_ENABLED", "false")
+os.environ.setdefault("CAPTION_CACHE_ENABLED", "false")
+os.environ.setdefault("ANSWER_CACHE_ENABLED", "false")
+
+from collections import defaultdict
+
+import pytest
+from redis.exceptions import WatchError
+
+from backend.app.core import document_registry
+
+
+class FakeRedis:
+    """
+    Async Redis tối thiểu trong RAM (decode_responses=True) cho DocumentRegistry:
+    strings / hashes / sorted sets / sets, pipeline + WATCH / MULTI.
+    `before_execute`: coroutines chạy ngay trước EXEC kế tiếp (giả lập client khác ghi đè).
+    """
+
+    def __init__(self):
+        self.strings, self.hashes, self.sets = {}, {}, {}
+        self.zsets = defaultdict(dict)
+        self.versions = defaultdict(int)
+        self.before_execute = []
+
+    def _touch(self, *keys):
+        for key in keys:
+            self.versions[key] += 1
+
+    async def get(self, key):
+        return self.strings.get(key)
+
+    async def set(self, key, value, nx=False):
+        if nx and key in self.strings:
+            return None
+        self.strings[key] = str(value)
+        self._touch(key)
+        return True
+
+    async def delete(self, *keys):
+        removed = 0
+        for key in keys:
+            for store in (self.strings, self.hashes, self.zsets, self.sets):
+                if store.pop(key, None) is not None:
+                    removed += 1
+        self._touch(*keys)
+        return removed
+
+    async def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    async def hmget(self, key, fields):
+        return [self.hashes.get(key, {}).get(field) for field in fields]
+
+    async def hset(self, key, mapping):
+        self.hashes.setdefault(key, {}).update({k: str(v) for k, v in mapping.items()})
+        self._touch(key)
+        return len(mapping)
+
+    async def zadd(self, key, mapping):
+        self.zsets[key].update(mapping)
+        self._touch(key)
+        return len(mapping)
+
+    async def zrem(self, key, *members):
+        removed = sum(self.zsets[key].pop(m, None) is not None for m in members)
+        self._touch(key)
+        return removed
+
+    def _ranked(self, members):
+        return [m for m, _ in sorted(members.items(), key=lambda item: (item[1], item[0]))]
+
+    async def zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    async def zrevrange(self, key, start, end):
+        ranked = self._ranked(self.zsets.get(key, {}))[::-1]
+        return ranked[start:None if end == -1 else end + 1]
+
+    async def zinter(self, keys, aggregate="MAX"):
+        common = set(self.zsets.get(keys[0], {})).intersection(*(self.zsets.get(k, {}) for k in keys[1:]))
+        return self._ranked({m: max(self.zsets[k][m] for k in keys) for m in common})
+
+    async def smembers(self, key):
+        return set(self.sets.get(key, set()))
+
+    async def srem(self, key, *members):
+        self.sets.get(key, set()).difference_update(members)
+        self._touch(key)
+
+    async def publish(self, channel, message):
+        return 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """Trước MULTI (đang WATCH) lệnh chạy ngay và phải await; ngược lại xếp hàng tới execute()."""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self._reset()
+
+    def _reset(self):
+        self.commands, self.watched, self.watching, self.queued = [], {}, False, False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._reset()
+
+    async def watch(self, *keys):
+        self.watching = True
+        self.watched = {key: self.redis.versions[key] for key in keys}
+
+    async def unwatch(self):
+        self._reset()
+
+    def multi(self):
+        self.queued = True
+
+    def __getattr__(self, name):
+        command = getattr(self.redis, name)
+        if self.watching and not self.queued:
+            return command
+
+        def _queue(*args, **kwargs):
+            self.commands.append((command, args, kwargs))
+            return self
+        return _queue
+
+    async def execute(self):
+        while self.redis.before_execute:
+            await self.redis.before_execute.pop(0)
+        if any(self.redis.versions[key] != version for key, version in self.watched.items()):
+            self._reset()
+            raise WatchError("Watched variable changed.")
+        commands = self.commands
+        self._reset()
+        return [await command(*args, **kwargs) for command, args, kwargs in commands]
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(document_registry, "get_async_redis", lambda *args, **kwargs: redis)
+    return redis
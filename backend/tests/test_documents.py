@@ -0,0 +1,196 @@
+import asyncio
+import hashlib
+import io
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from starlette.datastructures import UploadFile
+
+from backend.app.api.limits import MULTIPART_OVERHEAD, UploadSizeLimitMiddleware
+from backend.app.api.v1 import documents as documents_module
+from backend.app.core.document_registry import INDEX_STATUS_KEY, DocumentRegistry
+
+PDF = b"%PDF-1.7\n" + b"x" * 64
+
+
+@pytest.fixture
+def uploads(monkeypatch, tmp_path, fake_redis):
+    """upload_document với Redis giả, UPLOAD_DIR tạm; trả về list (doc_id, file_path) đã enqueue."""
+    enqueued = []
+    monkeypatch.setattr(documents_module, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(documents_module, "ingest_document",
+                        lambda doc_id, file_path, metadata: enqueued.append((doc_id, file_path)))
+    return enqueued
+
+
+def upload(content, filename="vnm_q3.pdf", company="Vinamilk", year=2025, quarter="Q3"):
+    file = UploadFile(file=io.BytesIO(content), filename=filename)
+    return asyncio.run(documents_module.upload_document(file=file, company=company, year=year, quarter=quarter))
+
+
+def test_upload_rejects_non_pdf_content(uploads, tmp_path):
+    with pytest.raises(HTTPException) as exc:
+        upload(b"<html>not a pdf</html>")
+
+    assert exc.value.status_code == 400
+    assert list(tmp_path.iterdir()) == [] and uploads == []
+
+
+def test_upload_over_limit_is_413_and_leaves_no_temp_file(uploads, tmp_path, monkeypatch):
+    monkeypatch.setattr(documents_module.settings, "max_upload_mb", 1)
+    monkeypatch.setattr(documents_module.settings, "upload_chunk_size", 64 * 1024)
+
+    with pytest.raises(HTTPException) as exc:
+        upload(PDF + b"x" * (1024 * 1024))
+
+    assert exc.value.status_code == 413
+    assert list(tmp_path.iterdir()) == [] and uploads == []
+
+
+def test_upload_streams_file_into_place_with_hash(uploads, tmp_path):
+    content = PDF + b"y" * (3 * 1024 * 1024)
+    doc = upload(content)
+
+    stored = asyncio.run(documents_module.registry.get(doc.doc_id))
+    assert stored["file_hash"] == hashlib.sha256(content).hexdigest()
+    assert stored["file_size"] == len(content)
+    assert [p.name for p in tmp_path.iterdir()] == [f"{doc.doc_id}_vnm_q3.pdf"]
+
+
+def test_same_file_is_deduplicated_by_hash(uploads):
+    first = upload(PDF)
+    again = upload(PDF, filename="renamed.pdf", company="VNM")
+
+    assert again.doc_id == first.doc_id
+    assert again.message.startswith("Document already uploaded")
+    assert len(uploads) == 1
+
+
+def test_failed_upload_can_be_retried_with_same_file(uploads):
+    first = upload(PDF)
+    asyncio.run(documents_module.registry.update(first.doc_id, status="failed"))
+
+    retried = upload(PDF)
+
+    assert retried.doc_id == first.doc_id
+    assert len(uploads) == 2
+
+
+def test_new_version_reuses_doc_id_and_releases_old_hash(uploads):
+    first = upload(PDF)
+    asyncio.run(documents_module.registry.update(first.doc_id, status="completed"))
+    second = upload(PDF + b"v2", company=" vinamilk ", quarter="q3")
+
+    assert second.doc_id == first.doc_id
+    assert [doc_id for doc_id, _ in uploads] == [first.doc_id, first.doc_id]
+    # Hash bản cũ đã được giải phóng → upload lại bản cũ là 1 phiên bản mới nữa, không bị coi là trùng
+    asyncio.run(documents_module.registry.update(first.doc_id, status="completed"))
+    assert upload(PDF).message.startswith("New version uploaded")
+
+
+def test_new_version_rejected_while_previous_is_processing(uploads):
+    first = upload(PDF)
+
+    with pytest.raises(HTTPException) as exc:
+        upload(PDF + b"v2")
+
+    assert exc.value.status_code == 409
+    assert len(uploads) == 1
+
+    asyncio.run(documents_module.registry.update(first.doc_id, status="completed"))
+    second = upload(PDF + b"v2")
+    assert second.doc_id == first.doc_id
+    assert second.message.startswith("New version uploaded")
+
+
+def test_delete_runs_blocking_cleanup_off_the_event_loop(uploads, monkeypatch):
+    doc = upload(PDF)
+    threads = []
+    monkeypatch.setattr(documents_module, "_delete_document_data", lambda d: threads.append(threading.get_ident()))
+
+    asyncio.run(documents_module.delete_document(doc.doc_id))
+
+    assert threads and threads[0] != threading.get_ident()
+    assert asyncio.run(documents_module.registry.get(doc.doc_id)) is None
+
+
+def run_limited(content_length, path="/api/v1/documents/upload"):
+    """Gọi UploadSizeLimitMiddleware (max 1 MB); trả về (status, app phía sau có được gọi không)."""
+    reached, sent = [], []
+
+    async def _app(scope, receive, send):
+        reached.append(scope["path"])
+
+    async def _receive():
+        raise AssertionError("body must not be read")
+
+    async def _send(message):
+        sent.append(message)
+
+    middleware = UploadSizeLimitMiddleware(_app, paths=["/api/v1/documents/upload"], max_bytes=1024 * 1024)
+    scope = {"type": "http", "method": "POST", "path": path,
+             "headers": [(b"content-length", str(content_length).encode())]}
+    asyncio.run(middleware(scope, _receive, _send))
+    status = sent[0]["status"] if sent else None
+    return status, bool(reached)
+
+
+def test_upload_size_limit_rejects_by_content_length_before_reading_body():
+    assert run_limited(1024 * 1024 + MULTIPART_OVERHEAD + 1) == (413, False)
+    assert run_limited(1024 * 1024) == (None, True)
+    assert run_limited(10 * 1024 * 1024, path="/api/v1/query/") == (None, True)
+
+
+# ── DocumentRegistry ────────────────────────────────────────────────
+
+def seed(registry, docs):
+    start = datetime(2025, 1, 1)
+    for i, (company, status) in enumerate(docs):
+        asyncio.run(registry.create({
+            "doc_id": f"doc-{i}", "filename": f"{i}.pdf", "company": company, "year": 2025,
+            "quarter": None, "status": status, "created_at": start + timedelta(hours=i),
+        }))
+
+
+def test_registry_list_pages_newest_first_with_filters(fake_redis):
+    registry = DocumentRegistry()
+    seed(registry, [("Vinamilk", "completed"), ("Hoa Phat", "completed"),
+                    ("Vinamilk", "failed"), ("Vinamilk", "completed")])
+
+    def ids(**kwargs):
+        docs, total = asyncio.run(registry.list(**kwargs))
+        return [d["doc_id"] for d in docs], total
+
+    assert ids(limit=2) == (["doc-3", "doc-2"], 4)
+    assert ids(limit=2, offset=2) == (["doc-1", "doc-0"], 4)
+    assert ids(status="completed") == (["doc-3", "doc-1", "doc-0"], 3)
+    assert ids(company=" VINAMILK ") == (["doc-3", "doc-2", "doc-0"], 3)
+    assert ids(status="completed", company="vinamilk", limit=1, offset=1) == (["doc-0"], 2)
+
+
+def test_registry_update_moves_status_index(fake_redis):
+    registry = DocumentRegistry()
+    seed(registry, [("Vinamilk", "pending")])
+
+    assert asyncio.run(registry.update("doc-0", status="processing", progress_percent=10))
+    assert not asyncio.run(registry.update("missing", status="failed"))
+
+    assert asyncio.run(registry.get("doc-0"))["progress_percent"] == 10
+    assert "doc-0" not in fake_redis.zsets[INDEX_STATUS_KEY.format("pending")]
+    assert "doc-0" in fake_redis.zsets[INDEX_STATUS_KEY.format("processing")]
+
+
+def test_registry_update_retries_when_status_changes_concurrently(fake_redis):
+    """Worker khác đổi status giữa HMGET và EXEC → WatchError → đọc lại, không để doc ở 2 indexes."""
+    registry = DocumentRegistry()
+    seed(registry, [("Vinamilk", "pending")])
+    fake_redis.before_execute.append(registry.update("doc-0", status="retrying"))
+
+    asyncio.run(registry.update("doc-0", status="completed"))
+
+    indexed = [status for status in ("pending", "retrying", "completed")
+               if "doc-0" in fake_redis.zsets[INDEX_STATUS_KEY.format(status)]]
+    assert indexed == ["completed"]
+    assert asyncio.run(registry.get("doc-0"))["status"] == "completed"
@@ -0,0 +1,495 @@
+import asyncio
+import base64
+import hashlib
+import io
+import os
+import random
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+from PIL import Image
+from qdrant_client import QdrantClient
+
+from backend.app.core import async_utils
+from backend.app.core.async_utils import TokenBucket, retry_with_backoff
+from backend.app.core.ingestion import checkpoints as checkpoints_module
+from backend.app.core.ingestion import pipeline as pipeline_module
+from backend.app.core.ingestion.checkpoints import CheckpointMissing
+from backend.app.core.ingestion.chunk_ids import assign_chunk_ids
+from backend.app.core.ingestion.image_filter import ImagePreFilter
+from backend.app.core.ingestion.image_processor import ImageProcessor, LocalVisionBackend
+from backend.app.core.ingestion.parse_cache import ParseCache
+from backend.app.core.ingestion.progress import ProgressReporter
+from backend.app.core.retrieval import embedder as embedder_module
+from backend.app.core.retrieval import qdrant_client as qdrant_module
+from backend.app.core.retrieval.embedder import (
+    AsyncEmbedder,
+    LocalEmbeddingBackend,
+    pack_by_token_budget,
+)
+from backend.app.core.retrieval.qdrant_client import QdrantClientWrapper
+from backend.app.models.parsed_document import ParsedDocument, ParsedImage, ParsedPage
+from backend.app.workers import runtime, tasks
+
+
+@pytest.fixture
+def word_tokens(monkeypatch):
+    """1 token / từ → budget tests không phụ thuộc tiktoken (offline)."""
+    monkeypatch.setattr(embedder_module, "count_tokens", lambda text: len(text.split()))
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    """Backoff không ngủ thật; trả về list delays đã yêu cầu."""
+    delays = []
+
+    async def _sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(asyncio, "sleep", _sleep)
+    return delays
+
+
+# ── pack_by_token_budget ────────────────────────────────────────────
+
+def test_pack_fills_batch_exactly_to_budget(word_tokens):
+    texts = ["a b", "c d", "e f", "g"]
+    assert pack_by_token_budget(texts, max_tokens=4) == [[0, 1], [2, 3]]
+
+
+def test_pack_starts_new_batch_when_budget_exceeded(word_tokens):
+    texts = ["a b c", "d e", "f"]
+    assert pack_by_token_budget(texts, max_tokens=4) == [[0], [1, 2]]
+
+
+def test_pack_single_input_over_budget_gets_own_batch(word_tokens):
+    texts = ["a", "b " * 10, "c"]
+    assert pack_by_token_budget(texts, max_tokens=4) == [[0], [1], [2]]
+
+
+def test_pack_respects_max_items(word_tokens):
+    texts = ["a"] * 5
+    assert pack_by_token_budget(texts, max_tokens=100, max_items=2) == [[0, 1], [2, 3], [4]]
+
+
+def test_pack_empty():
+    assert pack_by_token_budget([], max_tokens=10) == []
+
+
+# ── AsyncEmbedder ───────────────────────────────────────────────────
+
+class RecordingBackend(LocalEmbeddingBackend):
+    """LocalEmbeddingBackend ghi lại từng batch; `fail_times` lần gọi đầu raise lỗi retryable."""
+
+    def __init__(self, fail_times: int = 0, slow_first: bool = False):
+        super().__init__(dim=64)
+        self.batches = []
+        self.fail_times = fail_times
+        self.slow_first = slow_first
+
+    async def embed(self, texts):
+        if self.fail_times:
+            self.fail_times -= 1
+            raise openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com"))
+        self.batches.append(list(texts))
+        if self.slow_first and len(self.batches) == 1:
+            # Batch đầu hoàn thành sau cùng → kết quả phải ghép theo index, không theo thứ tự xong
+            await asyncio.sleep(0.05)
+        return await super().embed(texts)
+
+
+def test_embedder_keeps_input_order_across_batches(word_tokens):
+    backend = RecordingBackend(slow_first=True)
+    embedder = AsyncEmbedder(backend=backend, cache=None)
+    embedder.batch_tokens = 2
+    texts = [f"revenue {i}" for i in range(6)]
+
+    vectors = asyncio.run(embedder.embed_batch(texts))
+
+    assert len(backend.batches) == 6
+    assert vectors == [backend.embed_one(t) for t in texts]
+
+
+def test_embedder_retries_retryable_errors(word_tokens, no_sleep):
+    backend = RecordingBackend(fail_times=2)
+    embedder = AsyncEmbedder(backend=backend, cache=None)
+
+    vectors = asyncio.run(embedder.embed_batch(["doanh thu", "lợi nhuận"]))
+
+    assert len(no_sleep) == 2
+    assert vectors == [backend.embed_one("doanh thu"), backend.embed_one("lợi nhuận")]
+
+
+def test_embedder_gives_up_after_max_retries(word_tokens, no_sleep):
+    backend = RecordingBackend(fail_times=10)
+    embedder = AsyncEmbedder(backend=backend, cache=None)
+    embedder.max_retries = 3
+
+    with pytest.raises(openai.APIConnectionError):
+        asyncio.run(embedder.embed_batch(["doanh thu"]))
+    assert len(no_sleep) == 3
+
+
+# ── retry_with_backoff / TokenBucket ────────────────────────────────
+
+class Flaky:
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError("boom")
+        return "ok"
+
+
+def test_backoff_jitter_stays_within_exponential_bound(no_sleep, monkeypatch):
+    bounds = []
+
+    def _uniform(low, high):
+        bounds.append((low, high))
+        return high
+
+    monkeypatch.setattr(async_utils.random, "uniform", _uniform)
+    fn = Flaky(failures=4)
+
+    result = asyncio.run(retry_with_backoff(fn, retry_on=(ConnectionError,), base_delay=1.0, max_delay=5.0))
+
+    assert result == "ok"
+    assert bounds == [(0, 2.0), (0, 4.0), (0, 5.0), (0, 5.0)]
+    assert no_sleep == [2.0, 4.0, 5.0, 5.0]
+
+
+def test_backoff_full_jitter_is_random(no_sleep):
+    random.seed(7)
+    asyncio.run(retry_with_backoff(Flaky(failures=5), retry_on=(ConnectionError,), base_delay=1.0, max_delay=8.0))
+    assert all(0 <= delay <= 8.0 for delay in no_sleep)
+    assert len(set(no_sleep)) == len(no_sleep)
+
+
+def test_backoff_retry_after_hint_is_capped_by_max_delay(no_sleep):
+    asyncio.run(retry_with_backoff(
+        Flaky(failures=1),
+        retry_on=(ConnectionError,),
+        base_delay=0.1,
+        max_delay=3.0,
+        retry_after=lambda e: 120.0,
+    ))
+    assert no_sleep == [3.0]
+
+
+def test_backoff_does_not_retry_other_errors(no_sleep):
+    async def _fail():
+        raise ValueError("bad input")
+
+    with pytest.raises(ValueError):
+        asyncio.run(retry_with_backoff(_fail, retry_on=(ConnectionError,)))
+    assert no_sleep == []
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    """time.monotonic + asyncio.sleep giả: sleep chỉ tăng đồng hồ (rates lũy thừa 2 → float chính xác)."""
+    clock = {"now": 0.0}
+
+    async def _sleep(delay):
+        clock["now"] += delay
+
+    monkeypatch.setattr(async_utils.time, "monotonic", lambda: clock["now"])
+    monkeypatch.setattr(asyncio, "sleep", _sleep)
+    return clock
+
+
+def test_token_bucket_allows_burst_then_paces(fake_clock):
+    bucket = TokenBucket(rate=4.0, capacity=2)
+
+    async def _acquire_all(n):
+        times = []
+        for _ in range(n):
+            await bucket.acquire()
+            times.append(fake_clock["now"])
+        return times
+
+    times = asyncio.run(_acquire_all(5))
+
+    assert times[:2] == [0.0, 0.0]
+    assert times[2:] == pytest.approx([0.25, 0.5, 0.75])
+
+
+def test_token_bucket_refills_up_to_capacity(fake_clock):
+    bucket = TokenBucket(rate=8.0, capacity=3)
+
+    async def _run():
+        for _ in range(3):
+            await bucket.acquire()
+        fake_clock["now"] += 60.0    # idle lâu vẫn chỉ tích tối đa capacity tokens
+        start = fake_clock["now"]
+        for _ in range(4):
+            await bucket.acquire()
+        return fake_clock["now"] - start
+
+    assert asyncio.run(_run()) == pytest.approx(0.125)
+
+
+# ── ImageProcessor ──────────────────────────────────────────────────
+
+def noise_png(seed: int) -> bytes:
+    """Ảnh nhiễu đủ lớn / entropy cao để qua ImagePreFilter, dHash khác nhau theo seed."""
+    rng = random.Random(seed)
+    img = Image.frombytes("RGB", (200, 150), rng.randbytes(200 * 150 * 3))
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class ReversedLatencyBackend(LocalVisionBackend):
+    """Ảnh trước trả lời chậm hơn ảnh sau → captions hoàn thành theo thứ tự ngược."""
+
+    def __init__(self, latencies):
+        super().__init__()
+        self.latencies = latencies
+
+    async def caption(self, image_bytes):
+        await asyncio.sleep(self.latencies.pop(0))
+        return await super().caption(image_bytes)
+
+
+def test_image_processor_keeps_page_order_under_concurrency():
+    images = [noise_png(seed) for seed in range(5)]
+    parsed = ParsedDocument(
+        file_path="report.pdf",
+        pages=[
+            ParsedPage(page_num=page, images=[
+                ParsedImage(page_num=page, index=0, data=base64.b64encode(images[page - 1]).decode())
+            ])
+            for page in range(1, 6)
+        ],
+    )
+    processor = ImageProcessor(backend=ReversedLatencyBackend([0.05, 0.04, 0.03, 0.02, 0.01]), cache=None)
+
+    chunks = asyncio.run(processor.process(parsed, {"doc_id": "doc-1"}))
+
+    assert [c["metadata"]["page_num"] for c in chunks] == [1, 2, 3, 4, 5]
+    digests = [hashlib.sha256(image).hexdigest()[:12] for image in images]
+    assert [c["content"].split("sha256:")[1] for c in chunks] == digests
+
+
+def png(img: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_prefilter_drops_decorative_and_repeated_images():
+    chart = noise_png(1)
+    images = [
+        chart,
+        png(Image.new("RGB", (40, 40), "red")),                           # icon
+        png(Image.frombytes("RGB", (900, 100), random.Random(2).randbytes(900 * 100 * 3))),  # banner
+        png(Image.new("RGB", (300, 200), "white")),                       # 1 màu
+        png(Image.open(io.BytesIO(chart)).resize((300, 225))),            # chart lặp lại, khác kích thước
+        b"not an image",
+        noise_png(3),
+    ]
+
+    result = ImagePreFilter(min_width=120, min_height=80, max_aspect_ratio=6.0,
+                            min_entropy=3.0, dup_distance=4).run(images)
+
+    assert [i for i, _ in result.kept] == [0, 6]
+    assert result.dropped == {"too_small": 1, "aspect_ratio": 1, "low_entropy": 1,
+                              "duplicate": 1, "unreadable": 1}
+    assert result.kept[0][1].sha256 == hashlib.sha256(chart).hexdigest()
+
+
+@pytest.fixture
+def stage_statuses(monkeypatch, tmp_path):
+    """_run_stage không cần worker / Redis: loop mới mỗi lần chạy, statuses ghi vào list."""
+    statuses = []
+
+    async def _status(self, status, **fields):
+        statuses.append(status)
+
+    monkeypatch.setattr(ProgressReporter, "status", _status)
+    monkeypatch.setattr(runtime, "run", asyncio.run)
+    monkeypatch.setattr(runtime, "get_pipeline", lambda: None)
+    monkeypatch.setattr(checkpoints_module.settings, "checkpoint_dir", str(tmp_path))
+    return statuses
+
+
+@pytest.mark.parametrize("retries, error, expected", [
+    (0, RuntimeError("rate limited"), "retrying"),
+    (2, RuntimeError("rate limited"), "retrying"),
+    (3, RuntimeError("rate limited"), "failed"),
+    (0, CheckpointMissing("parse.json"), "failed"),
+])
+def test_run_stage_fails_only_when_retries_exhausted(stage_statuses, retries, error, expected):
+    task = SimpleNamespace(request=SimpleNamespace(retries=retries), max_retries=3, retry=lambda exc: exc)
+
+    async def _body(pipeline, checkpoints, progress, timings):
+        raise error
+
+    with pytest.raises(type(error)):
+        tasks._run_stage(task, "extract", {"doc_id": "doc-1", "metadata": {}, "timings": {}}, _body)
+
+    assert stage_statuses[-1] == expected
+
+
+def test_merge_jobs_combines_chord_timings():
+    extract = {"doc_id": "doc-1", "metadata": {"doc_id": "doc-1"}, "timings": {"parse": 1.0, "stage_extract": 2.0}}
+    caption = {"doc_id": "doc-1", "metadata": {"doc_id": "doc-1"}, "timings": {"parse": 1.0, "stage_caption": 3.0}}
+
+    job = tasks._merge_jobs([extract, caption])
+
+    assert job["metadata"] == {"doc_id": "doc-1"}
+    assert job["timings"] == {"parse": 1.0, "stage_extract": 2.0, "stage_caption": 3.0}
+    assert tasks._merge_jobs(extract) is extract
+
+
+def test_worker_rebuilds_pipeline_when_init_failed(monkeypatch):
+    """Qdrant chưa sẵn sàng lúc worker_process_init → task đầu tiên tạo lại pipeline."""
+    attempts = []
+
+    class FlakyPipeline:
+        def __init__(self):
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise ConnectionError("qdrant:6333 refused")
+
+    async def _noop():
+        pass
+
+    monkeypatch.setattr(pipeline_module, "IngestionPipeline", FlakyPipeline)
+    monkeypatch.setattr(runtime, "_warm_clients", _noop)
+    monkeypatch.setattr(runtime, "_close_clients", _noop)
+    monkeypatch.setattr(runtime, "_loop", None)
+    monkeypatch.setattr(runtime, "_pipeline", None)
+
+    runtime.init_worker_resources()
+    try:
+        assert runtime._pipeline is None
+        assert isinstance(runtime.get_pipeline(), FlakyPipeline)
+        assert runtime.get_pipeline() is runtime.get_pipeline() and len(attempts) == 2
+    finally:
+        runtime.shutdown_worker_resources()
+
+
+# ── QdrantClientWrapper.aupsert_stream ──────────────────────────────
+
+class FakeAsyncQdrant:
+    """Ghi lại (số points, wait) của mỗi upsert; các lần gọi trong `fail_calls` raise."""
+
+    def __init__(self, fail_calls=()):
+        self.fail_calls = set(fail_calls)
+        self.calls = []
+
+    async def upsert(self, collection_name, points, wait):
+        call = len(self.calls)
+        self.calls.append((len(points), wait))
+        if call in self.fail_calls:
+            raise RuntimeError(f"upsert {call} rejected")
+        await asyncio.sleep(0)
+
+
+def bulk_loader(monkeypatch, client):
+    wrapper = QdrantClientWrapper()
+    wrapper._sparse["text_chunks"] = False
+    monkeypatch.setattr(qdrant_module, "get_async_qdrant", lambda: client)
+    return wrapper
+
+
+async def points(n):
+    """Async generator như embed stage: batch lỗi xong (và rời slot) trước khi generator cạn."""
+    for i in range(n):
+        await asyncio.sleep(0)
+        yield {"id": i, "vector": [0.0, 1.0], "payload": {"content": str(i)}}
+
+
+def test_aupsert_stream_sends_last_batch_with_wait(monkeypatch):
+    client = FakeAsyncQdrant()
+    acked = []
+
+    async def _on_batch(n):
+        acked.append(n)
+
+    stats = asyncio.run(bulk_loader(monkeypatch, client).aupsert_stream(
+        "text_chunks", points(10), batch_size=2, parallel=2, on_batch=_on_batch,
+    ))
+
+    assert stats["points"] == 10 and stats["batches"] == 5
+    assert [wait for _, wait in client.calls] == [False] * 4 + [True]
+    assert sum(acked) == 10
+
+
+def test_aupsert_stream_raises_when_a_batch_fails(monkeypatch):
+    client = FakeAsyncQdrant(fail_calls={0})
+
+    with pytest.raises(RuntimeError, match="upsert 0 rejected"):
+        asyncio.run(bulk_loader(monkeypatch, client).aupsert_stream(
+            "text_chunks", points(10), batch_size=2, parallel=2,
+        ))
+
+    # Không gửi batch cuối wait=True → caller không coi document là đã upsert đủ
+    assert (2, True) not in client.calls
+
+
+# ── Stable chunk IDs / re-ingest diff ───────────────────────────────
+
+def chunk(content, page, doc_id="doc-1"):
+    return {"content": content, "metadata": {"doc_id": doc_id, "chunk_type": "text", "page": page}}
+
+
+@pytest.fixture
+def memory_pipeline(monkeypatch):
+    """IngestionPipeline thật trên Qdrant in-memory (collections tạo bởi ensure_collections)."""
+    monkeypatch.setattr(qdrant_module, "QdrantClient", lambda **kwargs: QdrantClient(":memory:"))
+    return pipeline_module.IngestionPipeline()
+
+
+def test_chunk_ids_are_stable_per_doc_content_and_occurrence():
+    first = assign_chunk_ids([chunk("Revenue", 1), chunk("Revenue", 1), chunk("Revenue", 2)])
+    again = assign_chunk_ids([chunk("Revenue", 1), chunk("Revenue", 1), chunk("Revenue", 2)])
+    other_doc = assign_chunk_ids([chunk("Revenue", 1, doc_id="doc-2")])
+
+    assert [c["id"] for c in first] == [c["id"] for c in again]
+    assert len({c["id"] for c in first}) == 3
+    assert other_doc[0]["id"] != first[0]["id"]
+
+
+@pytest.mark.filterwarnings("ignore:Payload indexes have no effect")
+def test_reingest_diff_embeds_only_changed_chunks(memory_pipeline):
+    v1 = assign_chunk_ids([chunk("Revenue 100", 1), chunk("Profit 10", 2), chunk("Assets 500", 3)])
+    memory_pipeline.qdrant.upsert_chunks("text_chunks", [
+        {"id": c["id"], "vector": [0.0] * memory_pipeline.qdrant.embedding_dim, "payload": c} for c in v1
+    ])
+    v2 = assign_chunk_ids([chunk("Revenue 100", 1), chunk("Profit 12", 2), chunk("Assets 500", 3)])
+
+    new_chunks, stale_ids = asyncio.run(memory_pipeline.diff({"text_chunks": v2}, "doc-1", {}))
+
+    assert [c["content"] for c in new_chunks["text_chunks"]] == ["Profit 12"]
+    assert stale_ids["text_chunks"] == [v1[1]["id"]]
+
+
+# ── ParseCache ──────────────────────────────────────────────────────
+
+def parsed_doc(name):
+    return ParsedDocument(file_path=name, pages=[ParsedPage(page_num=1, markdown="x" * 1000)])
+
+
+def test_parse_cache_evicts_least_recently_used_over_bound(tmp_path):
+    entry_size = len(parsed_doc("a.pdf").model_dump_json())
+    cache = ParseCache(cache_dir=str(tmp_path), max_bytes=2 * entry_size)
+
+    for i, key in enumerate(["a", "b"]):
+        cache.put(key, parsed_doc(f"{key}.pdf"))
+        os.utime(cache._path(key), (1000 + i, 1000 + i))
+    assert cache.get("a").file_path == "a.pdf"   # a vừa dùng → b là LRU
+    cache.put("c", parsed_doc("c.pdf"))
+
+    assert sorted(e["key"] for e in cache.entries()) == ["a", "c"]
+    assert cache.get("b") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (1, 1, 1)
+    assert stats["size_bytes"] <= cache.max_bytes
@@ -0,0 +1,312 @@
+import asyncio
+
+import pytest
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.models import Distance, SparseVector, VectorParams
+
+from backend.app.core.generation import answer_cache as answer_cache_module
+from backend.app.core.generation import context_builder as context_builder_module
+from backend.app.core.generation.answer_cache import ANSWER_COLLECTION, AnswerCache
+from backend.app.core.generation.context_builder import ContextBuilder
+from backend.app.core.generation.query_analyzer import QueryAnalyzer
+from backend.app.core.generation.rag_engine import RAGEngine
+from backend.app.core.retrieval.qdrant_client import QdrantClientWrapper
+from backend.app.core.retrieval.query_cache import QueryVectorCache
+from backend.app.core.retrieval.retriever import MultiCollectionRetriever
+from backend.app.core.retrieval.schema import SCHEMA_VERSION, SchemaManager
+
+
+@pytest.fixture
+def analyzer():
+    return QueryAnalyzer()
+
+
+# ── QueryAnalyzer.analyze_local ─────────────────────────────────────
+
+@pytest.mark.parametrize("question", [
+    "Hoa Phat revenue 2024",
+    "Masan net profit Q3 2025?",
+    "Doanh thu của Hoa Phat năm 2024 là bao nhiêu?",
+    "HPG revenue 2024",
+])
+def test_local_defers_unknown_company_to_llm(analyzer, question):
+    assert analyzer.analyze_local(question) is None
+
+
+@pytest.mark.parametrize("question", [
+    "Vinamilk revenue Q3 2025",
+    "Doanh thu VNM năm 2024 là bao nhiêu?",
+])
+def test_local_resolves_known_company(analyzer, question):
+    analysis = analyzer.analyze_local(question)
+    assert analysis is not None
+    assert analysis["entities"]["company"] == "Vinamilk"
+
+
+@pytest.mark.parametrize("question", [
+    "What was revenue in 2024?",
+    "Doanh thu năm 2024 là bao nhiêu?",
+    "EPS Q4 2025",
+])
+def test_local_handles_question_without_entity(analyzer, question):
+    analysis = analyzer.analyze_local(question)
+    assert analysis is not None
+    assert analysis["entities"]["company"] is None
+    assert analysis["source"] == "local"
+
+
+def test_local_defers_multi_year_questions(analyzer):
+    assert analyzer.analyze_local("Vinamilk revenue 2023 vs 2024") is None
+
+
+# ── SchemaManager (local in-memory Qdrant) ──────────────────────────
+
+@pytest.fixture
+def qdrant():
+    return QdrantClient(":memory:")
+
+
+@pytest.mark.filterwarnings("ignore:Payload indexes have no effect")
+def test_schema_records_version_on_create(qdrant):
+    schema = SchemaManager(qdrant, embedding_dim=8, hybrid=True)
+    schema.create("text_chunks")
+    assert schema.stored_version("text_chunks") == SCHEMA_VERSION
+    assert schema.describe("text_chunks")["schema_version"] == SCHEMA_VERSION
+
+    dense_only = SchemaManager(qdrant, embedding_dim=8, hybrid=False)
+    dense_only.create("table_chunks")
+    assert dense_only.describe("table_chunks")["schema_version"] == SCHEMA_VERSION - 1
+
+
+@pytest.mark.filterwarnings("ignore:Payload indexes have no effect")
+def test_schema_migrates_unversioned_collection_from_detected_version(qdrant):
+    qdrant.create_collection("legacy", vectors_config=VectorParams(size=8, distance=Distance.COSINE))
+    schema = SchemaManager(qdrant, embedding_dim=8, hybrid=False)
+    assert schema.describe("legacy")["schema_version"] is None
+
+    changes = schema.migrate("legacy")
+
+    assert changes[0] == "detected v0"
+    assert schema.stored_version("legacy") == 2
+    assert "detected v0" not in schema.migrate("legacy")
+
+
+@pytest.mark.filterwarnings("ignore:Payload indexes have no effect")
+def test_schema_drop_forgets_version(qdrant):
+    schema = SchemaManager(qdrant, embedding_dim=8, hybrid=False)
+    schema.create("bench")
+    schema.drop("bench")
+    assert not qdrant.collection_exists("bench")
+    assert schema.stored_version("bench") is None
+
+
+@pytest.mark.filterwarnings("ignore:Payload indexes have no effect")
+def test_schema_hybrid_on_collection_without_bm25_falls_back(qdrant, capsys):
+    qdrant.create_collection("legacy", vectors_config=VectorParams(size=8, distance=Distance.COSINE))
+    schema = SchemaManager(qdrant, embedding_dim=8, hybrid=True)
+
+    schema.migrate("legacy")
+
+    assert schema.stored_version("legacy") == SCHEMA_VERSION - 1
+    assert "falls back to dense-only" in capsys.readouterr().out
+
+
+# ── Hybrid fallback / retrieval errors ──────────────────────────────
+
+def test_points_drop_sparse_vector_for_dense_only_collection():
+    chunk = {"id": 1, "vector": [0.1, 0.2], "sparse_vector": SparseVector(indices=[3], values=[1.0]), "payload": {}}
+    assert isinstance(QdrantClientWrapper._to_point(chunk, sparse=True).vector, dict)
+    assert QdrantClientWrapper._to_point(chunk, sparse=False).vector == [0.1, 0.2]
+
+
+def fake_retriever(monkeypatch, failing):
+    retriever = MultiCollectionRetriever()
+
+    async def _asearch(collection_name, query_vector, limit, filters=None, sparse_vector=None):
+        if collection_name in failing:
+            raise RuntimeError(f"{collection_name} has no sparse vector named bm25")
+        return [{"id": f"{collection_name}-{i}", "score": 1.0 - i / 10, "content": "", "metadata": {}}
+                for i in range(limit)]
+
+    monkeypatch.setattr(retriever.qdrant, "asearch", _asearch)
+    return retriever
+
+
+def test_search_skips_failed_collection_and_logs(monkeypatch, capsys):
+    retriever = fake_retriever(monkeypatch, failing={"image_chunks"})
+
+    hits = asyncio.run(retriever.search([0.0] * 8, top_k_text=2, top_k_table=2, top_k_image=2))
+
+    assert {h["source_collection"] for h in hits} == {"text", "table"}
+    assert "image_chunks search failed: RuntimeError" in capsys.readouterr().out
+
+
+def test_search_raises_when_every_collection_fails(monkeypatch):
+    retriever = fake_retriever(monkeypatch, failing={"text_chunks", "table_chunks", "image_chunks"})
+
+    with pytest.raises(RuntimeError, match="bm25"):
+        asyncio.run(retriever.search([0.0] * 8))
+
+
+# ── AnswerCache scope ───────────────────────────────────────────────
+
+def test_scope_entities_capture_company_and_period(analyzer):
+    assert analyzer.scope_entities("Vinamilk revenue Q3 2025") == {
+        "company": "Vinamilk", "years": [2025], "quarters": ["Q3"],
+    }
+    assert analyzer.scope_entities("Hoa Phat revenue 2024")["names"] == ["hoa", "phat"]
+
+
+def test_answer_cache_paraphrases_differing_only_in_period_miss(monkeypatch):
+    """Cùng query vector (cosine 1.0) nhưng khác quý → không được dùng lại câu trả lời."""
+    engine = RAGEngine()
+    engine.answer_cache = AnswerCache(engine.retriever.embedder.cache_model)
+
+    async def _embed(question):
+        return [1.0] + [0.0] * (engine.answer_cache.embedding_dim - 1)
+
+    monkeypatch.setattr(engine.retriever, "embed_question", _embed)
+
+    async def _run():
+        client = AsyncQdrantClient(":memory:")
+        monkeypatch.setattr(answer_cache_module, "get_async_qdrant", lambda: client)
+        await engine._store_answer("Vinamilk revenue Q3 2025", 5, None, "Q3: 15,000B VND", [], {})
+        return (
+            await engine._cached_answer("Vinamilk revenue Q4 2025", 5, None),
+            await engine._cached_answer("What was Vinamilk revenue in Q3 2025?", 5, None),
+        )
+
+    other_quarter, same_quarter = asyncio.run(_run())
+
+    assert other_quarter is None
+    assert same_quarter["answer"] == "Q3: 15,000B VND"
+
+
+def test_invalidate_matches_filters_case_insensitively(monkeypatch, tmp_path):
+    """Entry lưu với filter "vinamilk" / "q3" vẫn bị xóa khi document "Vinamilk" Q3 đổi."""
+    cache = AnswerCache("test-model")
+    vector = [1.0] + [0.0] * (cache.embedding_dim - 1)
+
+    async def _store():
+        client = AsyncQdrantClient(path=str(tmp_path))
+        monkeypatch.setattr(answer_cache_module, "get_async_qdrant", lambda: client)
+        for company in ("vinamilk", " VINAMILK ", "Hoa Phat"):
+            filters = {"company": company, "year": 2025, "quarter": "q3"}
+            await cache.astore(f"{company} revenue", vector, filters, 5, "answer", [])
+        await client.close()
+
+    asyncio.run(_store())
+    client = QdrantClient(path=str(tmp_path))
+    try:
+        AnswerCache.invalidate(client, {"company": "Vinamilk", "year": 2025, "quarter": "Q3"})
+        remaining = client.scroll(ANSWER_COLLECTION, with_payload=True)[0]
+    finally:
+        client.close()
+    assert [p.payload["filters"]["company"] for p in remaining] == ["Hoa Phat"]
+
+
+# ── ContextBuilder.pack ─────────────────────────────────────────────
+
+@pytest.fixture
+def word_tokens(monkeypatch):
+    """1 token / từ → budget tests không phụ thuộc tiktoken (offline)."""
+    monkeypatch.setattr(context_builder_module, "count_tokens", lambda text: len(text.split()))
+    monkeypatch.setattr(context_builder_module, "truncate_tokens", lambda text, n: " ".join(text.split()[:n]))
+
+
+def hit(content, score, page=1, collection="text"):
+    return {"content": content, "score": score, "source_collection": collection,
+            "metadata": {"doc_id": "doc-1", "company": "Vinamilk", "page_num": page}}
+
+
+def words(prefix, n):
+    return " ".join(f"{prefix}{i}" for i in range(n))
+
+
+def test_pack_fills_budget_by_score_and_skips_duplicates(word_tokens):
+    # header ~10 tokens / chunk: top 30 + mid 22 + low 20 = 72 ≤ 75; big (50) không còn vừa
+    builder = ContextBuilder(token_budget=75, dedup_threshold=0.8)
+    chunks = [
+        hit(words("low", 10), 0.2, page=3),
+        hit(words("top", 20), 0.9, page=1),
+        hit(words("top", 20), 0.8, page=2),      # trùng nội dung chunk tốt nhất
+        hit(words("big", 40), 0.7, page=4),      # không còn vừa budget
+        hit(words("mid", 12), 0.5, page=5),
+    ]
+
+    packed, stats = builder.pack(chunks)
+
+    assert [c["score"] for c in packed] == [0.9, 0.5, 0.2]
+    assert stats["duplicates"] == 1 and stats["over_budget"] == 1
+    assert stats["tokens_used"] <= 75
+
+
+def test_pack_truncates_single_chunk_larger_than_budget(word_tokens):
+    packed, stats = ContextBuilder(token_budget=30).pack([hit(words("w", 100), 0.9)])
+
+    assert len(packed) == 1
+    assert stats["tokens_used"] <= 30
+
+
+def test_pack_trims_wide_long_table_to_relevant_rows_and_columns(word_tokens):
+    header = "| Metric | " + " | ".join(f"Q{q} {y}" for y in (2024, 2025) for q in (1, 2, 3, 4)) + " |"
+    separator = "|" + "---|" * 9
+    rows = [f"| Item{i} | " + " | ".join(str(i * 10 + c) for c in range(8)) + " |" for i in range(30)]
+    rows[17] = "| Revenue | " + " | ".join(str(c) for c in range(8)) + " |"
+    table = "\n".join([header, separator, *rows])
+    builder = ContextBuilder(token_budget=10_000, table_max_rows=5, table_max_cols=3)
+
+    packed, stats = builder.pack([hit(table, 0.9, collection="table")], question="Revenue Q3 2025")
+
+    lines = packed[0]["content"].split("\n")
+    assert stats["trimmed_tables"] == 1
+    # Cột tên chỉ tiêu + các cột / hàng khớp từ khóa câu hỏi, giữ thứ tự gốc
+    assert lines[0] == "| Metric | Q3 2024 | Q3 2025 |"
+    assert lines[2:] == ["| Revenue | 2 | 6 |", "(trimmed: 1/30 rows, 3/9 columns relevant to the question)"]
+
+
+# ── QueryVectorCache (LRU + single-flight) ──────────────────────────
+
+def test_query_cache_coalesces_concurrent_misses():
+    cache = QueryVectorCache(maxsize=2)
+    calls = []
+
+    async def _embed():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return [1.0, 0.0]
+
+    async def _run():
+        key = cache.make_key("m", "Vinamilk  revenue")
+        vectors = await asyncio.gather(*(cache.get_or_compute(key, _embed) for _ in range(5)))
+        again = await cache.get_or_compute(cache.make_key("m", "Vinamilk revenue"), _embed)
+        return vectors, again
+
+    vectors, again = asyncio.run(_run())
+
+    assert len(calls) == 1
+    assert vectors == [[1.0, 0.0]] * 5 and again == [1.0, 0.0]
+    assert (cache.misses, cache.coalesced, cache.hits) == (1, 4, 1)
+
+
+def test_query_cache_does_not_cache_failures_and_evicts_lru():
+    cache = QueryVectorCache(maxsize=2)
+
+    async def _fail():
+        raise RuntimeError("openai down")
+
+    async def _vector(value):
+        return [value]
+
+    async def _run():
+        with pytest.raises(RuntimeError):
+            await cache.get_or_compute("a", _fail)
+        assert await cache.get_or_compute("a", lambda: _vector(1.0)) == [1.0]   # lỗi không được cache
+        await cache.get_or_compute("b", lambda: _vector(2.0))
+        await cache.get_or_compute("a", lambda: _vector(9.0))                   # hit → a mới dùng
+        await cache.get_or_compute("c", lambda: _vector(3.0))                   # evict b (LRU)
+
+    asyncio.run(_run())
+
+    assert list(cache._entries) == ["a", "c"]
+    assert cache.stats()["size"] == 2
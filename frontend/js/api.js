@@ -23,10 +23,23 @@ const Api = {
     return res.json();
   },
 
-  async listDocuments() {
-    const res = await fetch(`${API_BASE}/documents/`);
+  /** 1 trang documents (mới nhất trước) + tổng số từ header X-Total-Count */
+  async listDocuments(limit = 100, offset = 0) {
+    const res = await fetch(`${API_BASE}/documents/?limit=${limit}&offset=${offset}`);
     if (!res.ok) throw new Error('Failed to load documents');
-    return res.json();
+    const items = await res.json();
+    const total = parseInt(res.headers.get('X-Total-Count'), 10);
+    return { items, total: Number.isNaN(total) ? offset + items.length : total };
+  },
+
+  /** Mọi documents: đọc lần lượt các trang tới khi đủ X-Total-Count */
+  async listAllDocuments(pageSize = 500) {
+    const all = [];
+    while (true) {
+      const { items, total } = await this.listDocuments(pageSize, all.length);
+      all.push(...items);
+      if (items.length === 0 || all.length >= total) return all;
+    }
   },
 
   async getDocumentStatus(docId) {
@@ -35,6 +48,11 @@ const Api = {
     return res.json();
   },
 
+  /** SSE stream tiến độ ingestion: events `status` + `progress` ({ percent, message, ... }) */
+  documentEventsUrl(docId) {
+    return `${API_BASE}/documents/${docId}/events`;
+  },
+
   async deleteDocument(docId) {
     const res = await fetch(`${API_BASE}/documents/${docId}`, { method: 'DELETE' });
     if (!res.ok) throw new Error('Failed to delete document');
@@ -63,8 +81,15 @@ const Api = {
     return res.json();
   },
 
-  /** Streaming query — gọi callback(token) với mỗi token */
-  async queryStream(question, options = {}, onToken, onDone, onError) {
+  /**
+   * Streaming query (SSE) — backend gửi typed events:
+   *   sources → handlers.onSources(sources)   (trước tokens)
+   *   token   → handlers.onToken(token)
+   *   done    → handlers.onDone({ timings, context, cached })
+   *   error   → handlers.onError(err)
+   */
+  async queryStream(question, options = {}, handlers = {}) {
+    const { onSources, onToken, onDone, onError } = handlers;
     const body = {
       question,
       top_k: options.topK || 5,
@@ -83,6 +108,7 @@ const Api = {
       const reader = res.body.getReader();
       const decoder = new TextDecoder();
       let buffer = '';
+      let eventName = 'message';
 
       while (true) {
         const { done, value } = await reader.read();
@@ -92,17 +118,19 @@ const Api = {
         buffer = lines.pop(); // Keep incomplete last line
 
         for (const line of lines) {
-          if (!line.startsWith('data: ')) continue;
-          const data = line.slice(6).trim();
-          if (data === '[DONE]') { onDone && onDone(); return; }
-          try {
-            const json = JSON.parse(data);
-            if (json.token) onToken && onToken(json.token);
-            if (json.error) throw new Error(json.error);
-          } catch (e) { /* skip malformed */ }
+          if (line.startsWith('event: ')) { eventName = line.slice(7).trim(); continue; }
+          if (!line.startsWith('data: ')) { if (!line.trim()) eventName = 'message'; continue; }
+
+          let json;
+          try { json = JSON.parse(line.slice(6)); } catch (e) { continue; /* skip malformed */ }
+
+          if (eventName === 'sources') onSources && onSources(json.sources || []);
+          else if (eventName === 'token') onToken && onToken(json.token);
+          else if (eventName === 'done') { onDone && onDone(json); return; }
+          else if (eventName === 'error') throw new Error(json.error);
         }
       }
-      onDone && onDone();
+      onDone && onDone({});
     } catch (e) {
       onError && onError(e);
     }
@@ -69,33 +69,39 @@ const Chat = (() => {
       await Api.queryStream(
         question,
         { company: company || null, year: year || null },
-        // onToken
-        (token) => {
-          fullText += token;
-          assistantMsgEl.querySelector('.msg-bubble').innerHTML = renderMarkdown(fullText);
-          scrollToBottom(document.getElementById('chat-messages'));
-        },
-        // onDone
-        () => {
-          // Fetch full result for citations via non-streaming query
-          fetchCitations(question, company, year, assistantMsgEl);
-          setLoading(false);
-        },
-        // onError
-        async (err) => {
-          console.warn('Stream failed, falling back to regular query:', err);
-          // Fallback to regular query
-          try {
-            const result = await Api.query(question, { company: company || null, year: year || null });
-            assistantMsgEl.querySelector('.msg-bubble').innerHTML = renderMarkdown(result.answer);
-            if (result.sources && result.sources.length > 0) {
-              pendingSources = result.sources;
-              renderCitations(assistantMsgEl, result.sources);
+        {
+          // Citations đến trước tokens — không cần gọi lại /query/ sau khi stream xong
+          onSources: (sources) => {
+            if (sources.length > 0) {
+              pendingSources = sources;
+              renderCitations(assistantMsgEl, sources);
             }
-          } catch (e2) {
-            assistantMsgEl.querySelector('.msg-bubble').textContent = `❌ Lỗi: ${e2.message}`;
-          }
-          setLoading(false);
+          },
+          onToken: (token) => {
+            fullText += token;
+            assistantMsgEl.querySelector('.msg-bubble').innerHTML = renderMarkdown(fullText);
+            scrollToBottom(document.getElementById('chat-messages'));
+          },
+          onDone: ({ timings, context, cached }) => {
+            if (timings) console.debug(`Query timings (s)${cached ? ' [answer cache]' : ''}:`, timings);
+            if (context) console.debug('Context packing:', context);
+            setLoading(false);
+          },
+          onError: async (err) => {
+            console.warn('Stream failed, falling back to regular query:', err);
+            // Fallback to regular query
+            try {
+              const result = await Api.query(question, { company: company || null, year: year || null });
+              assistantMsgEl.querySelector('.msg-bubble').innerHTML = renderMarkdown(result.answer);
+              if (result.sources && result.sources.length > 0) {
+                pendingSources = result.sources;
+                renderCitations(assistantMsgEl, result.sources);
+              }
+            } catch (e2) {
+              assistantMsgEl.querySelector('.msg-bubble').textContent = `❌ Lỗi: ${e2.message}`;
+            }
+            setLoading(false);
+          },
         }
       );
     } catch (e) {
@@ -105,18 +111,6 @@ const Chat = (() => {
     }
   }
 
-  async function fetchCitations(question, company, year, msgEl) {
-    try {
-      const result = await Api.query(question, { company: company || null, year: year || null });
-      if (result.sources && result.sources.length > 0) {
-        pendingSources = result.sources;
-        renderCitations(msgEl, result.sources);
-      }
-    } catch (e) {
-      console.warn('Failed to fetch citations:', e);
-    }
-  }
-
   function appendMessage(role, content, sources = []) {
     const messages = document.getElementById('chat-messages');
     const div = document.createElement('div');
@@ -3,6 +3,8 @@
 const Upload = (() => {
   let selectedFile = null;
   let pollingIntervals = {};
+  let eventSources = {};
+  let modalDocId = null;
 
   function init() {
     // Open modal buttons
@@ -41,6 +43,7 @@ const Upload = (() => {
 
   function closeModal() {
     document.getElementById('upload-modal').classList.add('hidden');
+    modalDocId = null;
     resetForm();
   }
 
@@ -99,8 +102,9 @@ const Upload = (() => {
         created_at: new Date().toISOString(),
       });
 
-      // Poll status
-      startPolling(result.doc_id);
+      // Progress qua SSE (fallback: polling)
+      modalDocId = result.doc_id;
+      watchProgress(result.doc_id);
       setTimeout(closeModal, 2000);
 
     } catch (e) {
@@ -116,6 +120,50 @@ const Upload = (() => {
     document.getElementById('upload-status-text').textContent = text;
   }
 
+  /**
+   * 1 kết nối SSE / document: server push status + progress events (stage, percent),
+   * tự đóng khi completed / failed. Mất kết nối giữa chừng → chuyển sang polling.
+   */
+  function watchProgress(docId) {
+    if (eventSources[docId] || pollingIntervals[docId]) return;
+    if (!window.EventSource) return startPolling(docId);
+
+    const source = new EventSource(Api.documentEventsUrl(docId));
+    eventSources[docId] = source;
+
+    const onEvent = (e) => {
+      const ev = JSON.parse(e.data);
+      const update = { doc_id: docId, progress_percent: ev.percent };
+      if (ev.status) update.status = ev.status;
+      if (ev.total_chunks) update.total_chunks = ev.total_chunks;
+      DocList.addOrUpdate(update);
+      if (modalDocId === docId) setProgress(ev.percent, ev.message);
+
+      if (ev.type === 'status' && (ev.status === 'completed' || ev.status === 'failed')) {
+        source.close();
+        delete eventSources[docId];
+        finish(ev);
+      }
+    };
+    source.addEventListener('status', onEvent);
+    source.addEventListener('progress', onEvent);
+    source.onerror = () => {
+      if (!eventSources[docId]) return;  // đã đóng sau terminal status
+      source.close();
+      delete eventSources[docId];
+      startPolling(docId);
+    };
+  }
+
+  function finish(status) {
+    if (status.status === 'completed') {
+      showToast(`✅ Xử lý xong! ${status.total_chunks} chunks`, 'success');
+    } else {
+      showToast(`❌ Xử lý thất bại: ${status.error || 'unknown error'}`, 'error');
+    }
+    DocList.refresh();
+  }
+
   function startPolling(docId) {
     if (pollingIntervals[docId]) return;
     let attempts = 0;
@@ -126,22 +174,16 @@ const Upload = (() => {
         const status = await Api.getDocumentStatus(docId);
         DocList.addOrUpdate({ ...status, doc_id: docId });
 
-        if (status.status === 'completed') {
-          clearInterval(pollingIntervals[docId]);
-          delete pollingIntervals[docId];
-          showToast(`✅ Xử lý xong! ${status.total_chunks} chunks`, 'success');
-          DocList.refresh();
-        } else if (status.status === 'failed') {
+        if (status.status === 'completed' || status.status === 'failed') {
           clearInterval(pollingIntervals[docId]);
           delete pollingIntervals[docId];
-          showToast(`❌ Xử lý thất bại: ${status.error || 'unknown error'}`, 'error');
-          DocList.refresh();
+          finish(status);
         }
       } catch (e) { /* network blip, retry */ }
     }, 5000);
   }
 
-  return { init, startPolling };
+  return { init, watchProgress, startPolling };
 })();
 
 /* ═══════════════════════════════════════ DOC LIST MODULE ══ */
@@ -151,7 +193,7 @@ const DocList = (() => {
 
   async function refresh() {
     try {
-      const list = await Api.listDocuments();
+      const list = await Api.listAllDocuments();
       docs = {};
       list.forEach(d => { docs[d.doc_id] = d; });
       render();
@@ -194,6 +236,7 @@ const DocList = (() => {
           <span class="badge badge-year">${d.year}</span>
           ${d.quarter ? `<span class="badge badge-quarter">${d.quarter}</span>` : ''}
           ${d.total_chunks ? `<span class="badge badge-chunks">${d.total_chunks} chunks</span>` : ''}
+          ${d.status === 'processing' && d.progress_percent != null ? `<span class="badge badge-chunks">${d.progress_percent}%</span>` : ''}
         </div>
       </div>
     `).join('');
@@ -211,7 +254,7 @@ const DocList = (() => {
   }
 
   function statusLabel(s) {
-    return { pending: '⏳', processing: '⏳⏳', completed: '✓', failed: '✗' }[s] || s;
+    return { pending: '⏳', processing: '⏳⏳', retrying: '↻', completed: '✓', failed: '✗' }[s] || s;
   }
 
   function updateFilters() {
@@ -0,0 +1,432 @@
+"""
+Benchmarks cho Qdrant schema / retrieval trên corpus tổng hợp (không cần OpenAI).
+Usage:
+    python scripts/benchmark.py filters                       # filtered search: không index vs payload indexes
+    python scripts/benchmark.py filters -n 50000 --dim 1536 --queries 300
+    python scripts/benchmark.py quantization                  # recall@k / latency / RAM: none vs scalar vs binary
+    python scripts/benchmark.py quantization -n 50000 --oversampling 1 2 4
+    python scripts/benchmark.py dims                          # 256/512/1024/1536 dims: RAM, build time, latency, recall
+    python scripts/benchmark.py dims --source text_chunks     # dùng vectors thật từ collection (khuyến nghị)
+    python scripts/benchmark.py worker-startup                # overhead khởi động mỗi Celery task: cold vs warm
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qdrant_client import QdrantClient
+from qdrant_client.models import (
+    Distance,
+    FieldCondition,
+    Filter,
+    MatchValue,
+    PointStruct,
+    VectorParams,
+)
+
+from backend.app.config import get_settings
+from backend.app.core.retrieval.embedder import shorten_embedding
+from backend.app.core.retrieval.schema import SchemaManager, search_params
+
+settings = get_settings()
+
+QUARTERS = ["Q1", "Q2", "Q3", "Q4"]
+YEARS = list(range(2019, 2026))
+
+
+# ── synthetic corpus ────────────────────────────────────────────────
+def random_vectors(rng: np.random.Generator, n: int, dim: int) -> np.ndarray:
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def clustered_vectors(rng: np.random.Generator, n: int, dim: int, clusters: int = 200, spread: float = 0.35) -> np.ndarray:
+    """Vectors gom cụm quanh các centroids — gần phân bố embeddings thật hơn gaussian thuần."""
+    centroids = random_vectors(rng, clusters, dim)
+    labels = rng.integers(clusters, size=n)
+    noise = rng.standard_normal((n, dim)).astype(np.float32) * (spread / np.sqrt(dim))
+    vectors = centroids[labels] + noise
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Ground truth brute-force (cosine = dot product vì vectors đã normalize)."""
+    scores = queries @ corpus.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def recall_at_k(found, truth) -> float:
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def synthetic_payloads(rng: np.random.Generator, n: int, companies: int, docs: int):
+    doc_meta = [
+        {
+            "doc_id": str(uuid.UUID(int=int(rng.integers(0, 2**63)))),
+            "company": f"company_{rng.integers(companies)}",
+            "year": int(rng.choice(YEARS)),
+            "quarter": str(rng.choice(QUARTERS)),
+        }
+        for _ in range(docs)
+    ]
+    for i in range(n):
+        meta = doc_meta[i % docs]
+        yield {"content": f"chunk {i}", "metadata": {**meta, "chunk_type": "text"}}
+
+
+def load_corpus(client: QdrantClient, name: str, vectors: np.ndarray, payloads, batch_size: int = 512):
+    batch = []
+    for i, (vector, payload) in enumerate(zip(vectors, payloads)):
+        batch.append(PointStruct(id=i, vector=vector.tolist(), payload=payload))
+        if len(batch) >= batch_size:
+            client.upsert(collection_name=name, points=batch, wait=False)
+            batch = []
+    client.upsert(collection_name=name, points=batch, wait=True)
+
+
+def wait_until_green(client: QdrantClient, name: str, timeout: float = 600):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if str(client.get_collection(name).status).lower().endswith("green"):
+            return
+        time.sleep(0.5)
+
+
+def latency_report(samples_ms):
+    samples_ms = sorted(samples_ms)
+    return {
+        "p50": statistics.median(samples_ms),
+        "p95": samples_ms[int(len(samples_ms) * 0.95) - 1],
+        "mean": statistics.fmean(samples_ms),
+    }
+
+
+def print_report(label: str, report):
+    print(f"  {label:<28} p50={report['p50']:7.2f}ms  p95={report['p95']:7.2f}ms  mean={report['mean']:7.2f}ms")
+
+
+# ── filters ─────────────────────────────────────────────────────────
+def make_filters(rng: np.random.Generator, payloads, count: int):
+    """Các dạng filter retriever thật sự dùng: company+year, company+year+quarter, doc_id."""
+    filters = []
+    for _ in range(count):
+        meta = payloads[int(rng.integers(len(payloads)))]["metadata"]
+        kind = rng.integers(3)
+        if kind == 0:
+            keys = {"company": meta["company"], "year": meta["year"]}
+        elif kind == 1:
+            keys = {"company": meta["company"], "year": meta["year"], "quarter": meta["quarter"]}
+        else:
+            keys = {"doc_id": meta["doc_id"]}
+        filters.append(Filter(must=[
+            FieldCondition(key=f"metadata.{k}", match=MatchValue(value=v)) for k, v in keys.items()
+        ]))
+    return filters
+
+
+def run_queries(client: QdrantClient, name: str, queries: np.ndarray, filters, top_k: int):
+    search_ms, count_ms = [], []
+    for vector, query_filter in zip(queries, filters):
+        t0 = time.perf_counter()
+        client.query_points(collection_name=name, query=vector.tolist(), limit=top_k, query_filter=query_filter)
+        search_ms.append((time.perf_counter() - t0) * 1000)
+
+        # count exact theo filter ~ chi phí phần lọc của delete_by_doc_id
+        t0 = time.perf_counter()
+        client.count(collection_name=name, count_filter=query_filter, exact=True)
+        count_ms.append((time.perf_counter() - t0) * 1000)
+    return latency_report(search_ms), latency_report(count_ms)
+
+
+def bench_filters(args):
+    client = QdrantClient(host=args.host, port=args.port, timeout=300)
+    rng = np.random.default_rng(args.seed)
+    name = f"bench_filters_{uuid.uuid4().hex[:8]}"
+
+    print(f"Building synthetic corpus: {args.n} points, dim={args.dim}, {args.docs} docs, {args.companies} companies")
+    vectors = random_vectors(rng, args.n, args.dim)
+    payloads = list(synthetic_payloads(rng, args.n, args.companies, args.docs))
+    queries = random_vectors(rng, args.queries, args.dim)
+    filters = make_filters(rng, payloads, args.queries)
+
+    client.create_collection(
+        collection_name=name,
+        vectors_config=VectorParams(size=args.dim, distance=Distance.COSINE),
+    )
+    schema = SchemaManager(client, embedding_dim=args.dim, hybrid=False)
+    try:
+        t0 = time.perf_counter()
+        load_corpus(client, name, vectors, payloads)
+        wait_until_green(client, name)
+        print(f"Loaded in {time.perf_counter() - t0:.1f}s\n")
+
+        # warm-up
+        run_queries(client, name, queries[:10], filters[:10], args.top_k)
+        before = run_queries(client, name, queries, filters, args.top_k)
+
+        t0 = time.perf_counter()
+        changes = schema.migrate(name)
+        wait_until_green(client, name)
+        print(f"[Schema] v{schema.stored_version(name)}: {', '.join(changes)} ({time.perf_counter() - t0:.1f}s)\n")
+
+        run_queries(client, name, queries[:10], filters[:10], args.top_k)
+        after = run_queries(client, name, queries, filters, args.top_k)
+
+        print(f"Filtered search, {args.queries} queries, top_k={args.top_k}")
+        print_report("search (no payload index)", before[0])
+        print_report("search (payload indexes)", after[0])
+        print(f"  speedup p50: {before[0]['p50'] / after[0]['p50']:.2f}x")
+        print("Filter-only count (delete_by_doc_id path)")
+        print_report("count (no payload index)", before[1])
+        print_report("count (payload indexes)", after[1])
+        print(f"  speedup p50: {before[1]['p50'] / after[1]['p50']:.2f}x")
+    finally:
+        if not args.keep:
+            schema.drop(name)
+
+
+# ── quantization ────────────────────────────────────────────────────
+def vector_ram_bytes(n: int, dim: int, mode: str) -> int:
+    """RAM ước tính cho vectors (không gồm HNSW graph): float32 / int8 / 1 bit mỗi dim."""
+    return {"none": n * dim * 4, "scalar": n * dim, "binary": n * dim // 8}[mode]
+
+
+def bench_quantization(args):
+    client = QdrantClient(host=args.host, port=args.port, timeout=300)
+    rng = np.random.default_rng(args.seed)
+    suffix = uuid.uuid4().hex[:8]
+
+    print(f"Building clustered corpus: {args.n} points, dim={args.dim}")
+    corpus = clustered_vectors(rng, args.n, args.dim)
+    # Queries = điểm trong corpus + nhiễu (câu hỏi gần chunks có thật)
+    picks = rng.integers(args.n, size=args.queries)
+    queries = corpus[picks] + rng.standard_normal((args.queries, args.dim)).astype(np.float32) * (0.3 / np.sqrt(args.dim))
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    truth = exact_top_k(corpus, queries, args.top_k)
+    payloads = [{"content": f"chunk {i}", "metadata": {"chunk_type": "text"}} for i in range(args.n)]
+
+    rows = []
+    created = []
+    try:
+        for mode in ("none", "scalar", "binary"):
+            name = f"bench_quant_{mode}_{suffix}"
+            schema = SchemaManager(client, embedding_dim=args.dim, quantization=mode, hybrid=False)
+            schema.create(name)
+            created.append(name)
+            t0 = time.perf_counter()
+            load_corpus(client, name, corpus, payloads)
+            wait_until_green(client, name)
+            print(f"  {name}: loaded + indexed in {time.perf_counter() - t0:.1f}s")
+
+            variants = [("-", None)] if mode == "none" else [
+                (f"os={os_} rescore={rescore}", search_params(mode, oversampling=os_, rescore=rescore))
+                for os_ in args.oversampling
+                for rescore in (True, False)
+            ]
+            for label, params in variants:
+                found, latencies = [], []
+                for vector in queries:
+                    t0 = time.perf_counter()
+                    points = client.query_points(
+                        collection_name=name,
+                        query=vector.tolist(),
+                        limit=args.top_k,
+                        search_params=params,
+                    ).points
+                    latencies.append((time.perf_counter() - t0) * 1000)
+                    found.append([p.id for p in points])
+                report = latency_report(latencies)
+                rows.append((mode, label, recall_at_k(found, truth), report["p50"], report["p95"],
+                             vector_ram_bytes(args.n, args.dim, mode)))
+    finally:
+        if not args.keep:
+            for name in created:
+                schema.drop(name)
+
+    print(f"\nrecall@{args.top_k} vs exact brute force, {args.queries} queries")
+    print(f"  {'mode':<8} {'search params':<28} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'vector RAM':>11}")
+    for mode, label, recall, p50, p95, ram in rows:
+        print(f"  {mode:<8} {label:<28} {recall:7.3f} {p50:8.2f} {p95:8.2f} {ram / 2**20:9.1f}MB")
+    print("  (vector RAM là ước tính; với scalar/binary, vectors gốc float32 nằm trên disk, chỉ đọc khi rescore)")
+
+
+# ── dims ────────────────────────────────────────────────────────────
+def sample_collection_vectors(client: QdrantClient, name: str, n: int) -> np.ndarray:
+    vectors = []
+    offset = None
+    while len(vectors) < n:
+        points, offset = client.scroll(
+            collection_name=name, limit=min(1000, n - len(vectors)), offset=offset,
+            with_payload=False, with_vectors=True,
+        )
+        vectors.extend(p.vector for p in points)
+        if offset is None:
+            break
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def bench_dims(args):
+    client = QdrantClient(host=args.host, port=args.port, timeout=300)
+    rng = np.random.default_rng(args.seed)
+    suffix = uuid.uuid4().hex[:8]
+
+    if args.source:
+        corpus = sample_collection_vectors(client, args.source, args.n)
+        print(f"Sampled {len(corpus)} vectors ({corpus.shape[1]}-d) from '{args.source}'")
+    else:
+        corpus = clustered_vectors(rng, args.n, 1536)
+        print(f"Built clustered synthetic corpus: {len(corpus)} points, 1536-d "
+              f"(synthetic data spreads information evenly over dims → recall is pessimistic; prefer --source)")
+    full_dim = corpus.shape[1]
+
+    picks = rng.integers(len(corpus), size=args.queries)
+    queries = corpus[picks] + rng.standard_normal((args.queries, full_dim)).astype(np.float32) * (0.3 / np.sqrt(full_dim))
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    truth = exact_top_k(corpus, queries, args.top_k)  # ground truth ở số chiều đầy đủ
+    payloads = [{"content": f"chunk {i}", "metadata": {"chunk_type": "text"}} for i in range(len(corpus))]
+
+    rows = []
+    for dim in sorted(d for d in args.dims if d <= full_dim):
+        name = f"bench_dims_{dim}_{suffix}"
+        reduced = np.asarray([shorten_embedding(v.tolist(), dim) for v in corpus], dtype=np.float32)
+        reduced_queries = np.asarray([shorten_embedding(q.tolist(), dim) for q in queries], dtype=np.float32)
+
+        schema = SchemaManager(client, embedding_dim=dim, quantization="none", hybrid=False)
+        schema.create(name)
+        try:
+            t0 = time.perf_counter()
+            load_corpus(client, name, reduced, payloads)
+            load_s = time.perf_counter() - t0
+            wait_until_green(client, name)
+            build_s = time.perf_counter() - t0
+
+            found, latencies = [], []
+            for vector in reduced_queries:
+                t0 = time.perf_counter()
+                points = client.query_points(collection_name=name, query=vector.tolist(), limit=args.top_k).points
+                latencies.append((time.perf_counter() - t0) * 1000)
+                found.append([p.id for p in points])
+            report = latency_report(latencies)
+            rows.append((dim, vector_ram_bytes(len(corpus), dim, "none"), load_s, build_s,
+                         report["p50"], report["p95"], recall_at_k(found, truth)))
+        finally:
+            if not args.keep:
+                schema.drop(name)
+
+    print(f"\nrecall@{args.top_k} vs exact search at {full_dim}-d, {args.queries} queries")
+    print(f"  {'dim':>5} {'vector RAM':>11} {'upload s':>9} {'+index s':>9} {'p50 ms':>8} {'p95 ms':>8} {'recall':>7}")
+    for dim, ram, load_s, build_s, p50, p95, recall in rows:
+        print(f"  {dim:>5} {ram / 2**20:9.1f}MB {load_s:9.1f} {build_s:9.1f} {p50:8.2f} {p95:8.2f} {recall:7.3f}")
+
+
+# ── worker startup ──────────────────────────────────────────────────
+async def touch_clients(pipeline, round_trip: bool):
+    """Phần việc tối thiểu của 1 task: lấy pooled clients (+ 1 round-trip Qdrant)."""
+    from backend.app.core.clients import get_async_openai, get_async_qdrant
+
+    get_async_openai()
+    client = get_async_qdrant()
+    if round_trip:
+        await client.get_collections()
+    return pipeline
+
+
+def bench_worker_startup(args):
+    """
+    Cold = cách task cũ chạy: event loop mới + IngestionPipeline mới (LlamaParse, vision backend,
+    Qdrant client, ensure_collections) + clients mới cho loop đó, rồi đóng loop.
+    Warm = runtime của worker process: loop + pipeline + clients tạo 1 lần trong worker_process_init.
+    """
+    from backend.app.core.ingestion.pipeline import IngestionPipeline
+    from backend.app.workers import runtime
+
+    settings.qdrant_host, settings.qdrant_port = args.host, args.port
+    round_trip = not args.no_round_trip
+
+    def cold_task():
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(touch_clients(IngestionPipeline(), round_trip))
+        finally:
+            loop.close()
+
+    cold_task()  # import / first-connection warm-up, không tính
+    cold = []
+    for _ in range(args.tasks):
+        t0 = time.perf_counter()
+        cold_task()
+        cold.append((time.perf_counter() - t0) * 1000)
+
+    t0 = time.perf_counter()
+    runtime.init_worker_resources()
+    init_ms = (time.perf_counter() - t0) * 1000
+    warm = []
+    try:
+        for _ in range(args.tasks):
+            t0 = time.perf_counter()
+            runtime.run(touch_clients(runtime.get_pipeline(), round_trip))
+            warm.append((time.perf_counter() - t0) * 1000)
+    finally:
+        runtime.shutdown_worker_resources()
+
+    print(f"\nPer-task startup overhead, {args.tasks} tasks"
+          f"{' (incl. 1 Qdrant round-trip)' if round_trip else ''}")
+    print_report("cold (loop + pipeline/task)", latency_report(cold))
+    print_report("warm (worker_process_init)", latency_report(warm))
+    print(f"  one-time worker init: {init_ms:.1f}ms "
+          f"→ saves {statistics.fmean(cold) - statistics.fmean(warm):.1f}ms per task")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Qdrant retrieval benchmarks")
+    parser.add_argument("--host", default=settings.qdrant_host)
+    parser.add_argument("--port", type=int, default=settings.qdrant_port)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark collection afterwards")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    filters = sub.add_parser("filters", help="Filtered search latency without vs with payload indexes")
+    filters.add_argument("-n", type=int, default=20000, help="Number of points")
+    filters.add_argument("--dim", type=int, default=256)
+    filters.add_argument("--docs", type=int, default=400)
+    filters.add_argument("--companies", type=int, default=30)
+    filters.add_argument("--queries", type=int, default=200)
+    filters.add_argument("--top-k", type=int, default=5)
+    filters.set_defaults(func=bench_filters)
+
+    quant = sub.add_parser("quantization", help="Recall@k / latency / memory: unquantized vs scalar vs binary")
+    quant.add_argument("-n", type=int, default=20000, help="Number of points")
+    quant.add_argument("--dim", type=int, default=1536)
+    quant.add_argument("--queries", type=int, default=200)
+    quant.add_argument("--top-k", type=int, default=10)
+    quant.add_argument("--oversampling", type=float, nargs="+", default=[1.0, 2.0, 4.0])
+    quant.set_defaults(func=bench_quantization)
+
+    dims = sub.add_parser("dims", help="Memory / index build / latency / recall at reduced embedding dims")
+    dims.add_argument("-n", type=int, default=20000, help="Number of points")
+    dims.add_argument("--dims", type=int, nargs="+", default=[256, 512, 1024, 1536])
+    dims.add_argument("--source", help="Sample real vectors from this collection instead of synthetic ones")
+    dims.add_argument("--queries", type=int, default=200)
+    dims.add_argument("--top-k", type=int, default=10)
+    dims.set_defaults(func=bench_dims)
+
+    worker = sub.add_parser("worker-startup", help="Celery task startup overhead: per-task setup vs warm worker")
+    worker.add_argument("--tasks", type=int, default=20)
+    worker.add_argument("--no-round-trip", action="store_true", help="Skip the Qdrant call inside each task")
+    worker.set_defaults(func=bench_worker_startup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 """
-Chạy 1 lần để khởi tạo 3 Qdrant collections.
+Khởi tạo 3 Qdrant collections, hoặc migrate collections đã có lên schema hiện tại
+(payload indexes, HNSW config, on-disk payload). Chạy lại nhiều lần an toàn.
 Usage:
     cd /home/yennguyen/Hyena
     python scripts/init_collections.py
 """
+import json
 import sys
 import os
 
@@ -19,8 +21,7 @@ def main():
 
     print("\nDone! Collections info:")
     for name in [qdrant.TEXT_COLLECTION, qdrant.TABLE_COLLECTION, qdrant.IMAGE_COLLECTION]:
-        info = qdrant.client.get_collection(name)
-        print(f"  - {name}: {info.points_count} points")
+        print(f"  - {name}: {json.dumps(qdrant.schema.describe(name))}")
 
 
 if __name__ == "__main__":
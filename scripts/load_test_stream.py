@@ -0,0 +1,93 @@
+"""
+Load test cho /api/v1/query/stream: bắn N requests đồng thời, đo time-to-first-token
+và tổng thời gian từng request để kiểm tra các streams chạy chồng lên nhau (overlap)
+thay vì xếp hàng trên event loop.
+
+Usage:
+    python scripts/load_test_stream.py --url http://localhost:8001 -n 10
+    python scripts/load_test_stream.py -n 20 --question "Doanh thu Q4 2025 là bao nhiêu?"
+
+Đọc kết quả:
+    overlap factor = tổng thời gian các requests / wall time
+    ≈ 1   → requests bị serialize (event loop bị block)
+    ≈ N   → requests chạy song song hoàn toàn
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+
+
+async def one_request(client: httpx.AsyncClient, url: str, body: dict, t_start: float) -> dict:
+    started = time.perf_counter()
+    first_token = None
+    tokens = 0
+    async with client.stream("POST", url, json=body) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            payload = json.loads(line[len("data: "):])
+            if "timings" in payload:  # event: done
+                break
+            if "error" in payload:
+                raise RuntimeError(payload["error"])
+            if payload.get("token"):
+                tokens += 1
+                if first_token is None:
+                    first_token = time.perf_counter()
+    ended = time.perf_counter()
+    return {
+        "start": started - t_start,
+        "ttft": (first_token - started) if first_token else None,
+        "duration": ended - started,
+        "end": ended - t_start,
+        "tokens": tokens,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Concurrent SSE load test")
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("-n", "--concurrency", type=int, default=10)
+    parser.add_argument("--question", default="What was the revenue in Q4 2025?")
+    parser.add_argument("--company", default=None)
+    parser.add_argument("--year", type=int, default=None)
+    args = parser.parse_args()
+
+    url = f"{args.url.rstrip('/')}/api/v1/query/stream"
+    body = {"question": args.question, "top_k": 5, "company": args.company, "year": args.year}
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=300, limits=limits) as client:
+        t_start = time.perf_counter()
+        results = await asyncio.gather(
+            *(one_request(client, url, body, t_start) for _ in range(args.concurrency)),
+            return_exceptions=True,
+        )
+        wall = time.perf_counter() - t_start
+
+    ok = [r for r in results if isinstance(r, dict)]
+    failed = [r for r in results if not isinstance(r, dict)]
+    for i, r in enumerate(ok, 1):
+        ttft = f"{r['ttft']:.2f}s" if r["ttft"] is not None else "-"
+        print(f"  #{i:<3} start={r['start']:.2f}s ttft={ttft:<7} end={r['end']:.2f}s tokens={r['tokens']}")
+    for e in failed:
+        print(f"  FAILED: {e}")
+
+    if not ok:
+        return
+    durations = [r["duration"] for r in ok]
+    ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+    print(f"\nRequests: {len(ok)} ok, {len(failed)} failed, wall time {wall:.2f}s")
+    print(f"Duration p50={statistics.median(durations):.2f}s max={max(durations):.2f}s")
+    if ttfts:
+        print(f"TTFT     p50={statistics.median(ttfts):.2f}s max={max(ttfts):.2f}s")
+    print(f"Overlap factor: {sum(durations) / wall:.2f} (1 = serialized, {len(ok)} = fully concurrent)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
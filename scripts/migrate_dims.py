@@ -0,0 +1,180 @@
+"""
+Re-project vectors đã lưu trong Qdrant sang số chiều nhỏ hơn (Matryoshka: truncate + renormalize),
+không gọi lại OpenAI API. Chạy sau khi đổi EMBEDDING_DIM trong .env.
+
+--rebuild: copy sang schema hiện tại kể cả khi số chiều không đổi, tính lại BM25 sparse
+vectors từ content (bắt buộc khi nâng collections cũ lên hybrid search, schema v3).
+
+Usage:
+    python scripts/migrate_dims.py --dim 512 --dry-run
+    python scripts/migrate_dims.py --dim 512
+    python scripts/migrate_dims.py --dim 512 --collections text_chunks
+    python scripts/migrate_dims.py --rebuild
+
+Flow mỗi collection (API/worker luôn truy cập qua tên `<name>`, không bao giờ thấy collection rỗng):
+    1. Copy + re-project sang collection mới `<name>_v<N>` (schema mới)
+    2. Kiểm tra số points khớp
+    3. Trỏ alias `<name>` sang `<name>_v<N>` (1 request đổi alias, atomic)
+    4. Xoá collection cũ (--keep-old để giữ lại rollback)
+
+Lần đầu `<name>` còn là collection thật (alias không được trùng tên collection) → bước 3 phải
+xoá nó rồi tạo alias ngay sau đó; chỉ 1 khoảng rất ngắn không có collection, dữ liệu đã nằm
+đủ trong `<name>_v<N>`. Script dừng giữa chừng → chạy lại: `<name>` mất nhưng `<name>_v<N>`
+còn thì chỉ tạo lại alias.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qdrant_client import QdrantClient
+from qdrant_client.models import CreateAlias, CreateAliasOperation, DeleteAlias, DeleteAliasOperation, PointStruct
+
+from backend.app.config import get_settings
+from backend.app.core.retrieval.embedder import shorten_embedding
+from backend.app.core.retrieval.qdrant_client import QdrantClientWrapper
+from backend.app.core.retrieval.schema import SPARSE_VECTOR, SchemaManager
+from backend.app.core.retrieval.sparse_encoder import SparseEncoder
+
+settings = get_settings()
+
+
+def to_point(point, dim: int, sparse_encoder) -> PointStruct:
+    dense = point.vector[""] if isinstance(point.vector, dict) else point.vector
+    vector = shorten_embedding(dense, dim)
+    if sparse_encoder is not None:
+        vector = {"": vector, SPARSE_VECTOR: sparse_encoder.encode_document(point.payload.get("content") or "")}
+    return PointStruct(id=point.id, vector=vector, payload=point.payload)
+
+
+def copy_points(client: QdrantClient, src: str, dst: str, dim: int, batch_size: int, sparse_encoder=None) -> int:
+    copied = 0
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=src,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        if points:
+            client.upsert(
+                collection_name=dst,
+                points=[to_point(p, dim, sparse_encoder) for p in points],
+                wait=offset is None,  # batch cuối làm barrier
+            )
+            copied += len(points)
+            print(f"\r  {src} → {dst}: {copied} points", end="", flush=True)
+        if offset is None:
+            if copied:
+                print()
+            return copied
+
+
+def version_names(client: QdrantClient, name: str):
+    """Các collection `<name>_v<N>` đã build, theo N tăng dần."""
+    pattern = re.compile(rf"^{re.escape(name)}_v(\d+)$")
+    found = [
+        (int(match.group(1)), col.name)
+        for col in client.get_collections().collections
+        if (match := pattern.match(col.name))
+    ]
+    return [col for _, col in sorted(found)]
+
+
+def next_version_name(client: QdrantClient, name: str) -> str:
+    built = version_names(client, name)
+    return f"{name}_v{int(built[-1].rsplit('_v', 1)[1]) + 1 if built else 1}"
+
+
+def swap_alias(client: QdrantClient, schema: SchemaManager, name: str, target: str):
+    """Trỏ alias `name` sang `target`. Trả về collection thật cũ (None nếu lần đầu)."""
+    aliases = schema.aliases()
+    if name in aliases:
+        old = aliases[name]
+        # Delete + create trong cùng 1 request → Qdrant đổi alias atomically
+        client.update_collection_aliases(change_aliases_operations=[
+            DeleteAliasOperation(delete_alias=DeleteAlias(alias_name=name)),
+            CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=name)),
+        ])
+        return old
+
+    if client.collection_exists(name):
+        # Collection thật cùng tên → phải xoá trước khi tạo alias (dữ liệu đã nằm đủ trong target)
+        schema.drop(name)
+    client.update_collection_aliases(change_aliases_operations=[
+        CreateAliasOperation(create_alias=CreateAlias(collection_name=target, alias_name=name)),
+    ])
+    return None
+
+
+def migrate_collection(client: QdrantClient, schema: SchemaManager, name: str, args) -> None:
+    if not client.collection_exists(name) and name not in schema.aliases():
+        # Lần chạy trước dừng sau khi xoá collection gốc, trước khi tạo alias
+        built = version_names(client, name)
+        if not built:
+            raise SystemExit(f"[{name}] does not exist")
+        target = built[-1]
+        print(f"[{name}] missing, restoring alias → {target}")
+        if not args.dry_run:
+            swap_alias(client, schema, name, target)
+        return
+
+    size = client.get_collection(name).config.params.vectors.size
+    count = client.count(collection_name=name, exact=True).count
+    if size == args.dim and not args.rebuild:
+        print(f"[{name}] already {size}-d, skipping (use --rebuild to rebuild anyway)")
+        return
+    if size < args.dim:
+        raise SystemExit(f"[{name}] is {size}-d; cannot re-project up to {args.dim}-d, re-ingest instead")
+
+    target = next_version_name(client, name)
+    print(f"[{name}] {count} points: {size}-d → {args.dim}-d into {target}")
+    if args.dry_run:
+        return
+
+    schema.create(target)
+    sparse_encoder = SparseEncoder() if schema.hybrid else None
+    t0 = time.perf_counter()
+    copied = copy_points(client, name, target, args.dim, args.batch_size, sparse_encoder)
+    if client.count(collection_name=target, exact=True).count != count:
+        raise SystemExit(f"[{name}] point count mismatch after copy, alias left untouched ({target} kept)")
+
+    old = swap_alias(client, schema, name, target)
+    if old is not None:
+        if args.keep_old:
+            print(f"[{name}] previous collection {old} kept for rollback")
+        else:
+            schema.drop(old)
+    print(f"[{name}] migrated {copied} points in {time.perf_counter() - t0:.1f}s, alias {name} → {target}")
+
+
+def main():
+    qdrant = QdrantClientWrapper()
+    default_collections = [qdrant.TEXT_COLLECTION, qdrant.TABLE_COLLECTION, qdrant.IMAGE_COLLECTION]
+
+    parser = argparse.ArgumentParser(description="Re-project stored vectors to a smaller embedding dimension")
+    parser.add_argument("--dim", type=int, default=settings.embedding_dim, help="Target dimension (default: EMBEDDING_DIM)")
+    parser.add_argument("--collections", nargs="+", default=default_collections)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Rebuild into the current schema even if the dimension is unchanged (recomputes BM25 sparse vectors)")
+    parser.add_argument("--dry-run", action="store_true", help="Only show what would be migrated")
+    parser.add_argument("--keep-old", action="store_true", help="Keep the previous collection behind the alias for rollback")
+    args = parser.parse_args()
+
+    if args.dim != settings.embedding_dim:
+        print(f"Warning: EMBEDDING_DIM={settings.embedding_dim} but migrating to {args.dim}; "
+              f"update .env before restarting the API/worker.")
+
+    schema = SchemaManager(qdrant.client, embedding_dim=args.dim)
+    for name in args.collections:
+        migrate_collection(qdrant.client, schema, name, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Inspect / purge on-disk LlamaParse cache (ParseCache).
+Usage:
+    python scripts/parse_cache.py stats
+    python scripts/parse_cache.py list
+    python scripts/parse_cache.py purge                  # xoá toàn bộ
+    python scripts/parse_cache.py purge --older-than 7   # xoá entries không dùng > 7 ngày
+    python scripts/parse_cache.py purge --key <key>
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.app.core.ingestion.parse_cache import ParseCache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the LlamaParse parse cache")
+    parser.add_argument("--dir", help="Cache directory (default: settings.parse_cache_dir)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("stats", help="Show size and hit/miss counters")
+    sub.add_parser("list", help="List entries, most recently used first")
+
+    purge = sub.add_parser("purge", help="Delete entries")
+    purge.add_argument("--key", help="Delete a single entry")
+    purge.add_argument("--older-than", type=float, metavar="DAYS", help="Only entries unused for DAYS days")
+    purge.add_argument("--reset-stats", action="store_true", help="Also reset hit/miss counters")
+
+    args = parser.parse_args()
+    cache = ParseCache(cache_dir=args.dir)
+
+    if args.command == "stats":
+        print(json.dumps(cache.stats(), indent=2))
+
+    elif args.command == "list":
+        for entry in cache.entries():
+            last_used = datetime.fromtimestamp(entry["last_used"]).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"{entry['key']}  {entry['size_bytes'] / 1024:10.1f} KB  {last_used}")
+
+    elif args.command == "purge":
+        if args.key:
+            removed = int(cache.delete(args.key))
+        else:
+            older_than = args.older_than * 86400 if args.older_than is not None else None
+            removed = cache.purge(older_than_seconds=older_than)
+        if args.reset_stats:
+            cache.reset_stats()
+        print(f"Removed {removed} entries")
+
+
+if __name__ == "__main__":
+    main()